@@ -1,5 +1,5 @@
 apt-get -qqy update
-apt-get -qqy install postgresql python-psycopg2
+apt-get -qqy install postgresql python-psycopg2 python-numpy python-gevent
 apt-get -qqy install python-flask python-sqlalchemy
 apt-get -qqy install python-pip
 pip install bleach
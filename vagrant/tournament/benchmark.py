@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+#
+# benchmark.py -- latency measurements for tournament.py
+#
+# Seeds the database with tournaments of increasing size and times the public
+# functions on each of them. It wipes the configured database, just like
+# tournament_test.py.
+#
+# usage: python tournament/benchmark.py [--sizes 100,1000] [--calls 200]
+#                                       [--output results.json]
+#                                       [--compare previous.json]
+#        python tournament/benchmark.py --pool [--calls 1000]
+#        python tournament/benchmark.py --prepared [--calls 1000]
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import db
+import swiss
+from tournament import *
+
+SIZES = [100, 1000, 10000, 100000]
+
+# Timings more than this much slower than the compared run are regressions.
+REGRESSION_THRESHOLD = 0.2
+
+
+def measure(fn, calls):
+    """Runs `fn` `calls` times and returns the latency of each call (ms)."""
+    timings = []
+    for _ in xrange(calls):
+        start = time.time()
+        fn()
+        timings.append((time.time() - start) * 1000)
+    return timings
+
+
+def percentile(timings, p):
+    ordered = sorted(timings)
+    idx = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def summarize(timings):
+    """Returns the latency percentiles (ms) and throughput (calls/s)."""
+    total = sum(timings)
+    return {
+        'calls': len(timings),
+        'mean': total / len(timings),
+        'p50': percentile(timings, 50),
+        'p95': percentile(timings, 95),
+        'p99': percentile(timings, 99),
+        'throughput': len(timings) / (total / 1000) if total else None,
+    }
+
+
+def report(label, timings):
+    print "%-24s mean %7.3fms  p50 %7.3fms  p95 %7.3fms  p99 %7.3fms" % (
+        label,
+        sum(timings) / len(timings),
+        percentile(timings, 50),
+        percentile(timings, 95),
+        percentile(timings, 99))
+
+
+def unpooled_count_all_players():
+    """`count_all_players` as before pooling: one connection per call."""
+    conn = connect()
+    cr = conn.cursor()
+    cr.execute("select count(*) from players")
+    cr.fetchone()
+    conn.commit()
+    cr.close()
+    conn.close()
+
+
+def bench_pool(calls):
+    """Per-call latency with a fresh connection vs a pooled connection."""
+    report("connect() per call", measure(unpooled_count_all_players, calls))
+    db.get_pool()
+    report("pooled new_transaction", measure(count_all_players, calls))
+
+
+def planning_time(cr, query, params):
+    """Returns the time (ms) PostgreSQL spends planning a query."""
+    cr.execute("explain (analyze, format json) " + query, params)
+    plan = cr.fetchone()[0]
+    if isinstance(plan, basestring):
+        plan = json.loads(plan)
+    return plan[0]["Planning Time"]
+
+
+def bench_prepared(calls, players=1000):
+    """Planning time and latency with and without prepared statements."""
+    tid, rounds = seed(players)
+    queries = [
+        ("player_standings", STANDINGS_QUERY + " limit %s", (tid, None)),
+        ("tournament_status", "select * from tournament_status where id = %s",
+         (tid,)),
+        ("count_players", COUNT_PLAYERS_QUERY, (tid,)),
+    ]
+    with new_transaction() as cr:
+        for (name, query, params) in queries:
+            planned = [planning_time(cr, query, params) for _ in xrange(10)]
+            # Prepared statements switch to a cached generic plan after
+            # five executions.
+            for _ in xrange(10):
+                db.execute_prepared(cr, name, query, params)
+            sql = "execute %s (%s)" % (name, ", ".join(["%s"] * len(params)))
+            cached = [planning_time(cr, sql, params) for _ in xrange(10)]
+            print "%-24s planning %7.3fms -> %7.3fms" % (
+                name, sum(planned) / 10, sum(cached) / 10)
+
+    ids = [row[0] for row in player_standings(tid)]
+
+    def random_match():
+        winner, loser = random.sample(ids, 2)
+        report_match(tid, winner, loser)
+
+    # Reported matches change what the reads return, they are measured last.
+    for (name, fn) in [("player_standings", lambda: player_standings(tid)),
+                       ("count_players", lambda: count_players(tid)),
+                       ("report_match", random_match)]:
+        for prepare in (False, True):
+            db.configure(prepare=prepare)
+            measure(fn, 10)
+            report("%s %s" % (name, "prepared" if prepare else "unprepared"),
+                   measure(fn, calls))
+
+
+def wipe():
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+
+def seed_matches(tournament, rounds):
+    """Plays `rounds` rounds in a tournament, straight in SQL.
+
+    In round r each player meets the player whose position in the tournament
+    xor r gives their own, so nobody meets the same opponent twice.
+    """
+    with new_transaction() as cr:
+        # Standings are rebuilt once at the end instead of row by row.
+        cr.execute("alter table matches disable trigger matches_standings")
+        cr.execute("""
+            with numbered as (
+                select player,
+                       row_number() over (order by player) - 1 as rn
+                  from tournament_players
+                 where tournament = %(t)s )
+            insert into matches
+                ( tournament, round, player, opponent, won, points )
+            select %(t)s, r, a.player, b.player, won, won * r
+              from numbered a
+             cross join generate_series(1, %(rounds)s) r
+              join numbered b
+                on b.rn = a.rn # r::bigint
+             cross join lateral (
+                 select ((a.rn < b.rn) <>
+                         ((least(a.rn, b.rn) + r) %% 2 = 0))::integer as won
+             ) result
+        """, {'t': tournament, 'rounds': rounds})
+        cr.execute("alter table matches enable trigger matches_standings")
+        cr.execute("select rebuild_standings(%s)", (tournament,))
+
+
+def seed(players):
+    """Creates a tournament with `players` players halfway through.
+
+    Returns:
+        A tuple (tournament id, rounds played).
+    """
+    wipe()
+    rounds = max(1, swiss.min_rounds(players) // 2)
+    with new_transaction() as cr:
+        cr.execute("""
+            insert into players ( name )
+            select 'Player ' || i from generate_series(1, %s) i
+        """, (players,))
+        cr.execute("""
+            insert into tournaments ( name ) values ( 'Benchmark' )
+            returning id
+        """)
+        tid = cr.fetchone()[0]
+        cr.execute("""
+            insert into tournament_players
+            select %s, id from players
+        """, (tid,))
+    seed_matches(tid, rounds)
+    with new_transaction() as cr:
+        cr.execute("analyze")
+    return tid, rounds
+
+
+def bench_size(players, calls):
+    """Times every public function on a tournament of `players` players.
+
+    Returns:
+        A dict of function name to its summarized timings.
+    """
+    tid, rounds = seed(players)
+    ids = [row[0] for row in player_standings(tid)]
+
+    def random_match():
+        winner, loser = random.sample(ids, 2)
+        report_match(tid, winner, loser)
+
+    # Slow calls on large tournaments are measured less often.
+    heavy_calls = max(3, calls * 1000 // max(players, 1000))
+    timings = {
+        'count_all_players': measure(count_all_players, calls),
+        'count_players': measure(lambda: count_players(tid), calls),
+        'player_standings': measure(lambda: player_standings(tid),
+                                    heavy_calls),
+        'player_standings_tiebreaks': measure(
+            lambda: player_standings(tid, tiebreak=swiss.TIEBREAKS),
+            heavy_calls),
+        'player_standings_as_of_round': measure(
+            lambda: player_standings(tid, as_of_round=rounds // 2 + 1),
+            heavy_calls),
+        'player_history': measure(lambda: player_history(tid, ids[0]),
+                                  calls),
+        'swiss_pairings': measure(lambda: swiss_pairings(tid), heavy_calls),
+        'player_standings_many': measure(
+            lambda: player_standings_many([tid]), heavy_calls),
+        'swiss_pairings_many': measure(lambda: swiss_pairings_many([tid]),
+                                       heavy_calls),
+        'report_winner': measure(lambda: report_winner(tid), calls),
+        'report_match': measure(random_match, calls),
+        'rebuild_ratings': measure(rebuild_ratings, 3),
+    }
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "benchmark.tcol")
+        timings['export_tournament'] = measure(
+            lambda: export_tournament(tid, path), 3)
+        timings['import_tournament'] = measure(
+            lambda: import_tournament(path), 3)
+    finally:
+        shutil.rmtree(directory)
+
+    timings['delete_matches'] = []
+    for _ in xrange(3):
+        seed_matches(tid, rounds)
+        timings['delete_matches'].extend(
+            measure(lambda: delete_matches(tid), 1))
+    seed_matches(tid, rounds)
+    timings['delete_all_matches'] = measure(delete_all_matches, 1)
+    timings['delete_players'] = measure(lambda: delete_players(tid), 1)
+    timings['delete_tournaments'] = measure(delete_tournaments, 1)
+    timings['delete_all_players'] = measure(delete_all_players, 1)
+
+    results = {}
+    for name, values in sorted(timings.items()):
+        results[name] = summarize(values)
+        report("%s (%s)" % (name, players), values)
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"]).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    """Prints the p50 change of every timing and returns the regressions."""
+    regressions = []
+    for size, results in sorted(current['results'].items(),
+                                key=lambda item: int(item[0])):
+        for name, stats in sorted(results.items()):
+            try:
+                before = previous['results'][size][name]['p50']
+            except KeyError:
+                continue
+            change = (stats['p50'] - before) / before if before else 0
+            flag = ""
+            if change > REGRESSION_THRESHOLD:
+                flag = "  REGRESSION"
+                regressions.append((size, name, change))
+            print "%-24s %7s  p50 %8.3fms -> %8.3fms  %+6.1f%%%s" % (
+                name, size, before, stats['p50'], change * 100, flag)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default=",".join(str(s) for s in SIZES),
+                        help="comma separated numbers of players")
+    parser.add_argument("--calls", type=int, default=200,
+                        help="calls per function and size")
+    parser.add_argument("--output", default="benchmark-results.json",
+                        help="where to write the results")
+    parser.add_argument("--compare",
+                        help="results of a previous run to compare with")
+    parser.add_argument("--pool", action="store_true",
+                        help="only compare pooled and unpooled connections")
+    parser.add_argument("--prepared", action="store_true",
+                        help="only compare prepared and unprepared queries")
+    args = parser.parse_args()
+
+    if args.pool:
+        bench_pool(args.calls)
+        return 0
+    if args.prepared:
+        bench_prepared(args.calls)
+        return 0
+
+    results = {
+        'commit': current_commit(),
+        'timestamp': time.time(),
+        'calls': args.calls,
+        'results': {},
+    }
+    for players in [int(s) for s in args.sizes.split(",")]:
+        results['results'][str(players)] = bench_size(players, args.calls)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print "Results written to %s" % args.output
+
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(json.load(f), results):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
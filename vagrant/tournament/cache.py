@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#
+# cache.py -- opt-in in-process cache for tournament.py reads
+#
+# Reads are cached per tournament and keyed by the tournament's version,
+# which is bumped by every function of tournament.py that changes it, so a
+# cached value is never served after a change made through this process.
+# Changes made by other processes are not seen, only enable the cache where
+# a single process writes to the tournaments it reads. While it is enabled,
+# reads go to the primary rather than to read replicas, which could return
+# results from before a change and have them cached under the new version.
+#
+# Reads that rank players by rating (see `swiss.RATING`) depend on the
+# matches of every tournament, they are keyed by a version that changes with
+# any tournament.
+#
+# Example:
+#     cache.enable(maxsize=4096)
+#     player_standings(tid)   # queries the database
+#     player_standings(tid)   # served from the cache
+#     cache.info()            # {'hits': 1, 'misses': 1, ...}
+
+import collections
+import functools
+import inspect
+import threading
+
+import swiss
+
+
+class ReadCache(object):
+    """A size-capped LRU cache with per-tournament versions.
+
+    Args:
+        maxsize: the maximum number of cached values.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._versions = collections.defaultdict(int)
+        self._epoch = 0
+        self._ratings = 0
+        self._lock = threading.Lock()
+
+    def key(self, name, tournament, args, kwargs, rated=False):
+        return (name, args, tuple(sorted(kwargs.items())),
+                self._epoch, self._versions[tournament],
+                self._ratings if rated else None)
+
+    def get(self, key):
+        """Returns (True, value) on a hit and (False, None) on a miss."""
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return False, None
+            self._entries[key] = value
+            self.hits += 1
+            return True, value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def bump(self, tournament=None):
+        """Invalidates a tournament, or everything when it is None."""
+        with self._lock:
+            if tournament is None:
+                self._epoch += 1
+            else:
+                self._versions[tournament] += 1
+                self._ratings += 1
+
+
+_cache = None
+
+
+def enable(maxsize=1024):
+    """Starts caching reads, discarding whatever was cached before."""
+    global _cache
+    _cache = ReadCache(maxsize)
+
+
+def disable():
+    """Stops caching reads."""
+    global _cache
+    _cache = None
+
+
+def enabled():
+    """Returns whether reads are cached."""
+    return _cache is not None
+
+
+def info():
+    """Returns the cache counters, or None when the cache is disabled."""
+    c = _cache
+    if c is None:
+        return None
+    return {'hits': c.hits, 'misses': c.misses,
+            'size': len(c._entries), 'maxsize': c.maxsize}
+
+
+def _tournament(args, kwargs):
+    return args[0] if args else kwargs.get('tournament')
+
+
+def _rated(fn, args, kwargs):
+    """Returns whether a call of `fn` ranks players by rating."""
+    tiebreak = inspect.getcallargs(fn, *args, **kwargs)['tiebreak']
+    return swiss.RATING in swiss.tiebreak_names(tiebreak)
+
+
+def _copy(value):
+    # Callers are free to change the lists they get back, also the ones in a
+    # tuple, like the sets of `played_pairs`.
+    if isinstance(value, (list, set, dict)):
+        return type(value)(value)
+    if isinstance(value, tuple):
+        return tuple(_copy(item) for item in value)
+    return value
+
+
+def cached(fn):
+    """Caches a read whose first argument, if any, is the tournament id."""
+    ranks = 'tiebreak' in inspect.getargspec(fn).args
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        c = _cache
+        if c is None:
+            return fn(*args, **kwargs)
+        rated = ranks and _rated(fn, args, kwargs)
+        key = c.key(fn.__name__, _tournament(args, kwargs), args, kwargs,
+                    rated)
+        try:
+            hash(key)
+        except TypeError:
+            # Arguments like lists can't be part of a key.
+            return fn(*args, **kwargs)
+        hit, value = c.get(key)
+        if not hit:
+            value = fn(*args, **kwargs)
+            c.put(key, value)
+        return _copy(value)
+    return wrapper
+
+
+def invalidates(fn):
+    """Bumps the version of the tournament a function changes.
+
+    The tournament is the first argument, when there is none (or it is None)
+    everything is invalidated.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            c = _cache
+            if c is not None:
+                c.bump(_tournament(args, kwargs))
+    return wrapper
+
+
+def invalidates_all(fn):
+    """Invalidates every cached value after a function runs."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            c = _cache
+            if c is not None:
+                c.bump()
+    return wrapper
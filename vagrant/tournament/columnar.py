@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+#
+# columnar.py -- compact columnar files of whole tournaments
+#
+# `tournament.export_tournament` streams the players and the matches of a
+# tournament out of PostgreSQL with binary COPY into a file of fixed-width
+# integer columns, plus a table of the players' names, and
+# `tournament.import_tournament` streams them back into a new tournament. The
+# file can be memory-mapped and read without a database:
+#
+#     export = columnar.load_export("contest.tcol")
+#     export.matches['points'].sum()
+#     columnar.standings(export)   # the same rows as player_standings
+#
+# Rows go through in chunks of `COPY_CHUNK_SIZE` bytes, so memory use doesn't
+# grow with the size of the tournament.
+#
+# The file starts with `EXPORT_HEADER` and is followed by these sections,
+# each one padded to 8 bytes:
+#   the tournament's name,
+#   `PLAYER_COLUMNS`, an int32 array each, ordered by player id,
+#   the offsets of each player's name in the names section, n + 1 int64,
+#   `MATCH_COLUMNS`, an int32 array each, in the order of the matches,
+#   the players' names, utf-8 encoded, one after another.
+
+import mmap
+import os
+import struct
+
+import numpy
+
+EXPORT_MAGIC = "TCOLS001"
+
+# Magic, tournament, and the lengths of the tournament's name, the players,
+# the matches and the players' names.
+EXPORT_HEADER = struct.Struct("<8siiqqq")
+
+# The id of each player who is registered into the tournament or played in
+# it, and 1 if they are registered, 0 otherwise.
+PLAYER_COLUMNS = ('id', 'registered')
+
+# Each row of the matches table, one for each side of a match. NULL rounds
+# and opponents (byes) are 0, a NULL won is -1.
+MATCH_COLUMNS = ('round', 'player', 'opponent', 'won', 'points')
+
+# Bytes of COPY data decoded or encoded at once.
+COPY_CHUNK_SIZE = 1 << 20
+
+COPY_SIGNATURE = "PGCOPY\n\377\r\n\0"
+COPY_HEADER = struct.Struct(">11sii")
+COPY_TRAILER = struct.pack(">h", -1)
+
+# A binary COPY row of (id, registered, name), up to the name's bytes.
+_PLAYER_ROW = struct.Struct(">hiiiii")
+
+
+def _int4_rows(columns):
+    """Returns the dtype of binary COPY rows of non-null int4 columns."""
+    fields = [('fields', '>i2')]
+    for column in columns:
+        fields.extend([(column + '_length', '>i4'), (column, '>i4')])
+    return numpy.dtype(fields)
+
+
+_MATCH_ROW = _int4_rows(MATCH_COLUMNS)
+
+
+def _padded(size):
+    return size + (-size % 8)
+
+
+def _layout(name_length, players, matches):
+    """Returns the offset of each section of a file, by name."""
+    offsets = {}
+    offset = EXPORT_HEADER.size
+    sections = ([('name', name_length)] +
+                [(column, 4 * players) for column in PLAYER_COLUMNS] +
+                [('offsets', 8 * (players + 1))] +
+                [(column, 4 * matches) for column in MATCH_COLUMNS] +
+                [('names', 0)])
+    for (section, size) in sections:
+        offsets[section] = offset
+        offset += _padded(size)
+    return offsets
+
+
+class _CopyTarget(object):
+    """The file psycopg2 writes the data of a binary `COPY ... TO STDOUT` to.
+
+    Data is buffered until `COPY_CHUNK_SIZE` bytes arrived, and the whole rows
+    in it are then decoded by `_rows`, which returns where it stopped.
+    """
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+        self._header = True
+
+    def write(self, data):
+        self._chunks.append(data)
+        self._size += len(data)
+        if self._size >= COPY_CHUNK_SIZE:
+            self._feed()
+
+    def close(self):
+        self._feed()
+        if "".join(self._chunks) != COPY_TRAILER:
+            raise ValueError("The COPY data ended in the middle of a row")
+
+    def _feed(self):
+        data = "".join(self._chunks)
+        offset = 0
+        if self._header:
+            if len(data) < COPY_HEADER.size:
+                return
+            signature, flags, extension = COPY_HEADER.unpack_from(data)
+            if signature != COPY_SIGNATURE:
+                raise ValueError("Not binary COPY data")
+            offset = COPY_HEADER.size + extension
+            self._header = False
+        rest = data[self._rows(data, offset):]
+        self._chunks = [rest]
+        self._size = len(rest)
+
+    def _rows(self, data, offset):
+        raise NotImplementedError
+
+
+class _PlayersTarget(_CopyTarget):
+    def __init__(self, writer):
+        _CopyTarget.__init__(self)
+        self.writer = writer
+
+    def _rows(self, data, offset):
+        ids = []
+        registered = []
+        names = []
+        while len(data) - offset >= _PLAYER_ROW.size:
+            row = _PLAYER_ROW.unpack_from(data, offset)
+            end = offset + _PLAYER_ROW.size + row[5]
+            if end > len(data):
+                break
+            ids.append(row[2])
+            registered.append(row[4])
+            names.append(data[offset + _PLAYER_ROW.size:end])
+            offset = end
+        self.writer.write_players(ids, registered, names)
+        return offset
+
+
+class _MatchesTarget(_CopyTarget):
+    def __init__(self, writer):
+        _CopyTarget.__init__(self)
+        self.writer = writer
+
+    def _rows(self, data, offset):
+        count = (len(data) - offset) // _MATCH_ROW.itemsize
+        rows = numpy.frombuffer(data, dtype=_MATCH_ROW, count=count,
+                                offset=offset)
+        if (rows['fields'] != len(MATCH_COLUMNS)).any():
+            raise ValueError("Unexpected columns in the COPY data")
+        self.writer.write_matches(rows)
+        return offset + rows.nbytes
+
+
+class ExportWriter(object):
+    """Writes an export file from the binary COPY of its players and matches.
+
+    The numbers of players and matches must be known up front. Use it within
+    a `with` statement, the file is written under a temporary name and only
+    renamed into place when the block succeeds:
+
+        with ExportWriter(path, tournament, name, players, matches) as writer:
+            cr.copy_expert("copy (...) to stdout with (format binary)",
+                           writer.players)
+            cr.copy_expert("copy (...) to stdout with (format binary)",
+                           writer.matches)
+
+    Attributes:
+        players: the file the players' rows are copied to, as (id,
+          registered, name).
+        matches: the file the matches' rows are copied to, as the
+          `MATCH_COLUMNS`, without NULLs.
+    """
+    def __init__(self, path, tournament, name, players, matches):
+        self.path = path
+        self.name = _utf8(name)
+        self.counts = {'players': players, 'matches': matches}
+        self.written = {'players': 0, 'matches': 0, 'names': 0}
+        self.layout = _layout(len(self.name), players, matches)
+        self.players = _PlayersTarget(self)
+        self.matches = _MatchesTarget(self)
+        self.temporary = path + ".tmp"
+        self.file = open(self.temporary, "wb")
+        self.file.write(EXPORT_HEADER.pack(EXPORT_MAGIC, tournament,
+                                           len(self.name), players, matches,
+                                           0))
+        self._write_at('name', 0, self.name)
+        self._write_at('offsets', 0, struct.pack("<q", 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        try:
+            if type is None:
+                self._finish()
+        finally:
+            self.file.close()
+            if os.path.exists(self.temporary):
+                os.remove(self.temporary)
+
+    def _write_at(self, section, position, data):
+        self.file.seek(self.layout[section] + position)
+        self.file.write(data)
+
+    def write_players(self, ids, registered, names):
+        start = self.written['players']
+        if start + len(ids) > self.counts['players']:
+            raise ValueError("More players than counted")
+        self._write_at('id', 4 * start,
+                       numpy.array(ids, dtype='<i4').tostring())
+        self._write_at('registered', 4 * start,
+                       numpy.array(registered, dtype='<i4').tostring())
+        ends = (self.written['names'] +
+                numpy.cumsum([len(name) for name in names], dtype='<i8'))
+        self._write_at('offsets', 8 * (start + 1), ends.tostring())
+        self._write_at('names', self.written['names'], "".join(names))
+        self.written['players'] += len(ids)
+        if len(ends):
+            self.written['names'] = int(ends[-1])
+
+    def write_matches(self, rows):
+        start = self.written['matches']
+        if start + len(rows) > self.counts['matches']:
+            raise ValueError("More matches than counted")
+        for column in MATCH_COLUMNS:
+            self._write_at(column, 4 * start,
+                           rows[column].astype('<i4').tostring())
+        self.written['matches'] += len(rows)
+
+    def _finish(self):
+        self.players.close()
+        self.matches.close()
+        for table in ('players', 'matches'):
+            if self.written[table] != self.counts[table]:
+                raise ValueError("Expected %s %s, got %s"
+                                 % (self.counts[table], table,
+                                    self.written[table]))
+        # The padding of the names section, and its length in the header.
+        self._write_at('names', self.written['names'],
+                       "\0" * (-self.written['names'] % 8))
+        self.file.seek(EXPORT_HEADER.size - 8)
+        self.file.write(struct.pack("<q", self.written['names']))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.rename(self.temporary, self.path)
+
+
+def _utf8(name):
+    if isinstance(name, unicode):
+        return name.encode('utf-8')
+    return name
+
+
+class TournamentExport(object):
+    """A tournament read from an export file.
+
+    Attributes:
+        tournament: the id the tournament had in the database it was
+          exported from.
+        name: the tournament's name.
+        players: a dict of `PLAYER_COLUMNS` to arrays.
+        matches: a dict of `MATCH_COLUMNS` to arrays.
+
+    Arrays are read-only views of the mapped file.
+    """
+    def __init__(self, data, tournament, name, players, matches, offsets,
+                 names):
+        self._data = data
+        self.tournament = tournament
+        self.name = name
+        self.players = players
+        self.matches = matches
+        self._offsets = offsets
+        self._names = names
+
+    def __len__(self):
+        return len(self.players['id'])
+
+    def player_name(self, index):
+        """Returns the name of the player at an index of `players`."""
+        begin, end = self._offsets[index:index + 2].tolist()
+        return self._data[self._names + begin:self._names + end]
+
+    def player_names(self):
+        """Returns the names of every player, in the order of `players`."""
+        offsets = self._offsets.tolist()
+        start = self._names
+        return [self._data[start + begin:start + end]
+                for (begin, end) in zip(offsets[:-1], offsets[1:])]
+
+
+def load_export(path):
+    """Maps an export file into memory.
+
+    Raises:
+        ValueError: if the file is not an export.
+    """
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    (magic, tournament, name_length, players, matches,
+     names_length) = EXPORT_HEADER.unpack_from(data)
+    if magic != EXPORT_MAGIC:
+        raise ValueError("%s is not a tournament export" % path)
+    layout = _layout(name_length, players, matches)
+
+    def column(section, count, dtype='<i4'):
+        return numpy.frombuffer(data, dtype=dtype, count=count,
+                                offset=layout[section])
+
+    name = data[layout['name']:layout['name'] + name_length]
+    return TournamentExport(
+        data, tournament, name,
+        dict((c, column(c, players)) for c in PLAYER_COLUMNS),
+        dict((c, column(c, matches)) for c in MATCH_COLUMNS),
+        column('offsets', players + 1, '<i8'), layout['names'])
+
+
+def standings(export, as_of_round=None):
+    """Computes the standings of an exported tournament.
+
+    Args:
+        export: a `TournamentExport`.
+        as_of_round: only count the matches up to this round.
+
+    Returns:
+        The same list of (id, name, wins, matches) as
+        `tournament.player_standings`, ranked by wins and then points.
+    """
+    players = export.players['id']
+    matches = export.matches
+    counted = matches['won'] >= 0
+    if as_of_round is not None:
+        counted &= (matches['round'] > 0) & (matches['round'] <= as_of_round)
+    # Players are sorted by id, so each match's player is found by bisection.
+    index = numpy.searchsorted(players, matches['player'][counted])
+    wins = numpy.bincount(index, weights=matches['won'][counted],
+                          minlength=len(players))
+    played = numpy.bincount(index, minlength=len(players))
+    points = numpy.bincount(index, weights=matches['points'][counted],
+                            minlength=len(players))
+    registered = numpy.flatnonzero(export.players['registered'])
+    ranked = registered[numpy.lexsort((players[registered],
+                                       -points[registered],
+                                       -wins[registered]))]
+    return [(int(players[i]), export.player_name(i), int(wins[i]),
+             int(played[i]))
+            for i in ranked]
+
+
+class _CopySource(object):
+    """The file psycopg2 reads the data of a `COPY ... FROM STDIN` from.
+
+    Reads the chunks of a generator, `size` bytes at a time.
+    """
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ""
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _copy_data(rows):
+    yield COPY_HEADER.pack(COPY_SIGNATURE, 0, 0)
+    for chunk in rows:
+        yield chunk
+    yield COPY_TRAILER
+
+
+def copy_players(export):
+    """Returns a file of the binary COPY data of the players of an export.
+
+    The rows are (id, registered, name).
+    """
+    def rows():
+        ids = export.players['id'].tolist()
+        registered = export.players['registered'].tolist()
+        chunk = []
+        size = 0
+        for (i, name) in enumerate(export.player_names()):
+            chunk.append(_PLAYER_ROW.pack(3, 4, ids[i], 4, registered[i],
+                                          len(name)) + name)
+            size += _PLAYER_ROW.size + len(name)
+            if size >= COPY_CHUNK_SIZE:
+                yield "".join(chunk)
+                chunk = []
+                size = 0
+        yield "".join(chunk)
+    return _CopySource(_copy_data(rows()))
+
+
+def copy_matches(export):
+    """Returns a file of the binary COPY data of the matches of an export.
+
+    The rows are the `MATCH_COLUMNS`, without NULLs.
+    """
+    def rows():
+        count = len(export.matches['round'])
+        step = COPY_CHUNK_SIZE // _MATCH_ROW.itemsize
+        for start in xrange(0, count, step):
+            chunk = numpy.empty(min(step, count - start), dtype=_MATCH_ROW)
+            chunk['fields'] = len(MATCH_COLUMNS)
+            for column in MATCH_COLUMNS:
+                chunk[column + '_length'] = 4
+                chunk[column] = export.matches[column][start:start + step]
+            yield chunk.tostring()
+    return _CopySource(_copy_data(rows()))
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+#
+# db.py -- database configuration and connection pooling
+#
+
+import collections
+import itertools
+import os
+import re
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+
+# Connection settings. They are read from the environment when the module is
+# loaded and can be changed at runtime with `configure`.
+#
+# `replicas` are the connection strings of read replicas, separated by `;` in
+# the environment. Read-only transactions go to them in turn, see
+# `getconn_for_read`. After this process commits a write its reads go to the
+# primary for `read_your_writes` seconds, so they see that write even if the
+# replicas lag behind.
+config = {
+    'dsn': os.environ.get('TOURNAMENT_DSN', 'dbname=tournament'),
+    'minconn': int(os.environ.get('TOURNAMENT_POOL_MIN', 1)),
+    'maxconn': int(os.environ.get('TOURNAMENT_POOL_MAX', 10)),
+    'ping_interval': float(os.environ.get('TOURNAMENT_POOL_PING', 30)),
+    'prepare': os.environ.get('TOURNAMENT_PREPARE', '1') != '0',
+    'replicas': [dsn.strip() for dsn
+                 in os.environ.get('TOURNAMENT_REPLICA_DSNS', '').split(';')
+                 if dsn.strip()],
+    'read_your_writes': float(os.environ.get('TOURNAMENT_READ_YOUR_WRITES',
+                                             0)),
+}
+
+# Seconds a replica that refused a connection is left out of the rotation.
+REPLICA_RETRY_INTERVAL = 10
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# (pid, pools) of the replicas, see `get_replica_pools`.
+_replica_pools = None
+_replica_turn = itertools.count()
+# Replica connection string to the time it can be tried again.
+_replica_down = {}
+# When this process last committed a write.
+_last_write = 0
+
+
+class Connection(psycopg2.extensions.connection):
+    """A connection that remembers the statements prepared on it.
+
+    Prepared statements live as long as the server session, a new connection
+    starts with none and prepares them again as they are used.
+    """
+    def __init__(self, *args, **kwargs):
+        super(Connection, self).__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class ConnectionPool(object):
+    """A thread-safe pool of PostgreSQL connections.
+
+    At most `maxconn` connections are open at the same time, callers asking
+    for a connection when all of them are in use will block until one is
+    given back. Idle connections are checked before being handed out and
+    are replaced when they are broken.
+
+    Args:
+        dsn: the connection string.
+        minconn: how many connections are opened up front.
+        maxconn: the maximum number of open connections.
+        ping_interval: idle connections older than this (in seconds) are
+          pinged with a `select 1` before being handed out.
+    """
+    def __init__(self, dsn, minconn=1, maxconn=10, ping_interval=30):
+        if maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: %s..%s" % (minconn, maxconn))
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.ping_interval = ping_interval
+        self.closed = False
+        self.pid = os.getpid()
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+        self._slots = self._make_slots(maxconn)
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.time()))
+
+    def _make_slots(self, maxconn):
+        return threading.BoundedSemaphore(maxconn)
+
+    def _connect(self):
+        return psycopg2.connect(self.dsn, connection_factory=Connection)
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        status = conn.get_transaction_status()
+        if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.time() - last_used < self.ping_interval:
+            return True
+        try:
+            cr = conn.cursor()
+            cr.execute("select 1")
+            cr.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        """Borrow a connection from the pool, opening one if needed."""
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    if self.closed:
+                        raise PoolError("connection pool is closed")
+                    if not self._idle:
+                        break
+                    conn, last_used = self._idle.pop()
+                if self._is_healthy(conn, last_used):
+                    return conn
+                self._discard(conn)
+            return self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        """Give a connection back to the pool.
+
+        Connections left inside a transaction are rolled back, broken ones are
+        closed instead of being kept.
+        """
+        try:
+            if not conn.closed:
+                status = conn.get_transaction_status()
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    self._discard(conn)
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        self._discard(conn)
+            with self._lock:
+                if self.closed or conn.closed:
+                    self._discard(conn)
+                else:
+                    self._idle.append((conn, time.time()))
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        """Close every idle connection and refuse any further checkout."""
+        with self._lock:
+            self.closed = True
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+
+
+# The class of the pool created by `get_pool`.
+pool_class = ConnectionPool
+
+
+def configure(**options):
+    """Change the connection settings.
+
+    The current pool is closed and a new one will be created with the new
+    settings on the next checkout.
+
+    Example:
+        configure(dsn="dbname=tournament host=db", maxconn=20)
+    """
+    global _pool, _replica_pools
+    unknown = set(options) - set(config)
+    if unknown:
+        raise ValueError("Unknown settings: %s" % ", ".join(sorted(unknown)))
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.closeall()
+        if _replica_pools is not None and _replica_pools[0] == os.getpid():
+            for pool in _replica_pools[1]:
+                pool.closeall()
+        _pool = None
+        _replica_pools = None
+        _replica_down.clear()
+        config.update(options)
+
+
+def get_pool():
+    """Returns the process-wide connection pool, creating it if needed."""
+    global _pool
+    with _pool_lock:
+        # Connections can't be shared with a forked child, the child gets a
+        # pool of its own and leaves the parent's connections untouched.
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = pool_class(config['dsn'],
+                               config['minconn'],
+                               config['maxconn'],
+                               config['ping_interval'])
+        return _pool
+
+
+def get_replica_pools():
+    """Returns the pools of the replicas, creating them if needed.
+
+    They open no connection up front, a replica that is down doesn't keep
+    the others from being used.
+    """
+    global _replica_pools
+    with _pool_lock:
+        if _replica_pools is None or _replica_pools[0] != os.getpid():
+            _replica_pools = (os.getpid(),
+                              [pool_class(dsn, 0, config['maxconn'],
+                                          config['ping_interval'])
+                               for dsn in config['replicas']])
+        return _replica_pools[1]
+
+
+def getconn_for_read():
+    """Borrows a connection for a read-only transaction.
+
+    Replicas are tried in turn, starting with the one after the replica used
+    by the previous read. A replica that refuses the connection is skipped
+    for `REPLICA_RETRY_INTERVAL` seconds. Without replicas, when none of them
+    is up or right after this process wrote, see `read_your_writes`, the
+    connection comes from the primary's pool.
+
+    Returns:
+        A tuple (pool, connection), the connection must be given back to that
+        pool.
+    """
+    pools = get_replica_pools()
+    now = time.time()
+    if pools and now - _last_write >= config['read_your_writes']:
+        start = next(_replica_turn)
+        for i in xrange(len(pools)):
+            pool = pools[(start + i) % len(pools)]
+            if _replica_down.get(pool.dsn, 0) > now:
+                continue
+            try:
+                return pool, pool.getconn()
+            except psycopg2.OperationalError:
+                _replica_down[pool.dsn] = now + REPLICA_RETRY_INTERVAL
+    pool = get_pool()
+    return pool, pool.getconn()
+
+
+def wrote():
+    """Records that this process committed a write, see `read_your_writes`."""
+    global _last_write
+    _last_write = time.time()
+
+
+_PLACEHOLDER = re.compile(r"%%|%\((\w+)\)s|%s")
+
+
+def positional(query):
+    """Rewrites the psycopg2 placeholders of a query as $1, $2...
+
+    Returns:
+        A tuple (query, names). `names` lists the parameter of each position
+        for queries with named placeholders, and is None for queries with
+        plain `%s` ones.
+    """
+    names = []
+    count = [0]
+
+    def number(match):
+        if match.group(0) == "%%":
+            return "%"
+        name = match.group(1)
+        if name is None:
+            count[0] += 1
+            return "$%d" % count[0]
+        if name not in names:
+            names.append(name)
+        return "$%d" % (names.index(name) + 1)
+    return _PLACEHOLDER.sub(number, query), (names or None)
+
+
+# Positional versions of the prepared queries, by statement name.
+_statements = {}
+
+
+def execute_prepared(cr, name, query, params=()):
+    """Runs a query as a server-side prepared statement.
+
+    The statement is prepared, under `name`, the first time it runs on the
+    cursor's connection and is executed by name from then on, so the server
+    neither parses nor plans it again. Connections that don't come from the
+    pool, or a `prepare` setting turned off, run the query as usual.
+
+    Args:
+        cr: the cursor.
+        name: the statement name, the same for every call with this query.
+        query: the query, with psycopg2 placeholders.
+        params: the parameters, a tuple or a dict like for `cr.execute`.
+    """
+    prepared = getattr(cr.connection, 'prepared', None)
+    if prepared is None or not config['prepare']:
+        cr.execute(query, params)
+        return
+    statement = _statements.get(name)
+    if statement is None:
+        statement = _statements[name] = positional(query)
+    sql, names = statement
+    if name not in prepared:
+        cr.execute("prepare %s as %s" % (name, sql))
+        prepared.add(name)
+    if names is not None:
+        params = [params[n] for n in names]
+    if params:
+        cr.execute("execute %s (%s)" % (name, ", ".join(["%s"] * len(params))),
+                   params)
+    else:
+        cr.execute("execute %s" % name)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+#
+# eventlog.py -- append-only log of the changes to the tournaments
+#
+# Every function of tournament.py that changes the tournaments or the players
+# appends an event to the `events` table, in the same transaction as the
+# change. Events are never changed or removed, so the history outlives
+# delete_matches and delete_tournaments.
+#
+# A snapshot file holds the state of a tournament up to an event: the
+# standings, the played pairs, the byes and the results. Restoring the
+# tournament loads the latest snapshot, memory-mapped, and replays only the
+# events after it:
+#
+#     tournament.snapshot_tournament(tid, "snapshots")
+#     ...
+#     snapshot = eventlog.latest_snapshot("snapshots", tid)
+#     tournament_memory.restore(
+#         tid, tournament.iter_events(tid, after=snapshot.event), snapshot)
+#
+# This module only knows the binary formats, tournament.py writes the events
+# and the snapshots and tournament_memory.py replays them.
+
+import glob
+import mmap
+import os
+import re
+import struct
+
+import numpy
+
+# Kinds of events, after the functions that log them. Events of a tournament
+# carry its id, the others have none.
+#   register_tournament: the payload is the tournament's name.
+#   register_players: (id, name) of each new player.
+#   register_into_tournament: (id, name) of each player registered into the
+#     tournament.
+#   report_results: a `RESULT` row for each match or bye.
+#   delete_matches: every match of the tournament was deleted, or of every
+#     tournament without one.
+#   delete_players: every player of the tournament was unregistered.
+#   delete_tournaments: every tournament was deleted.
+#   delete_all_players: every player was deleted.
+REGISTER_TOURNAMENT = 1
+REGISTER_PLAYERS = 2
+REGISTER_INTO_TOURNAMENT = 3
+REPORT_RESULTS = 4
+DELETE_MATCHES = 5
+DELETE_PLAYERS = 6
+DELETE_TOURNAMENTS = 7
+DELETE_ALL_PLAYERS = 8
+
+# A match, or a bye when the loser is 0, with the points of the winner.
+RESULT = numpy.dtype([('round', '<i4'), ('winner', '<i4'), ('loser', '<i4'),
+                      ('points', '<i4')])
+
+# A registered player in a snapshot.
+PLAYER = numpy.dtype([('player', '<i4'), ('wins', '<i4'),
+                      ('matches', '<i4'), ('points', '<i4'),
+                      ('games', '<i4'), ('rating', '<f8')])
+
+SNAPSHOT_MAGIC = "TSNAP001"
+
+# Magic, tournament, event, and the lengths of the sections that follow it:
+# name, players, player names, played pairs, byes and results.
+SNAPSHOT_HEADER = struct.Struct("<8siqiiiiii")
+
+_COUNT = struct.Struct("<i")
+
+
+def _utf8(name):
+    if isinstance(name, unicode):
+        return name.encode('utf-8')
+    return name
+
+
+def encode_players(players):
+    """Returns the payload of a list of (id, name)."""
+    ids = [player for (player, name) in players]
+    return (_COUNT.pack(len(ids)) +
+            struct.pack("<%di" % len(ids), *ids) +
+            "\0".join(_utf8(name) for (player, name) in players))
+
+
+def decode_players(payload):
+    """Returns the list of (id, name) of a payload from `encode_players`."""
+    count = _COUNT.unpack_from(payload)[0]
+    ids = struct.unpack_from("<%di" % count, payload, _COUNT.size)
+    names = payload[_COUNT.size + 4 * count:]
+    return zip(ids, names.split("\0") if count else [])
+
+
+def encode_results(results):
+    """Returns the payload of a list of (round, winner, loser, points).
+
+    A None loser is a bye.
+    """
+    values = []
+    for (round, winner, loser, points) in results:
+        values.extend((round, winner, loser or 0, points))
+    return struct.pack("<%di" % len(values), *values)
+
+
+def decode_results(payload):
+    """Returns a `RESULT` array from a payload made by `encode_results`."""
+    return numpy.frombuffer(payload, dtype=RESULT)
+
+
+def decode(kind, payload):
+    """Returns the content of an event's payload.
+
+    A name for `REGISTER_TOURNAMENT`, a list of (id, name) for the
+    registrations, a `RESULT` array for `REPORT_RESULTS`, None otherwise.
+    """
+    if kind == REGISTER_TOURNAMENT:
+        return str(payload)
+    if kind in (REGISTER_PLAYERS, REGISTER_INTO_TOURNAMENT):
+        return decode_players(str(payload))
+    if kind == REPORT_RESULTS:
+        return decode_results(str(payload))
+    return None
+
+
+class Snapshot(object):
+    """The state of a tournament up to an event.
+
+    Attributes:
+        tournament: the tournament id.
+        event: the id of the last event included.
+        name: the tournament's name.
+        players: a `PLAYER` array, the standings and ratings of the
+          registered players.
+        names: the players' names, in the order of `players`.
+        pairs: an (n, 2) array of the players of each match played.
+        byes: an array with the ids of the players who had a bye.
+        results: a `RESULT` array with every match and bye, in the order
+          they were reported.
+
+    Arrays of loaded snapshots are read-only views of the mapped file.
+    """
+    def __init__(self, tournament, event, name, players, names, pairs, byes,
+                 results):
+        self.tournament = tournament
+        self.event = event
+        self.name = name
+        self.players = players
+        self.names = names
+        self.pairs = pairs
+        self.byes = byes
+        self.results = results
+
+
+def snapshot_path(directory, tournament, event):
+    return os.path.join(directory,
+                        "tournament_%d.%016d.snap" % (tournament, event))
+
+
+def _padding(size):
+    return "\0" * (-size % 8)
+
+
+def write_snapshot(directory, snapshot):
+    """Writes a snapshot file into a directory.
+
+    The file is written under a temporary name and renamed once it is on
+    disk, so a crash never leaves a partial snapshot behind.
+
+    Returns:
+        The path of the file.
+    """
+    name = _utf8(snapshot.name)
+    names = [_utf8(player_name) for player_name in snapshot.names]
+    offsets = numpy.cumsum([0] + [len(n) for n in names], dtype='<i8')
+    sections = [name,
+                numpy.asarray(snapshot.players, dtype=PLAYER).tostring(),
+                offsets.tostring() + "".join(names),
+                numpy.asarray(snapshot.pairs, dtype='<i4').tostring(),
+                numpy.asarray(snapshot.byes, dtype='<i4').tostring(),
+                numpy.asarray(snapshot.results, dtype=RESULT).tostring()]
+    path = snapshot_path(directory, snapshot.tournament, snapshot.event)
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, snapshot.tournament,
+                                     snapshot.event,
+                                     *[len(section) for section in sections]))
+        for section in sections:
+            f.write(section + _padding(len(section)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(temporary, path)
+    return path
+
+
+def load_snapshot(path):
+    """Maps a snapshot file into memory.
+
+    Returns:
+        A `Snapshot` whose arrays are read straight from the mapped file.
+    """
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    header = SNAPSHOT_HEADER.unpack_from(data)
+    if header[0] != SNAPSHOT_MAGIC:
+        raise ValueError("%s is not a tournament snapshot" % path)
+    tournament, event = header[1:3]
+    sections = []
+    offset = SNAPSHOT_HEADER.size
+    for size in header[3:]:
+        sections.append((offset, size))
+        offset += size + len(_padding(size))
+
+    def array(section, dtype):
+        offset, size = sections[section]
+        return numpy.frombuffer(data, dtype=dtype,
+                                count=size // numpy.dtype(dtype).itemsize,
+                                offset=offset)
+
+    offset, size = sections[0]
+    name = data[offset:offset + size]
+    players = array(1, PLAYER)
+    offset, size = sections[2]
+    offsets = numpy.frombuffer(data, dtype='<i8', count=len(players) + 1,
+                               offset=offset)
+    start = offset + offsets.nbytes
+    names = [data[start + begin:start + end]
+             for (begin, end) in zip(offsets[:-1].tolist(),
+                                     offsets[1:].tolist())]
+    return Snapshot(tournament, event, name, players, names,
+                    array(3, '<i4').reshape(-1, 2), array(4, '<i4'),
+                    array(5, RESULT))
+
+
+def list_snapshots(directory, tournament):
+    """Returns (event, path) of each snapshot of a tournament, oldest first."""
+    snapshots = []
+    for path in glob.glob(os.path.join(directory,
+                                       "tournament_%d.*.snap" % tournament)):
+        match = re.search(r"\.(\d+)\.snap$", path)
+        if match:
+            snapshots.append((int(match.group(1)), path))
+    return sorted(snapshots)
+
+
+def latest_snapshot(directory, tournament):
+    """Loads the most recent snapshot of a tournament in a directory.
+
+    Returns:
+        A `Snapshot`, or None when the tournament has none.
+    """
+    snapshots = list_snapshots(directory, tournament)
+    return load_snapshot(snapshots[-1][1]) if snapshots else None
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+#
+# Query plan regression tests for tournament.py
+#
+# Loads a synthetic match history (1M matches by default) and checks that the
+# hot queries are answered from indexes instead of scanning whole tables.
+# It wipes the configured database, just like tournament_test.py.
+#
+# usage: python tournament/explain_test.py [matches]
+
+import json
+import sys
+
+import swiss
+from tournament import *
+
+# Tables that grow with the match history and must never be scanned whole,
+# nor every one of their partitions.
+LARGE_TABLES = set(["matches", "standings", "round_standings",
+                    "tournament_players"])
+
+TOURNAMENTS = 100
+PLAYERS = 10000
+PLAYERS_PER_TOURNAMENT = 1000
+
+
+def load_dataset(matches):
+    """Fills the database with `matches` match rows.
+
+    Every tournament has `PLAYERS_PER_TOURNAMENT` players and plays as many
+    rounds as needed to reach the requested amount of matches.
+    """
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+    rounds = max(1, matches // (TOURNAMENTS * PLAYERS_PER_TOURNAMENT))
+    with new_transaction() as cr:
+        cr.execute("""
+            insert into players ( name )
+            select 'Player ' || i from generate_series(1, %s) i
+        """, (PLAYERS,))
+        cr.execute("""
+            insert into tournaments ( name )
+            select 'Tournament ' || i from generate_series(1, %s) i
+        """, (TOURNAMENTS,))
+        cr.execute("""
+            insert into tournament_players
+            select tournaments.id, players.id
+              from tournaments
+              join players
+                on players.id %% %s = tournaments.id %% %s
+        """, (PLAYERS // PLAYERS_PER_TOURNAMENT,
+              PLAYERS // PLAYERS_PER_TOURNAMENT))
+        # Statistics left over from earlier runs can make the insert below
+        # pick a very slow plan.
+        cr.execute("analyze tournament_players")
+        # Standings are rebuilt once at the end instead of row by row.
+        cr.execute("alter table matches disable trigger matches_standings")
+        # Players meet a different opponent every round, like in
+        # benchmark.py.
+        cr.execute("""
+            with numbered as (
+                select tournament, player,
+                       row_number() over (partition by tournament
+                                          order by player) - 1 as rn
+                  from tournament_players )
+            insert into matches
+                ( tournament, round, player, opponent, won, points )
+            select a.tournament, r, a.player, b.player, won, won * r
+              from numbered a
+             cross join generate_series(1, %s) r
+              join numbered b
+                on b.tournament = a.tournament
+               and b.rn = a.rn # r::bigint
+             cross join lateral (
+                 select ((a.rn < b.rn) <>
+                         ((least(a.rn, b.rn) + r) %% 2 = 0))::integer as won
+             ) result
+        """, (rounds,))
+        cr.execute("alter table matches enable trigger matches_standings")
+        cr.execute("select rebuild_standings(NULL)")
+        cr.execute("analyze")
+
+
+def plan_nodes(query, params):
+    """Returns every node of a query plan."""
+    with new_transaction() as cr:
+        cr.execute("explain (format json) " + query, params)
+        plan = cr.fetchone()[0]
+    if isinstance(plan, basestring):
+        plan = json.loads(plan)
+
+    found = []
+    nodes = [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        found.append(node)
+        nodes.extend(node.get("Plans", []))
+    return found
+
+
+def scanned_tables(query, params):
+    """Returns a set of (node type, table) for every scan in a query plan."""
+    return set((node["Node Type"], node["Relation Name"])
+               for node in plan_nodes(query, params)
+               if "Relation Name" in node)
+
+
+def partitions(table):
+    """Returns the names of the partitions of a table, none if it has none."""
+    with new_transaction() as cr:
+        cr.execute("""
+            select inhrelid::regclass::text from pg_inherits
+             where inhparent = %s::regclass
+        """, (table,))
+        return set(row[0] for row in cr.fetchall())
+
+
+def assert_uses_indexes(label, query, params):
+    """Checks that a query scans none of the `LARGE_TABLES` whole.
+
+    Partitions read whole are fine as long as the others were pruned, they
+    only hold the matches of the tournaments the query asked for.
+    """
+    scans = scanned_tables(query, params)
+    scanned = set(table for (node_type, table) in scans
+                  if node_type == "Seq Scan")
+    for table in LARGE_TABLES:
+        parts = partitions(table)
+        if table in scanned or (parts and parts <= scanned):
+            raise ValueError(
+                "%s should not scan the whole %s table. Plan scans: %s"
+                % (label, table, sorted(scans)))
+
+
+def sample_tournament():
+    tournaments = list_tournaments()
+    return tournaments[len(tournaments) // 2][0]
+
+
+def test_standings_plan():
+    tid = sample_tournament()
+    assert_uses_indexes("player_standings", STANDINGS_QUERY, (tid,))
+    assert_uses_indexes(
+        "tournament_status",
+        "select * from tournament_status where id = %s", (tid,))
+    print "1. player_standings() reads the standings through an index."
+
+
+def test_standings_page_plan():
+    tid = sample_tournament()
+    page = player_standings(tid, limit=100)
+    params = {'tournament': tid, 'after': page[-1][0], 'limit': 100}
+    assert_uses_indexes("player_standings", STANDINGS_PAGE_QUERY, params)
+    sorts = [node for node in plan_nodes(STANDINGS_PAGE_QUERY, params)
+             if node["Node Type"] == "Sort"]
+    if sorts:
+        raise ValueError(
+            "player_standings pages should be read in order from an index "
+            "instead of sorting the whole tournament")
+    print "7. player_standings() pages are read in order from an index."
+
+
+def test_tiebreak_standings_plan():
+    tid = sample_tournament()
+    assert_uses_indexes("player_standings",
+                        tiebreak_standings_query(swiss.TIEBREAKS +
+                                                 (swiss.RATING,)),
+                        {'tournament': tid, 'after': None, 'limit': None})
+    print "8. player_standings() computes tiebreaks through indexes."
+
+
+def test_round_standings_plan():
+    tid = sample_tournament()
+    player = player_standings(tid, limit=1)[0][0]
+    params = {'tournament': tid, 'round': 1, 'after': player, 'limit': 100}
+    assert_uses_indexes("player_standings", ROUND_STANDINGS_QUERY, params)
+    assert_uses_indexes("player_standings",
+                        tiebreak_standings_query("buchholz", True), params)
+    assert_uses_indexes("player_history", PLAYER_HISTORY_QUERY,
+                        (tid, player))
+    assert_uses_indexes("delete_matches", DELETE_ROUND_STANDINGS_QUERY,
+                        (tid,))
+    print "10. Standings as of a round and histories are read through indexes."
+
+
+def test_partition_pruning_plan():
+    tid = sample_tournament()
+    for (label, query) in [("swiss_pairings", PLAYED_PAIRS_QUERY),
+                           ("delete_matches", DELETE_MATCHES_QUERY)]:
+        partitions = set(table for (node_type, table)
+                         in scanned_tables(query, (tid,))
+                         if table.startswith("matches_"))
+        if partitions != set(["matches_%s" % tid]):
+            raise ValueError("%s should only read the tournament's "
+                             "partition. Plan scans: %s"
+                             % (label, sorted(partitions)))
+    print "9. Tournament queries only read their own matches partition."
+
+
+def test_report_match_plan():
+    tid = sample_tournament()
+    players = [row[0] for row in player_standings(tid)[:2]]
+    assert_uses_indexes("report_match", PLAYERS_WINS_QUERY, (tid, players))
+    print "2. report_match() looks up the loser's wins through an index."
+
+
+def test_report_round_plan():
+    tid = sample_tournament()
+    players = [row[0] for row in player_standings(tid)[:100]]
+    assert_uses_indexes("report_round", PLAYERS_WINS_QUERY, (tid, players))
+    print "6. report_round() looks up the losers' wins through an index."
+
+
+def test_count_players_plan():
+    tid = sample_tournament()
+    assert_uses_indexes("count_players", COUNT_PLAYERS_QUERY, (tid,))
+    print "3. count_players() counts through an index."
+
+
+def test_delete_matches_plan():
+    tid = sample_tournament()
+    assert_uses_indexes("delete_matches", DELETE_MATCHES_QUERY, (tid,))
+    print "4. delete_matches() finds the matches through an index."
+
+
+def test_played_pairs_plan():
+    tid = sample_tournament()
+    assert_uses_indexes("swiss_pairings", PLAYED_PAIRS_QUERY, (tid,))
+    print "5. swiss_pairings() reads the played pairs through an index."
+
+
+def test_many_tournaments_plan():
+    tournaments = [tid for (tid, name) in list_tournaments()[:5]]
+    assert_uses_indexes("player_standings_many", STANDINGS_MANY_QUERY,
+                        (tournaments,))
+    assert_uses_indexes("swiss_pairings_many", PLAYED_PAIRS_MANY_QUERY,
+                        (tournaments,))
+    print "11. Many tournaments are read at once through indexes."
+
+
+def test_player_foreign_keys_plan():
+    player = list_players()[0][0]
+    # The queries PostgreSQL runs to check that a deleted player has no
+    # matches.
+    for column in ("player", "opponent"):
+        assert_uses_indexes("delete_all_players",
+                            "select 1 from matches where %s = %%s" % column,
+                            (player,))
+    print "12. Deleted players are looked up in the matches through indexes."
+
+
+if __name__ == '__main__':
+    matches = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    load_dataset(matches)
+    test_standings_plan()
+    test_report_match_plan()
+    test_count_players_plan()
+    test_delete_matches_plan()
+    test_played_pairs_plan()
+    test_report_round_plan()
+    test_standings_page_plan()
+    test_tiebreak_standings_plan()
+    test_round_standings_plan()
+    test_many_tournaments_plan()
+    test_player_foreign_keys_plan()
+    if matches_partitioned():
+        test_partition_pruning_plan()
+    print "Success!  All plans use indexes!"
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+#
+# green.py -- cooperative concurrency for tournament.py with gevent
+#
+# After `patch()`, psycopg2 waits for the server by yielding to the gevent
+# hub instead of blocking the thread, and the connection pool makes the
+# greenlets waiting for a connection yield too. Every function of
+# tournament.py can then run from greenlets, so a single thread can have the
+# requests of many tournaments in flight at once:
+#
+#     green.patch()
+#     jobs = [green.spawn(player_standings, tid) for tid in tournaments]
+#     standings = green.gather(jobs)
+#
+# COPY is not available in this mode, psycopg2 doesn't support it with a
+# wait callback.
+
+import gevent
+import gevent.lock
+import gevent.socket
+import psycopg2
+import psycopg2.extensions
+
+import db
+
+
+def wait_callback(conn, timeout=None):
+    """Waits for a psycopg2 connection without blocking other greenlets."""
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            break
+        elif state == psycopg2.extensions.POLL_READ:
+            gevent.socket.wait_read(conn.fileno(), timeout=timeout)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            gevent.socket.wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(
+                "Bad result from poll: %r" % state)
+
+
+class GreenConnectionPool(db.ConnectionPool):
+    """A connection pool where waiting for a connection yields to the hub."""
+    def _make_slots(self, maxconn):
+        return gevent.lock.BoundedSemaphore(maxconn)
+
+
+def patch():
+    """Makes tournament.py cooperative for the rest of the process."""
+    psycopg2.extensions.set_wait_callback(wait_callback)
+    db.pool_class = GreenConnectionPool
+    # The pool connects while holding this lock, which yields to the hub.
+    # Other greenlets asking for the pool then have to yield too.
+    db._pool_lock = gevent.lock.Semaphore()
+    db.configure()
+
+
+def spawn(fn, *args, **kwargs):
+    """Starts `fn(*args, **kwargs)` in a new greenlet and returns it."""
+    return gevent.spawn(fn, *args, **kwargs)
+
+
+def gather(greenlets):
+    """Waits for every greenlet and returns their results, in order.
+
+    The first exception raised by any of them is raised again.
+    """
+    gevent.joinall(greenlets, raise_error=True)
+    return [g.value for g in greenlets]
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+#
+# live.py -- standings pushed to scoreboards with LISTEN/NOTIFY
+#
+# Every function of tournament.py that changes the standings of a tournament
+# sends an event on the tournament's channel when its transaction commits.
+# The events carry the new rows of the players that changed, so a
+# `Subscriber` keeps a local copy of the standings of the tournaments it
+# follows without querying them again:
+#
+#     subscriber = live.Subscriber()
+#     board = subscriber.follow(tid)
+#     while True:
+#         if tid in subscriber.wait(timeout=5):
+#             show(board.standings())
+#
+# Events are applied in commit order and carry absolute values, so the copy
+# ends up with the same standings as the database even when events arrive
+# right after the copy was first read.
+
+import json
+import select
+
+import psycopg2
+import psycopg2.extensions
+
+import db
+
+
+CHANNEL_PREFIX = "standings_"
+
+# Kinds of events:
+#   update: the rows are (player, wins, matches, points) of players whose
+#     standings changed.
+#   register: the rows are (player, wins, matches, points, name) of players
+#     registered into the tournament.
+#   reset: every player is back to no matches.
+#   clear: the tournament has no players anymore.
+#   reload: the standings changed in bulk and must be read again.
+UPDATE = 'update'
+REGISTER = 'register'
+RESET = 'reset'
+CLEAR = 'clear'
+RELOAD = 'reload'
+
+# PostgreSQL rejects NOTIFY payloads of 8000 bytes or more.
+MAX_PAYLOAD = 7999
+
+
+def channel(tournament):
+    """Returns the channel of the events of a tournament."""
+    return CHANNEL_PREFIX + str(int(tournament))
+
+
+def encode(event, rows=()):
+    """Returns the payloads that send an event, each one short enough.
+
+    Rows are split across as many payloads as needed. A row too long to be
+    sent on its own, because of a very long name, turns into a reload.
+    """
+    if not rows:
+        return [json.dumps([event])]
+    payloads = []
+    chunk = []
+    size = len(json.dumps([event, []]))
+    for row in rows:
+        encoded = json.dumps(list(row), separators=(',', ':'))
+        if size + len(encoded) + 1 > MAX_PAYLOAD and chunk:
+            payloads.append(_payload(event, chunk))
+            chunk = []
+            size = len(json.dumps([event, []]))
+        if size + len(encoded) + 1 > MAX_PAYLOAD:
+            payloads.append(json.dumps([RELOAD]))
+            continue
+        chunk.append(encoded)
+        size += len(encoded) + 1
+    if chunk:
+        payloads.append(_payload(event, chunk))
+    return payloads
+
+
+def _payload(event, encoded_rows):
+    return '[%s,[%s]]' % (json.dumps(event), ",".join(encoded_rows))
+
+
+def decode(payload):
+    """Returns (event, rows) from a payload made by `encode`."""
+    message = json.loads(payload)
+    return message[0], message[1] if len(message) > 1 else []
+
+
+class LiveStandings(object):
+    """A local copy of the standings of a tournament.
+
+    Kept up to date by a `Subscriber`, read with `standings`.
+    """
+    def __init__(self, tournament):
+        self.tournament = tournament
+        # Player id to [name, wins, matches, points].
+        self.players = {}
+        self._sorted = None
+
+    def load(self, rows):
+        """Replaces the copy with rows of standings.
+
+        Args:
+            rows: (player, name, wins, matches, points) tuples.
+        """
+        self.players = dict((row[0], list(row[1:])) for row in rows)
+        self._sorted = None
+
+    def apply(self, event, rows):
+        """Applies an event.
+
+        Returns:
+            False when the standings must be read again, True otherwise.
+        """
+        self._sorted = None
+        if event == UPDATE:
+            for (player, wins, matches, points) in rows:
+                if player in self.players:
+                    self.players[player][1:] = [wins, matches, points]
+        elif event == REGISTER:
+            for (player, wins, matches, points, name) in rows:
+                self.players[player] = [name, wins, matches, points]
+        elif event == RESET:
+            for standing in self.players.itervalues():
+                standing[1:] = [0, 0, 0]
+        elif event == CLEAR:
+            self.players = {}
+        else:
+            return False
+        return True
+
+    def standings(self):
+        """Returns the standings, like `tournament.player_standings`."""
+        if self._sorted is None:
+            ranked = sorted(self.players.iteritems(),
+                            key=lambda item: (-item[1][1], -item[1][3],
+                                              item[0]))
+            self._sorted = [(player, name, wins, matches)
+                            for (player, (name, wins, matches, points))
+                            in ranked]
+        return list(self._sorted)
+
+
+class Subscriber(object):
+    """Follows the standings of tournaments from their events.
+
+    Events are received on a connection of its own, outside of the pool,
+    which listens to the channels of the tournaments followed. Nothing is
+    read from it until `poll` or `wait` is called. `fileno` lets an event
+    loop watch the connection instead of calling `wait`, with gevent wait on
+    it with `gevent.socket.wait_read` and then call `poll`.
+
+    Args:
+        dsn: the connection string, `db.config['dsn']` by default.
+    """
+    def __init__(self, dsn=None):
+        self.conn = psycopg2.connect(dsn or db.config['dsn'])
+        self.conn.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        self.followed = {}
+
+    def follow(self, tournament):
+        """Starts following a tournament.
+
+        Returns:
+            The `LiveStandings` of the tournament.
+        """
+        if tournament in self.followed:
+            return self.followed[tournament]
+        live = LiveStandings(tournament)
+        cr = self.conn.cursor()
+        try:
+            # Listening first, changes committed while the standings are
+            # read arrive as events afterwards.
+            cr.execute("listen %s" % channel(tournament))
+            self._load(cr, live)
+        finally:
+            cr.close()
+        self.followed[tournament] = live
+        return live
+
+    def unfollow(self, tournament):
+        """Stops following a tournament."""
+        if self.followed.pop(tournament, None) is not None:
+            cr = self.conn.cursor()
+            try:
+                cr.execute("unlisten %s" % channel(tournament))
+            finally:
+                cr.close()
+
+    def _load(self, cr, live):
+        cr.execute("""
+            select standings.player, players.name, wins, matches, points
+              from standings
+              join players on players.id = standings.player
+             where standings.tournament = %s
+        """, (live.tournament,))
+        live.load(cr.fetchall())
+
+    def fileno(self):
+        return self.conn.fileno()
+
+    def poll(self):
+        """Applies the events received so far.
+
+        Returns:
+            The set of ids of the tournaments whose standings changed.
+        """
+        self.conn.poll()
+        changed = set()
+        reload = set()
+        while self.conn.notifies:
+            notify = self.conn.notifies.pop(0)
+            tournament = int(notify.channel[len(CHANNEL_PREFIX):])
+            live = self.followed.get(tournament)
+            if live is None:
+                continue
+            event, rows = decode(notify.payload)
+            if not live.apply(event, rows):
+                reload.add(tournament)
+            changed.add(tournament)
+        if reload:
+            cr = self.conn.cursor()
+            try:
+                for tournament in reload:
+                    self._load(cr, self.followed[tournament])
+            finally:
+                cr.close()
+            # Events committed before the standings were read again are
+            # applied once more, in commit order, which ends with the same
+            # standings.
+            changed |= self.poll()
+        return changed
+
+    def wait(self, timeout=None):
+        """Waits for events for up to `timeout` seconds and applies them.
+
+        Returns:
+            The set of ids of the tournaments whose standings changed, empty
+            if nothing changed before the timeout.
+        """
+        changed = self.poll()
+        if changed:
+            return changed
+        if select.select([self.conn], [], [], timeout)[0]:
+            return self.poll()
+        return set()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+#
+# metrics.py -- opt-in latency instrumentation for tournament.py
+#
+# Once enabled, every public function of tournament.py and every statement it
+# runs are timed into in-process histograms, together with the rows returned
+# and the time spent waiting for a pooled connection. Everything is labelled
+# with the public function it belongs to, so the time of a slow call can be
+# split between getting a connection, running SQL and the Python around it.
+#
+# Example:
+#     metrics.enable()
+#     metrics.add_hook(lambda metric, function, value: log(...))
+#     swiss_pairings(tid)
+#     print metrics.export()   # Prometheus text exposition format
+#
+# While disabled, which is the default, the only cost is a global lookup per
+# call.
+
+import bisect
+import functools
+import threading
+import time
+
+import psycopg2.extensions
+
+
+# Upper bounds of the histogram buckets, in seconds or rows.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# Name, help text and buckets of every metric.
+METRICS = [
+    ('function_seconds',
+     "Time spent in each public function of tournament.py.",
+     DEFAULT_BUCKETS),
+    ('connection_wait_seconds',
+     "Time spent waiting for a pooled connection.",
+     DEFAULT_BUCKETS),
+    ('query_seconds',
+     "Time spent running SQL statements.",
+     DEFAULT_BUCKETS),
+    ('query_rows',
+     "Rows returned or changed by SQL statements.",
+     ROW_BUCKETS),
+]
+
+PREFIX = "tournament_"
+
+
+class Histogram(object):
+    """Counts observations into buckets, exported cumulatively."""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Registry(object):
+    """The histograms of every metric, one per function label."""
+    def __init__(self):
+        self.buckets = dict((name, buckets)
+                            for (name, help, buckets) in METRICS)
+        self.histograms = dict((name, {}) for (name, help, buckets)
+                               in METRICS)
+        self._lock = threading.Lock()
+
+    def observe(self, metric, function, value):
+        with self._lock:
+            histograms = self.histograms[metric]
+            h = histograms.get(function)
+            if h is None:
+                h = histograms[function] = Histogram(self.buckets[metric])
+            h.observe(value)
+
+
+_registry = None
+_hooks = []
+
+
+def enable():
+    """Starts recording, discarding whatever was recorded before."""
+    global _registry
+    _registry = Registry()
+
+
+def disable():
+    """Stops recording."""
+    global _registry
+    _registry = None
+
+
+def enabled():
+    """Returns whether recording is on."""
+    return _registry is not None
+
+
+def add_hook(hook):
+    """Calls `hook(metric, function, value)` for every observation.
+
+    Hooks run in the thread that made the observation, while recording is
+    enabled, and should be quick. They can forward the observations to
+    statsd, a log or a tracing system.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def observe(metric, function, value):
+    """Records a value of a metric for a function of tournament.py."""
+    r = _registry
+    if r is None:
+        return
+    r.observe(metric, function, value)
+    for hook in list(_hooks):
+        hook(metric, function, value)
+
+
+def info():
+    """Returns {metric: {function: (count, sum)}}, or None when disabled."""
+    r = _registry
+    if r is None:
+        return None
+    with r._lock:
+        return dict((metric, dict((function, (h.count, h.sum))
+                                  for function, h in histograms.items()))
+                    for metric, histograms in r.histograms.items())
+
+
+def export():
+    """Returns every histogram in the Prometheus text exposition format."""
+    r = _registry
+    if r is None:
+        return ""
+    lines = []
+    with r._lock:
+        for (metric, help, buckets) in METRICS:
+            name = PREFIX + metric
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s histogram" % name)
+            for function, h in sorted(r.histograms[metric].items()):
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append('%s_bucket{function="%s",le="%s"} %d'
+                                 % (name, function, repr(float(bound)),
+                                    cumulative))
+                lines.append('%s_bucket{function="%s",le="+Inf"} %d'
+                             % (name, function, h.count))
+                lines.append('%s_sum{function="%s"} %r'
+                             % (name, function, h.sum))
+                lines.append('%s_count{function="%s"} %d'
+                             % (name, function, h.count))
+    return "\n".join(lines) + "\n"
+
+
+def timed(fn):
+    """Records the duration of every call of a function."""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _registry is None:
+            return fn(*args, **kwargs)
+        start = time.time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            observe('function_seconds', name, time.time() - start)
+    return wrapper
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """A cursor that records the duration and row count of each statement.
+
+    `label` is the function of tournament.py the statements belong to. On
+    server-side cursors only the statement itself is timed, the rows are
+    fetched later, while they are iterated.
+    """
+    label = None
+
+    def execute(self, query, vars=None):
+        start = time.time()
+        try:
+            return super(TimedCursor, self).execute(query, vars)
+        finally:
+            self._record(time.time() - start)
+
+    def executemany(self, query, vars_list):
+        start = time.time()
+        try:
+            return super(TimedCursor, self).executemany(query, vars_list)
+        finally:
+            self._record(time.time() - start)
+
+    def _record(self, elapsed):
+        observe('query_seconds', self.label, elapsed)
+        if self.rowcount >= 0:
+            observe('query_rows', self.label, self.rowcount)
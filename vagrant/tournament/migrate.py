@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#
+# migrate.py -- brings an existing tournament database up to date
+#
+# usage: python tournament/migrate.py
+#
+# Every file in migrations/ is named `{version}_{description}.sql` and is
+# applied once, in version order, inside its own transaction. Applied versions
+# are recorded in the `schema_migrations` table. Databases created with the
+# current tournament.sql already have every migration recorded.
+
+import os
+import re
+
+from tournament import connect
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'migrations')
+
+
+def available_migrations():
+    """Returns a sorted list of (version, path) of all migration files."""
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = re.match(r'^(\d+)_.*\.sql$', filename)
+        if match:
+            migrations.append((int(match.group(1)),
+                               os.path.join(MIGRATIONS_DIR, filename)))
+    return sorted(migrations)
+
+
+def applied_migrations(cr):
+    """Returns the set of versions already applied to the database."""
+    cr.execute("""
+        create table if not exists schema_migrations (
+            version integer primary key,
+            applied_at timestamp not null default now() )
+    """)
+    cr.execute("select version from schema_migrations")
+    return set(row[0] for row in cr.fetchall())
+
+
+def migrate():
+    """Applies every pending migration.
+
+    Returns:
+        The list of applied versions.
+    """
+    conn = connect()
+    try:
+        cr = conn.cursor()
+        applied = applied_migrations(cr)
+        conn.commit()
+        done = []
+        for version, path in available_migrations():
+            if version in applied:
+                continue
+            with open(path) as f:
+                cr.execute(f.read())
+            cr.execute("""
+                insert into schema_migrations ( version ) values ( %s )
+            """, (version,))
+            conn.commit()
+            done.append(version)
+        return done
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    versions = migrate()
+    if versions:
+        print "Applied migrations: %s" % ", ".join(str(v) for v in versions)
+    else:
+        print "Database is up to date."
@@ -0,0 +1,105 @@
+-- 001: incrementally maintained standings table.
+--
+-- Replaces the aggregate in the tournament_status view with the standings
+-- table and fills it from the existing matches.
+
+DROP VIEW tournament_status;
+
+-- Running totals of every registered player in a tournament, kept up to date
+-- by the triggers below in the same transaction that changes `matches`.
+CREATE TABLE standings ( tournament INTEGER,
+                         player INTEGER,
+                         wins INTEGER NOT NULL DEFAULT 0,
+                         matches INTEGER NOT NULL DEFAULT 0,
+                         points INTEGER NOT NULL DEFAULT 0,
+                         PRIMARY KEY (tournament, player),
+                         FOREIGN KEY (tournament, player)
+                           REFERENCES tournament_players ON DELETE CASCADE );
+
+CREATE INDEX standings_rank ON standings (tournament, wins DESC, points DESC, player);
+
+
+CREATE FUNCTION add_standings() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO standings ( tournament, player, wins, matches, points )
+  SELECT NEW.tournament,
+         NEW.player,
+         coalesce(sum(won), 0),
+         count(won),
+         coalesce(sum(points), 0)
+    FROM matches
+   WHERE tournament = NEW.tournament
+     AND player = NEW.player;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tournament_players_standings
+  AFTER INSERT ON tournament_players
+  FOR EACH ROW EXECUTE PROCEDURE add_standings();
+
+
+CREATE FUNCTION update_standings() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    UPDATE standings
+       SET wins = wins - coalesce(OLD.won, 0),
+           matches = matches - (OLD.won IS NOT NULL)::integer,
+           points = points - coalesce(OLD.points, 0)
+     WHERE tournament = OLD.tournament
+       AND player = OLD.player;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    UPDATE standings
+       SET wins = wins + coalesce(NEW.won, 0),
+           matches = matches + (NEW.won IS NOT NULL)::integer,
+           points = points + coalesce(NEW.points, 0)
+     WHERE tournament = NEW.tournament
+       AND player = NEW.player;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER matches_standings
+  AFTER INSERT OR UPDATE OR DELETE ON matches
+  FOR EACH ROW EXECUTE PROCEDURE update_standings();
+
+
+-- Recomputes the standings of a tournament (or of all of them when called
+-- with NULL) from `matches`.
+CREATE FUNCTION rebuild_standings(INTEGER) RETURNS void AS $$
+  LOCK TABLE matches IN SHARE MODE;
+  DELETE FROM standings WHERE $1 IS NULL OR tournament = $1;
+  INSERT INTO standings ( tournament, player, wins, matches, points )
+  SELECT tournament_players.tournament,
+         tournament_players.player,
+         coalesce(sum(matches.won), 0),
+         count(matches.won),
+         coalesce(sum(matches.points), 0)
+    FROM tournament_players
+    LEFT JOIN matches
+      ON tournament_players.tournament = matches.tournament
+     AND tournament_players.player = matches.player
+   WHERE $1 IS NULL OR tournament_players.tournament = $1
+   GROUP BY tournament_players.tournament, tournament_players.player;
+$$ LANGUAGE sql;
+
+
+SELECT rebuild_standings(NULL);
+
+
+CREATE VIEW tournament_status as
+  SELECT tournaments.id,
+         tournaments.name,
+         players.id as player_id,
+         players.name as player_name,
+         standings.wins,
+         standings.matches,
+         standings.points
+  FROM standings
+  JOIN tournaments
+    ON tournaments.id = standings.tournament
+  JOIN players
+    ON players.id = standings.player
+  ORDER BY tournaments.id, wins desc, points desc, players.id;
@@ -0,0 +1,11 @@
+-- 002: match ids, rounds, constraints and indexes.
+
+ALTER TABLE matches ADD COLUMN id serial PRIMARY KEY;
+ALTER TABLE matches ADD COLUMN round INTEGER;
+ALTER TABLE matches ALTER COLUMN tournament SET NOT NULL;
+ALTER TABLE matches ALTER COLUMN player SET NOT NULL;
+ALTER TABLE matches ADD CHECK (won IN (0, 1));
+
+CREATE INDEX matches_tournament_player ON matches (tournament, player, opponent);
+CREATE INDEX matches_opponent ON matches (opponent);
+CREATE INDEX tournament_players_player ON tournament_players (player);
@@ -0,0 +1,8 @@
+-- 003: standings index usable for keyset pagination.
+
+DROP INDEX standings_rank;
+
+-- Scanned backwards it gives the ranking (wins desc, points desc, player),
+-- and it supports keyset pagination with a (wins, points, -player) row
+-- comparison.
+CREATE INDEX standings_rank ON standings (tournament, wins, points, (-player));
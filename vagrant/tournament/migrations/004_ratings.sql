@@ -0,0 +1,22 @@
+-- 004: Elo ratings of the players across tournaments.
+--
+-- Every existing player starts at the initial rating, run
+-- tournament.rebuild_ratings() afterwards to rate them from their matches.
+
+CREATE TABLE ratings ( player INTEGER PRIMARY KEY
+                         REFERENCES players(id) ON DELETE CASCADE,
+                       rating REAL NOT NULL DEFAULT 1500,
+                       games INTEGER NOT NULL DEFAULT 0 );
+
+CREATE FUNCTION add_rating() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO ratings ( player ) VALUES ( NEW.id );
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER players_ratings
+  AFTER INSERT ON players
+  FOR EACH ROW EXECUTE PROCEDURE add_rating();
+
+INSERT INTO ratings ( player ) SELECT id FROM players;
@@ -0,0 +1,202 @@
+-- 005: round standings, the totals of every player after each round.
+--
+-- Matches reported before had no round. Each player's matches are numbered
+-- in the order they were reported, and both rows of a match take the greater
+-- of their two numbers as its round, like `report_match` does for the round
+-- after the last one either player played. The round standings are then
+-- computed from the matches.
+
+CREATE TABLE round_standings ( tournament INTEGER,
+                               player INTEGER,
+                               round INTEGER,
+                               wins INTEGER NOT NULL DEFAULT 0,
+                               matches INTEGER NOT NULL DEFAULT 0,
+                               points INTEGER NOT NULL DEFAULT 0,
+                               PRIMARY KEY (tournament, player, round),
+                               FOREIGN KEY (tournament, player)
+                                 REFERENCES tournament_players
+                                 ON DELETE CASCADE );
+
+-- The k-th row of a player against an opponent and the k-th row of the
+-- opponent against them are the two sides of the same match. A bye only has
+-- one side, least() and greatest() skip its NULL opponent.
+UPDATE matches
+   SET round = numbered.round
+  FROM ( SELECT id, max(side_round) OVER (PARTITION BY tournament,
+                                          least(player, opponent),
+                                          greatest(player, opponent),
+                                          pair_seq) AS round
+           FROM ( SELECT id, tournament, player, opponent,
+                         row_number() OVER (PARTITION BY tournament, player
+                                            ORDER BY id) AS side_round,
+                         row_number() OVER (PARTITION BY tournament, player,
+                                                         opponent
+                                            ORDER BY id) AS pair_seq
+                    FROM matches ) sides ) numbered
+ WHERE matches.id = numbered.id
+   AND matches.round IS NULL;
+
+CREATE OR REPLACE FUNCTION add_standings() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO standings ( tournament, player, wins, matches, points )
+  SELECT NEW.tournament,
+         NEW.player,
+         coalesce(sum(won), 0),
+         count(won),
+         coalesce(sum(points), 0)
+    FROM matches
+   WHERE tournament = NEW.tournament
+     AND player = NEW.player;
+  INSERT INTO round_standings ( tournament, player, round, wins, matches,
+                                points )
+  SELECT tournament, player, round,
+         sum(coalesce(sum(won), 0)) OVER w,
+         sum(count(won)) OVER w,
+         sum(coalesce(sum(points), 0)) OVER w
+    FROM matches
+   WHERE tournament = NEW.tournament
+     AND player = NEW.player
+     AND round IS NOT NULL
+   GROUP BY tournament, player, round
+  WINDOW w AS (ORDER BY round);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION update_standings() RETURNS trigger AS $$
+DECLARE
+  last_round INTEGER;
+  wins_before INTEGER;
+  matches_before INTEGER;
+  points_before INTEGER;
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    UPDATE standings
+       SET wins = wins - coalesce(OLD.won, 0),
+           matches = matches - (OLD.won IS NOT NULL)::integer,
+           points = points - coalesce(OLD.points, 0)
+     WHERE tournament = OLD.tournament
+       AND player = OLD.player;
+    UPDATE round_standings
+       SET wins = wins - coalesce(OLD.won, 0),
+           matches = matches - (OLD.won IS NOT NULL)::integer,
+           points = points - coalesce(OLD.points, 0)
+     WHERE tournament = OLD.tournament
+       AND player = OLD.player
+       AND round >= OLD.round;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    UPDATE standings
+       SET wins = wins + coalesce(NEW.won, 0),
+           matches = matches + (NEW.won IS NOT NULL)::integer,
+           points = points + coalesce(NEW.points, 0)
+     WHERE tournament = NEW.tournament
+       AND player = NEW.player;
+    -- Only registered players have standings. Their standings row is now
+    -- locked, so the changes to their round standings below don't race
+    -- with other transactions.
+    IF FOUND AND NEW.round IS NOT NULL THEN
+      SELECT round, wins, matches, points
+        INTO last_round, wins_before, matches_before, points_before
+        FROM round_standings
+       WHERE tournament = NEW.tournament
+         AND player = NEW.player
+       ORDER BY round DESC
+       LIMIT 1;
+      -- Usually the player's first match of a later round than any they
+      -- played, which starts from the totals of their last round. A late
+      -- result is added to its round and the ones after it.
+      IF last_round >= NEW.round THEN
+        UPDATE round_standings
+           SET wins = wins + coalesce(NEW.won, 0),
+               matches = matches + (NEW.won IS NOT NULL)::integer,
+               points = points + coalesce(NEW.points, 0)
+         WHERE tournament = NEW.tournament
+           AND player = NEW.player
+           AND round >= NEW.round;
+        IF EXISTS (SELECT 1 FROM round_standings
+                    WHERE tournament = NEW.tournament
+                      AND player = NEW.player
+                      AND round = NEW.round) THEN
+          RETURN NULL;
+        END IF;
+        SELECT wins, matches, points
+          INTO wins_before, matches_before, points_before
+          FROM round_standings
+         WHERE tournament = NEW.tournament
+           AND player = NEW.player
+           AND round < NEW.round
+         ORDER BY round DESC
+         LIMIT 1;
+      END IF;
+      INSERT INTO round_standings ( tournament, player, round, wins,
+                                    matches, points )
+      VALUES ( NEW.tournament, NEW.player, NEW.round,
+               coalesce(wins_before, 0) + coalesce(NEW.won, 0),
+               coalesce(matches_before, 0) + (NEW.won IS NOT NULL)::integer,
+               coalesce(points_before, 0) + coalesce(NEW.points, 0) );
+    END IF;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rebuild_standings(INTEGER) RETURNS void AS $$
+  LOCK TABLE matches IN SHARE MODE;
+  DELETE FROM round_standings WHERE $1 IS NULL OR tournament = $1;
+  DELETE FROM standings WHERE $1 IS NULL OR tournament = $1;
+  INSERT INTO standings ( tournament, player, wins, matches, points )
+  SELECT tournament_players.tournament,
+         tournament_players.player,
+         coalesce(sum(matches.won), 0),
+         count(matches.won),
+         coalesce(sum(matches.points), 0)
+    FROM tournament_players
+    LEFT JOIN matches
+      ON tournament_players.tournament = matches.tournament
+     AND tournament_players.player = matches.player
+   WHERE $1 IS NULL OR tournament_players.tournament = $1
+   GROUP BY tournament_players.tournament, tournament_players.player;
+  INSERT INTO round_standings ( tournament, player, round, wins, matches,
+                                points )
+  SELECT matches.tournament, matches.player, matches.round,
+         sum(coalesce(sum(matches.won), 0)) OVER w,
+         sum(count(matches.won)) OVER w,
+         sum(coalesce(sum(matches.points), 0)) OVER w
+    FROM matches
+    JOIN tournament_players
+      ON tournament_players.tournament = matches.tournament
+     AND tournament_players.player = matches.player
+   WHERE matches.round IS NOT NULL
+     AND ($1 IS NULL OR matches.tournament = $1)
+   GROUP BY matches.tournament, matches.player, matches.round
+  WINDOW w AS (PARTITION BY matches.tournament, matches.player
+               ORDER BY matches.round);
+$$ LANGUAGE sql;
+
+-- Databases with the partitioned layout of partitioning.sql also reset the
+-- round standings when truncating matches.
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'truncate_matches') THEN
+    EXECUTE $f$
+      CREATE OR REPLACE FUNCTION truncate_matches(INTEGER) RETURNS void AS $b$
+      BEGIN
+        IF $1 IS NULL THEN
+          TRUNCATE matches;
+          DELETE FROM round_standings;
+          UPDATE standings SET wins = 0, matches = 0, points = 0;
+        ELSE
+          EXECUTE format('TRUNCATE matches_%s', $1);
+          DELETE FROM round_standings WHERE tournament = $1;
+          UPDATE standings SET wins = 0, matches = 0, points = 0
+           WHERE tournament = $1;
+        END IF;
+      END;
+      $b$ LANGUAGE plpgsql
+    $f$;
+  END IF;
+END;
+$$;
+
+SELECT rebuild_standings(NULL);
@@ -0,0 +1,22 @@
+-- 006: append-only event log, see eventlog.py.
+
+-- Append-only log of the changes made through tournament.py, see
+-- eventlog.py. It outlives the tournaments, players and matches it describes,
+-- so it has no foreign keys, and its rows can't be changed or removed.
+CREATE TABLE events ( id BIGSERIAL PRIMARY KEY,
+                      tournament INTEGER,
+                      kind SMALLINT NOT NULL,
+                      payload BYTEA NOT NULL,
+                      logged_at TIMESTAMP NOT NULL DEFAULT now() );
+
+CREATE INDEX events_tournament ON events (tournament, id);
+
+CREATE FUNCTION reject_change() RETURNS trigger AS $$
+BEGIN
+  RAISE EXCEPTION '% is append-only', TG_TABLE_NAME;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER events_append_only
+  BEFORE UPDATE OR DELETE OR TRUNCATE ON events
+  FOR EACH STATEMENT EXECUTE PROCEDURE reject_change();
@@ -0,0 +1,4 @@
+-- 007: index on matches.player, for the foreign key checks of deleted
+-- players.
+
+CREATE INDEX matches_player ON matches (player);
@@ -0,0 +1,136 @@
+-- Optional partitioned layout of the matches table, needs PostgreSQL 11 or
+-- later.
+--
+-- Every tournament gets its own partition of `matches`, created when the
+-- tournament is registered and dropped when it is deleted. Queries for a
+-- tournament only read its partition, deleting its matches truncates the
+-- partition instead of deleting row by row, and finished tournaments can be
+-- detached with `archive_tournament`.
+--
+-- Apply it to a database created with tournament.sql:
+--
+--   psql tournament -f tournament/partitioning.sql
+
+\set ON_ERROR_STOP on
+
+BEGIN;
+
+DROP TRIGGER matches_standings ON matches;
+ALTER TABLE matches RENAME TO unpartitioned_matches;
+ALTER INDEX matches_pkey RENAME TO unpartitioned_matches_pkey;
+ALTER INDEX matches_tournament_player
+  RENAME TO unpartitioned_matches_tournament_player;
+ALTER INDEX matches_player RENAME TO unpartitioned_matches_player;
+ALTER INDEX matches_opponent RENAME TO unpartitioned_matches_opponent;
+
+-- Primary keys of partitioned tables must include the partition key.
+CREATE TABLE matches ( id INTEGER NOT NULL
+                         DEFAULT nextval('matches_id_seq'),
+                       tournament INTEGER NOT NULL REFERENCES tournaments(id),
+                       round INTEGER,
+                       player INTEGER NOT NULL REFERENCES players(id),
+                       opponent INTEGER REFERENCES players(id),
+                       won INTEGER CHECK (won IN (0, 1)),
+                       points INTEGER DEFAULT 0,
+                       PRIMARY KEY (tournament, id) )
+  PARTITION BY LIST (tournament);
+
+CREATE INDEX matches_tournament_player ON matches (tournament, player, opponent);
+CREATE INDEX matches_player ON matches (player);
+CREATE INDEX matches_opponent ON matches (opponent);
+
+
+CREATE FUNCTION create_matches_partition() RETURNS trigger AS $$
+BEGIN
+  EXECUTE format('CREATE TABLE matches_%s PARTITION OF matches
+                  FOR VALUES IN (%s)', NEW.id, NEW.id);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tournaments_create_matches_partition
+  AFTER INSERT ON tournaments
+  FOR EACH ROW EXECUTE PROCEDURE create_matches_partition();
+
+-- Fires after the foreign key checks, which keep tournaments with matches
+-- from being deleted.
+CREATE FUNCTION drop_matches_partition() RETURNS trigger AS $$
+BEGIN
+  EXECUTE format('DROP TABLE IF EXISTS matches_%s', OLD.id);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tournaments_drop_matches_partition
+  AFTER DELETE ON tournaments
+  FOR EACH ROW EXECUTE PROCEDURE drop_matches_partition();
+
+
+DO $$
+DECLARE
+  t INTEGER;
+BEGIN
+  FOR t IN SELECT id FROM tournaments LOOP
+    EXECUTE format('CREATE TABLE matches_%s PARTITION OF matches
+                    FOR VALUES IN (%s)', t, t);
+  END LOOP;
+END;
+$$;
+
+INSERT INTO matches SELECT * FROM unpartitioned_matches;
+ALTER SEQUENCE matches_id_seq OWNED BY matches.id;
+DROP TABLE unpartitioned_matches;
+
+CREATE TRIGGER matches_standings
+  AFTER INSERT OR UPDATE OR DELETE ON matches
+  FOR EACH ROW EXECUTE PROCEDURE update_standings();
+
+
+-- Removes the matches of a tournament, or of all of them when called with
+-- NULL, and resets their standings and round standings. Truncating skips the
+-- row triggers that keep the standings up to date. Archived tournaments have
+-- no partition any more and keep their standings.
+CREATE FUNCTION truncate_matches(INTEGER) RETURNS void AS $$
+BEGIN
+  IF $1 IS NULL THEN
+    TRUNCATE matches;
+    DELETE FROM round_standings
+     WHERE to_regclass(format('matches_%s', tournament)) IN
+           (SELECT inhrelid FROM pg_inherits
+             WHERE inhparent = 'matches'::regclass);
+    UPDATE standings SET wins = 0, matches = 0, points = 0
+     WHERE to_regclass(format('matches_%s', tournament)) IN
+           (SELECT inhrelid FROM pg_inherits
+             WHERE inhparent = 'matches'::regclass);
+  ELSE
+    EXECUTE format('TRUNCATE matches_%s', $1);
+    DELETE FROM round_standings WHERE tournament = $1;
+    UPDATE standings SET wins = 0, matches = 0, points = 0
+     WHERE tournament = $1;
+  END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Detaches the partition of a tournament and renames it to
+-- archived_matches_{id}. The standings are kept, further matches are
+-- rejected. The archived table drops the foreign keys it had as a partition,
+-- so the tournament and its players can still be deleted. Returns the name of
+-- the archived table.
+CREATE FUNCTION archive_tournament(INTEGER) RETURNS TEXT AS $$
+DECLARE
+  fkey TEXT;
+BEGIN
+  EXECUTE format('ALTER TABLE matches DETACH PARTITION matches_%s', $1);
+  EXECUTE format('ALTER TABLE matches_%s RENAME TO archived_matches_%s',
+                 $1, $1);
+  FOR fkey IN SELECT conname FROM pg_constraint
+               WHERE conrelid = format('archived_matches_%s', $1)::regclass
+                 AND contype = 'f' LOOP
+    EXECUTE format('ALTER TABLE archived_matches_%s DROP CONSTRAINT %I',
+                   $1, fkey);
+  END LOOP;
+  RETURN 'archived_matches_' || $1;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+# ratings.py -- Elo ratings of the players across tournaments
+#
+# Every player starts at `INITIAL_RATING`. A win moves the winner up and the
+# loser down by the same amount, `K_FACTOR` times how unlikely the win was:
+#
+#     expected = 1 / (1 + 10 ** ((loser - winner) / 400))
+#     winner += K_FACTOR * (1 - expected)
+#     loser -= K_FACTOR * (1 - expected)
+#
+# The backends apply `rate_matches` as results are reported, and `replay`
+# recomputes every rating from the whole match history at once.
+
+import numpy
+
+INITIAL_RATING = 1500.0
+K_FACTOR = 32.0
+
+# A rating difference of `SCALE` points makes the stronger player ten times
+# as likely to win as to lose.
+SCALE = 400.0
+
+
+def expected_score(rating, opponent_rating):
+    """Returns the probability that a player beats an opponent.
+
+    Works on plain numbers as well as on numpy arrays of ratings.
+    """
+    return 1.0 / (1.0 + 10 ** ((opponent_rating - rating) / SCALE))
+
+
+def rating_change(winner_rating, loser_rating, k=K_FACTOR):
+    """Returns the points the winner of a match takes from the loser."""
+    return k * (1.0 - expected_score(winner_rating, loser_rating))
+
+
+def rate_matches(ratings, results, k=K_FACTOR):
+    """Updates ratings with the results of some matches, in order.
+
+    Args:
+        ratings: a dict of player id to rating, updated in place. Players
+          missing from it start at `INITIAL_RATING`.
+        results: a list of (winner, loser) tuples.
+        k: the K-factor.
+
+    Returns:
+        A dict of player id to the number of matches they played.
+    """
+    games = {}
+    for (winner, loser) in results:
+        change = rating_change(ratings.get(winner, INITIAL_RATING),
+                               ratings.get(loser, INITIAL_RATING), k)
+        ratings[winner] = ratings.get(winner, INITIAL_RATING) + change
+        ratings[loser] = ratings.get(loser, INITIAL_RATING) - change
+        games[winner] = games.get(winner, 0) + 1
+        games[loser] = games.get(loser, 0) + 1
+    return games
+
+
+def batches(winners, losers, players):
+    """Splits a match history into batches where nobody plays twice.
+
+    Every match goes in the batch right after the last one either of its
+    players played in, so running the batches in order plays every player's
+    matches in their original order, and the matches of a batch can be rated
+    all at once.
+
+    Args:
+        winners: an array with the index of the winner of each match.
+        losers: an array with the index of the loser of each match.
+        players: the number of players.
+
+    Returns:
+        An array with the batch number of each match.
+    """
+    last = [-1] * players
+    batch = numpy.empty(len(winners), dtype=numpy.int64)
+    for i, (w, l) in enumerate(zip(winners.tolist(), losers.tolist())):
+        b = max(last[w], last[l]) + 1
+        batch[i] = last[w] = last[l] = b
+    return batch
+
+
+def replay(players, winners, losers, k=K_FACTOR):
+    """Rates every player from scratch from a match history.
+
+    Gives the same ratings as calling `rate_matches` on every match in order,
+    with one vectorized update per batch of matches, see `batches`.
+
+    Args:
+        players: a sequence with the id of every player.
+        winners: a sequence with the id of the winner of each match, in the
+          order they were played.
+        losers: a sequence with the id of the loser of each match.
+        k: the K-factor.
+
+    Returns:
+        A tuple (ratings, games) of arrays with the rating and the number of
+        matches of each player, in the order of `players`.
+    """
+    players = numpy.asarray(players, dtype=numpy.int64)
+    by_id = numpy.argsort(players)
+    # From here on winners and losers are indexes into `players`.
+    winners = by_id[numpy.searchsorted(
+        players[by_id], numpy.asarray(winners, dtype=numpy.int64))]
+    losers = by_id[numpy.searchsorted(
+        players[by_id], numpy.asarray(losers, dtype=numpy.int64))]
+
+    ratings = numpy.empty(len(players))
+    ratings.fill(INITIAL_RATING)
+    games = (numpy.bincount(winners, minlength=len(players)) +
+             numpy.bincount(losers, minlength=len(players)))
+    if not len(winners):
+        return ratings, games
+
+    batch = batches(winners, losers, len(players))
+    order = numpy.argsort(batch, kind='mergesort')
+    bounds = numpy.searchsorted(batch[order],
+                                numpy.arange(batch.max() + 2))
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        bw = winners[order[start:stop]]
+        bl = losers[order[start:stop]]
+        change = rating_change(ratings[bw], ratings[bl], k)
+        ratings[bw] += change
+        ratings[bl] -= change
+    return ratings, games
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#
+# simulator.py -- Monte Carlo simulation of Swiss-system tournaments
+#
+# Plays the same event many times, with results drawn from the players'
+# strengths, to find out how often the rules produce the right winner.
+#
+# usage: python tournament/simulator.py [events] [players] [rounds]
+
+import multiprocessing
+import sys
+import time
+
+import numpy
+
+import swiss
+
+# Events simulated by a worker process before reporting back.
+CHUNK_SIZE = 250
+
+
+def play_event(players, rounds, rng, spread=1.0):
+    """Plays a single event.
+
+    Players are paired with `swiss.pair_round` and the winners receive the
+    points `report_match` would give them.
+
+    Args:
+        players: the number of players.
+        rounds: how many rounds to play.
+        rng: a numpy.random.RandomState.
+        spread: standard deviation of the players' strengths. A player
+          beats one `spread` weaker about 73% of the time.
+
+    Returns:
+        A tuple of three boolean arrays, one entry per round:
+          strongest_leads: the strongest player is first in the standings.
+          tie_on_wins: the first two players have the same wins.
+          tie_on_points: the first two players have the same wins and points.
+    """
+    strength = rng.normal(0, spread, players)
+    strongest = numpy.argmax(strength)
+    ids = numpy.arange(players)
+    wins = numpy.zeros(players, dtype=int)
+    points = numpy.zeros(players, dtype=int)
+    played = set()
+    byes = set()
+
+    strongest_leads = numpy.zeros(rounds, dtype=bool)
+    tie_on_wins = numpy.zeros(rounds, dtype=bool)
+    tie_on_points = numpy.zeros(rounds, dtype=bool)
+    for r in xrange(rounds):
+        order = numpy.lexsort((ids, -points, -wins))
+        standings = [(i, None) for i in order.tolist()]
+        pairs = swiss.pair_round(standings, played, byes)
+        if pairs[-1][2] is None:
+            bye = pairs.pop()[0]
+            byes.add(bye)
+            wins[bye] += 1
+            points[bye] += swiss.BYE_POINTS
+
+        a = numpy.array([p[0] for p in pairs], dtype=int)
+        b = numpy.array([p[2] for p in pairs], dtype=int)
+        played.update(swiss.pair_key(i, j)
+                      for i, j in zip(a.tolist(), b.tolist()))
+        p_a = 1.0 / (1.0 + numpy.exp(strength[b] - strength[a]))
+        a_won = rng.random_sample(len(pairs)) < p_a
+        winners = numpy.where(a_won, a, b)
+        losers = numpy.where(a_won, b, a)
+        # Everybody plays once per round, so the losers' wins are still the
+        # ones `report_match` would read.
+        points[winners] += swiss.winner_points(wins[losers])
+        wins[winners] += 1
+
+        first, second = numpy.lexsort((ids, -points, -wins))[:2]
+        strongest_leads[r] = first == strongest
+        tie_on_wins[r] = wins[first] == wins[second]
+        tie_on_points[r] = tie_on_wins[r] and points[first] == points[second]
+    return strongest_leads, tie_on_wins, tie_on_points
+
+
+def simulate_chunk(args):
+    """Plays `events` events and returns the per-round counts of each stat.
+
+    The chunk's random numbers are seeded with both the simulation's seed and
+    the chunk's first event, so no two chunks of any two seeds share them.
+    """
+    events, players, rounds, seed, start, spread = args
+    rng = numpy.random.RandomState([seed, start])
+    totals = numpy.zeros((3, rounds), dtype=int)
+    for _ in xrange(events):
+        totals += play_event(players, rounds, rng, spread)
+    return totals
+
+
+def simulate(events, players, rounds=None, processes=None, seed=0,
+             spread=1.0):
+    """Plays the same event many times across a pool of processes.
+
+    Args:
+        events: how many events to simulate.
+        players: the number of players in each event.
+        rounds: how many rounds to play, by default the amount
+          `report_winner` requires.
+        processes: the size of the process pool, defaults to the number of
+          cores.
+        seed: the random seed, a non-negative integer. The same seed gives
+          the same results.
+        spread: standard deviation of the players' strengths.
+
+    Returns:
+        A dict with the number of `events`, `players` and `rounds`, and, for
+        each round, the fraction of events where:
+          strongest_leads: the strongest player was first.
+          tie_on_wins: the first two players had the same wins.
+          tie_on_points: the first two players had the same wins and points.
+
+    Raises:
+        ValueError: if there are no events to simulate.
+    """
+    if events < 1:
+        raise ValueError("At least one event must be simulated")
+    if rounds is None:
+        rounds = swiss.min_rounds(players)
+    chunks = [(min(CHUNK_SIZE, events - start), players, rounds,
+               seed, start, spread)
+              for start in xrange(0, events, CHUNK_SIZE)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        totals = sum(pool.imap_unordered(simulate_chunk, chunks))
+    finally:
+        pool.close()
+        pool.join()
+
+    rates = totals / float(events)
+    return {
+        'events': events,
+        'players': players,
+        'rounds': rounds,
+        'strongest_leads': rates[0].tolist(),
+        'tie_on_wins': rates[1].tolist(),
+        'tie_on_points': rates[2].tolist(),
+    }
+
+
+def rounds_needed(result, confidence=0.95):
+    """Returns the first round where the leader is clear often enough.
+
+    The leader is clear when no other player has the same wins and points.
+
+    Args:
+        result: a result from `simulate`.
+        confidence: the required fraction of events with a clear leader.
+
+    Returns:
+        The round number, starting at 1, or None if no simulated round
+        reached the confidence.
+    """
+    for r, tie in enumerate(result['tie_on_points']):
+        if 1 - tie >= confidence:
+            return r + 1
+    return None
+
+
+if __name__ == '__main__':
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    players = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    start = time.time()
+    result = simulate(events, players, rounds)
+    elapsed = time.time() - start
+
+    print "%s events of %s players in %.1fs" % (events, players, elapsed)
+    print "round  strongest leads  tie on wins  tie on wins and points"
+    for r in xrange(result['rounds']):
+        print "%5d  %15.3f  %11.3f  %22.3f" % (r + 1,
+                                               result['strongest_leads'][r],
+                                               result['tie_on_wins'][r],
+                                               result['tie_on_points'][r])
+    print "Rounds needed for a clear leader in 95%% of events: %s" % (
+        rounds_needed(result))
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+#
+# snapshot.py -- writes a snapshot of every tournament, see eventlog.py
+#
+# usage: python tournament/snapshot.py DIRECTORY [--keep 2]
+#
+# Meant to run periodically, from cron for instance, so that restoring a
+# tournament only replays the events logged since its latest snapshot. Only
+# the `--keep` most recent snapshots of each tournament are kept.
+
+import argparse
+import os
+
+import eventlog
+from tournament import iter_tournaments, snapshot_tournament
+
+
+def snapshot_all(directory, keep=2):
+    """Snapshots every tournament and removes their older snapshots.
+
+    Returns:
+        The list of paths written.
+    """
+    written = []
+    for (tournament, name) in iter_tournaments():
+        written.append(snapshot_tournament(tournament, directory))
+        snapshots = eventlog.list_snapshots(directory, tournament)
+        for (event, path) in snapshots[:-keep]:
+            os.remove(path)
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directory", help="where to write the snapshots")
+    parser.add_argument("--keep", type=int, default=2,
+                        help="snapshots kept for each tournament")
+    args = parser.parse_args()
+    paths = snapshot_all(args.directory, args.keep)
+    print "Wrote %s snapshots to %s." % (len(paths), args.directory)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+#
+# speculative.py -- next-round pairings prepared while a round is played
+#
+# A `SpeculativePairer` follows the standings of a tournament from their
+# events, see live.py, and tracks which boards of the round being played
+# have reported. Once only a few boards are pending, it pairs the next round
+# for every possible outcome of those boards in the background, so the next
+# round is a lookup as soon as the last result arrives:
+#
+#     boards = swiss_pairings(tid)        # publish round 1
+#     pairer = speculative.SpeculativePairer(tid, boards)
+#     pairer.start()
+#     ...                                 # scorekeepers call report_match
+#     boards = pairer.next_round()        # publish round 2
+#
+# The next round is paired like `swiss_pairings` without tiebreaks. Results
+# are expected for the boards of the round, byes reported with `report_bye`.
+# When the standings end up anything else, because of other results, new
+# players or deleted matches, the next round is read from the database
+# instead.
+
+import itertools
+import select
+import threading
+import time
+
+import live
+import swiss
+from tournament import played_pairs, swiss_pairings
+
+
+class SpeculativePairer(object):
+    """Keeps the pairings of a tournament's next round ready.
+
+    Create it before any result of the round is reported. `start` runs it in
+    a thread of its own, or `update` can be called from an event loop that
+    watches `fileno`, like `live.Subscriber.poll`.
+
+    Args:
+        tournament: the tournament id.
+        boards: the pairings of the round being played, as returned by
+          `swiss_pairings`.
+        max_pending: how many boards may still be pending when the next
+          round is paired for each of their outcomes, 2 ** max_pending
+          pairings at most.
+        subscriber: the `live.Subscriber` to follow the tournament with, a
+          new one by default.
+
+    Attributes:
+        boards: the pairings of the round being played.
+        candidates: a dict of outcome to the pairings of the next round
+          after it. An outcome is a tuple with the winner of each board of
+          `boards`.
+    """
+    def __init__(self, tournament, boards, max_pending=4, subscriber=None):
+        self.tournament = tournament
+        self.max_pending = max_pending
+        self._own_subscriber = subscriber is None
+        self.subscriber = subscriber or live.Subscriber()
+        self.live = self.subscriber.follow(tournament)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._read_played()
+        self._start_round(boards)
+
+    def _read_played(self):
+        played, byes = played_pairs(self.tournament)
+        self.played = set(played)
+        self.byes = set(byes)
+
+    def _start_round(self, boards):
+        self.boards = list(boards)
+        # (wins, matches, points) of every player when the round started.
+        self._start = dict((player, tuple(standing[1:]))
+                           for (player, standing)
+                           in self.live.players.iteritems())
+        self.candidates = {}
+
+    def fileno(self):
+        return self.subscriber.fileno()
+
+    def update(self):
+        """Applies the events received so far and pairs the outcomes left."""
+        with self._lock:
+            self.subscriber.poll()
+            self._speculate()
+
+    def run(self):
+        """Updates the pairings as events arrive, until `stop` is called."""
+        while not self._stopped.is_set():
+            if select.select([self], [], [], 0.5)[0]:
+                self.update()
+
+    def start(self):
+        """Runs `run` in a daemon thread."""
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the thread, and closes the subscriber if it created it."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._own_subscriber:
+            self.subscriber.close()
+
+    def info(self):
+        """Returns how many next rounds were looked up or paired again."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'candidates': len(self.candidates)}
+
+    def next_round(self, timeout=1.0):
+        """Returns the pairings of the next round and starts tracking it.
+
+        Waits up to `timeout` seconds for the events of the last results,
+        which arrive right after they are committed. Once every board has
+        reported, the pairings are looked up among the candidates, or paired
+        from the local standings. Otherwise they are read with
+        `swiss_pairings`.
+
+        Returns:
+            A list of (id1, name1, id2, name2), see `swiss_pairings`.
+        """
+        deadline = time.time() + timeout
+        while True:
+            with self._lock:
+                self.subscriber.poll()
+                outcome = self._outcome()
+                if outcome is not None:
+                    pairings = self.candidates.get(outcome)
+                    if pairings is None:
+                        pairings = self._pair(outcome)
+                        self.misses += 1
+                    else:
+                        self.hits += 1
+                    self._finish_round(pairings)
+                    return pairings
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            # The thread of `start` may apply the events first, so this
+            # doesn't wait for them for long.
+            select.select([self], [], [], min(remaining, 0.05))
+
+        pairings = swiss_pairings(self.tournament)
+        with self._lock:
+            self.subscriber.poll()
+            self.misses += 1
+            self._read_played()
+            self._start_round(pairings)
+        return pairings
+
+    def _finish_round(self, pairings):
+        for (id1, name1, id2, name2) in self.boards:
+            if id2 is None:
+                self.byes.add(id1)
+            else:
+                self.played.add(swiss.pair_key(id1, id2))
+        self._start_round(pairings)
+
+    def _result(self, player):
+        """Returns whether a player won their board, None while pending.
+
+        Raises:
+            ValueError: if the player's standings changed in any other way.
+        """
+        start = self._start.get(player)
+        standing = self.live.players.get(player)
+        if start is None or standing is None:
+            raise ValueError("Player %s is not in the round" % player)
+        wins, matches, points = standing[1:]
+        if matches == start[1]:
+            return None
+        if matches != start[1] + 1 or wins - start[0] not in (0, 1):
+            raise ValueError("Player %s played more than one board" % player)
+        return wins - start[0]
+
+    def _options(self):
+        """Returns the possible winners of each board.
+
+        Returns:
+            A list of tuples, a single winner for the boards that reported,
+            or None if the standings are not the ones of the round's boards.
+        """
+        options = []
+        try:
+            if set(self._start) != set(self.live.players):
+                return None
+            for (id1, name1, id2, name2) in self.boards:
+                result = self._result(id1)
+                if id2 is None:
+                    if result == 0:
+                        return None
+                    options.append((id1,))
+                    continue
+                other = self._result(id2)
+                if result is None and other is None:
+                    options.append((id1, id2))
+                elif (result, other) == (1, 0):
+                    options.append((id1,))
+                elif (result, other) == (0, 1):
+                    options.append((id2,))
+                else:
+                    return None
+        except ValueError:
+            return None
+        return options
+
+    def _speculate(self):
+        options = self._options()
+        if options is None:
+            self.candidates = {}
+            return
+        pending = sum(1 for option in options if len(option) > 1)
+        if pending > self.max_pending:
+            return
+        # Outcomes that are still possible were paired already.
+        candidates = {}
+        for outcome in itertools.product(*options):
+            pairings = self.candidates.get(outcome)
+            candidates[outcome] = (pairings if pairings is not None
+                                   else self._pair(outcome))
+        self.candidates = candidates
+
+    def _outcome(self):
+        """Returns the outcome of the round once every board has reported.
+
+        Returns:
+            None while a board is pending, or when the standings are not the
+            ones the outcome gives.
+        """
+        options = self._options()
+        if options is None or any(len(option) > 1 for option in options):
+            return None
+        outcome = tuple(option[0] for option in options)
+        # Also tells a pending bye from a reported one.
+        standings = dict((player, tuple(standing[1:]))
+                         for (player, standing)
+                         in self.live.players.iteritems())
+        if self._standings(outcome) != standings:
+            return None
+        return outcome
+
+    def _standings(self, outcome):
+        """Returns the (wins, matches, points) of each player after an outcome.
+
+        Points are counted like `report_match` does, from the wins the loser
+        had at the start of the round.
+        """
+        standings = dict((player, list(start))
+                         for (player, start) in self._start.iteritems())
+        for ((id1, name1, id2, name2), winner) in zip(self.boards, outcome):
+            if id2 is None:
+                points = swiss.BYE_POINTS
+            else:
+                loser = id2 if winner == id1 else id1
+                points = swiss.winner_points(self._start[loser][0])
+                standings[loser][1] += 1
+            standings[winner][0] += 1
+            standings[winner][1] += 1
+            standings[winner][2] += points
+        return dict((player, tuple(standing))
+                    for (player, standing) in standings.iteritems())
+
+    def _pair(self, outcome):
+        """Pairs the next round after an outcome of the round's boards."""
+        standings = self._standings(outcome)
+        ranked = sorted(standings.iteritems(),
+                        key=lambda item: (-item[1][0], -item[1][2], item[0]))
+        played = set(self.played)
+        byes = set(self.byes)
+        for (id1, name1, id2, name2) in self.boards:
+            if id2 is None:
+                byes.add(id1)
+            else:
+                played.add(swiss.pair_key(id1, id2))
+        return swiss.pair_round([(player, self.live.players[player][0],
+                                  wins, matches)
+                                 for (player, (wins, matches, points))
+                                 in ranked],
+                                played, byes)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+#
+# Concurrency stress test for report_match
+#
+# Many processes report random matches of the same tournament at once. The
+# standings and round standings must then match the recorded matches, and
+# replaying the matches in the order they were recorded must give every winner
+# the points it got. Replaying the event log must give the same standings.
+# It prints the sustained results per second for each number of writers and
+# wipes the configured database, just like tournament_test.py.
+#
+# usage: python tournament/stress_test.py [--writers 8,32,128] [--seconds 10]
+#                                         [--players 1000]
+#
+# Every writer holds its own connection, PostgreSQL's max_connections must be
+# above the largest number of writers.
+
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+
+import db
+import swiss
+import tournament_memory
+from tournament import *
+
+WRITERS = [8, 32, 128]
+
+
+def writer(args):
+    """Reports random matches from `start` until `stop`.
+
+    Returns:
+        The number of matches reported.
+    """
+    tournament, players, start, stop, seed = args
+    # Each writer needs a single connection.
+    db.configure(minconn=0, maxconn=1)
+    rng = random.Random(seed)
+    while time.time() < start:
+        time.sleep(0.01)
+    reported = 0
+    while time.time() < stop:
+        winner, loser = rng.sample(players, 2)
+        report_match(tournament, winner, loser)
+        reported += 1
+    return reported
+
+
+def run(writers, seconds, players):
+    """Reports matches from `writers` processes for `seconds` seconds.
+
+    Returns:
+        A tuple (tournament id, matches reported).
+    """
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+    tid = register_tournament("Stress test")
+    ids = register_players(["Player %s" % i for i in xrange(players)])
+    register_players_into_tournament(tid, ids)
+
+    # Writers start together, once all of them are up.
+    start = time.time() + 1 + writers * 0.02
+    stop = start + seconds
+    pool = multiprocessing.Pool(writers)
+    try:
+        counts = pool.map(writer, [(tid, ids, start, stop, seed)
+                                   for seed in xrange(writers)])
+    finally:
+        pool.close()
+        pool.join()
+    return tid, sum(counts)
+
+
+def assert_consistent(tournament):
+    """Checks the standings and the points against the recorded matches."""
+    with new_transaction() as cr:
+        cr.execute("""
+            select standings.player
+              from standings
+              left join matches
+                on matches.tournament = standings.tournament
+               and matches.player = standings.player
+             where standings.tournament = %s
+             group by standings.player, standings.wins, standings.matches,
+                      standings.points
+            having standings.wins <> coalesce(sum(matches.won), 0)
+                or standings.matches <> count(matches.won)
+                or standings.points <> coalesce(sum(matches.points), 0)
+        """, (tournament,))
+        wrong = [row[0] for row in cr.fetchall()]
+        # Every match has a round, so the latest round standings of each
+        # player are their standings.
+        cr.execute("""
+            select standings.player
+              from standings
+              left join ( select distinct on (player)
+                                 player, wins, matches, points
+                            from round_standings
+                           where tournament = %(tournament)s
+                           order by player, round desc ) latest
+                on latest.player = standings.player
+             where standings.tournament = %(tournament)s
+               and (standings.wins, standings.matches, standings.points) <>
+                   (coalesce(latest.wins, 0), coalesce(latest.matches, 0),
+                    coalesce(latest.points, 0))
+        """, {'tournament': tournament})
+        wrong_rounds = [row[0] for row in cr.fetchall()]
+        cr.execute("""
+            select player, opponent, won, points from matches
+             where tournament = %s
+             order by id
+        """, (tournament,))
+        matches = cr.fetchall()
+    if wrong:
+        raise ValueError("The standings of players %s don't match their "
+                         "matches" % wrong)
+    if wrong_rounds:
+        raise ValueError("The round standings of players %s don't match "
+                         "their standings" % wrong_rounds)
+
+    # Reports that share a player run one after the other, the ids of their
+    # matches follow that order.
+    wins = {}
+    for (player, opponent, won, points) in matches:
+        if won and opponent is not None:
+            expected = swiss.winner_points(wins.get(opponent, 0))
+            if points != expected:
+                raise ValueError(
+                    "Player %s got %s points for beating player %s, "
+                    "who had %s wins" % (player, points, opponent,
+                                         wins.get(opponent, 0)))
+        wins[player] = wins.get(player, 0) + won
+
+    tournament_memory.reset()
+    tournament_memory.restore(tournament, iter_events(tournament))
+    if (tournament_memory.player_standings(tournament) !=
+            player_standings(tournament)):
+        raise ValueError("Replaying the event log gives other standings")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--writers", default=",".join(str(w) for w in WRITERS),
+                        help="comma separated numbers of writer processes")
+    parser.add_argument("--seconds", type=float, default=10,
+                        help="how long each run lasts")
+    parser.add_argument("--players", type=int, default=1000,
+                        help="players in the tournament")
+    args = parser.parse_args()
+
+    for i, writers in enumerate(int(w) for w in args.writers.split(",")):
+        tid, reported = run(writers, args.seconds, args.players)
+        assert_consistent(tid)
+        print "%s. %s writers: %s matches, %.0f results/s, standings are " \
+              "consistent." % (i + 1, writers, reported,
+                               reported / args.seconds)
+    print "Success!  Concurrent reports are consistent!"
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
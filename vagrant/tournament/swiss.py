@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+#
+# swiss.py -- Swiss-system rules shared by the tournament backends
+#
+
+import math
+import multiprocessing
+
+from matching import max_weight_matching
+
+
+def winner_points(loser_wins):
+    """Returns the points a win over a player with `loser_wins` wins is worth.
+
+    The winner receives as points the ammount of wins the loser has plus one.
+    This will give more value to a win over a player that has more wins and
+    the amount of points a user has can be used to find the best match, and
+    the winner in case of ties.
+    """
+    return loser_wins + 1
+
+
+# A bye counts as a win over a player with no wins.
+BYE_POINTS = winner_points(0)
+
+
+def min_rounds(players):
+    """Returns how many rounds are needed before a tournament has a winner.
+
+    Args:
+        players: the number of players in the tournament.
+    """
+    if players < 2:
+        return 0
+    return int(round(math.log(players, 2)))
+
+
+def pair_key(player, opponent):
+    """Returns the key of a pairing in a set of played pairs."""
+    return (player, opponent) if player < opponent else (opponent, player)
+
+
+def choose_bye(standings, byes):
+    """Returns the player who sits out the round in an odd field.
+
+    The bye goes to the lowest ranked player who hasn't had one yet, or to the
+    lowest ranked player if everybody already had one.
+
+    Args:
+        standings: a list of (id, name, wins, matches) in ranking order.
+        byes: a set of the ids of the players that already had a bye.
+    """
+    for player in reversed(standings):
+        if player[0] not in byes:
+            return player
+    return standings[-1]
+
+
+def pair_round(standings, played, byes=()):
+    """Pairs the players for the next round.
+
+    Players are paired down the standings, each one with the highest ranked
+    player below them they haven't played yet, which keeps the pairings
+    within score groups and floats players down only when needed. If that
+    leaves players that can only be paired for a rematch, the pairs around
+    them are reworked with a weighted matching.
+
+    Args:
+        standings: a list of (id, name, wins, matches) in ranking order, as
+          returned by `player_standings`.
+        played: a set of `pair_key(player, opponent)` of every match played.
+        byes: a set of the ids of the players that already had a bye.
+
+    Returns:
+      A list of tuples, each of which contains (id1, name1, id2, name2). In
+      an odd field the last tuple is (id, name, None, None) for the player
+      who gets the bye.
+    """
+    players = list(standings)
+    bye = None
+    if len(players) % 2:
+        bye = choose_bye(players, byes)
+        players.remove(bye)
+
+    ids = [p[0] for p in players]
+    n = len(ids)
+    partner = [-1] * n
+    stuck = []
+    for i in xrange(n):
+        if partner[i] != -1:
+            continue
+        j = i + 1
+        while j < n and (partner[j] != -1 or
+                         pair_key(ids[i], ids[j]) in played):
+            j += 1
+        if j < n:
+            partner[i] = j
+            partner[j] = i
+        else:
+            stuck.append(i)
+
+    if stuck:
+        repair_pairings(ids, partner, stuck, played)
+
+    pairs = [(players[i][0], players[i][1],
+              players[partner[i]][0], players[partner[i]][1])
+             for i in xrange(n) if i < partner[i]]
+    if bye:
+        pairs.append((bye[0], bye[1], None, None))
+    return pairs
+
+
+# Pairing takes about a microsecond per player unless rematches have to be
+# reworked, while starting a pool of processes takes about 100ms. Below this
+# many players in all, rounds are paired in the calling process by default.
+POOL_MIN_PLAYERS = 100000
+
+
+def _pair_round(args):
+    return pair_round(*args)
+
+
+def pair_rounds(rounds, processes=None):
+    """Pairs the next round of many tournaments across a pool of processes.
+
+    Tournaments are handed out largest first, so the largest one starts
+    right away and the smaller ones are paired by the other processes in the
+    meantime.
+
+    Args:
+        rounds: a list of (standings, played, byes) tuples, the arguments of
+          `pair_round` for each tournament.
+        processes: the size of the process pool. By default it is the number
+          of cores, or no pool at all for fewer than `POOL_MIN_PLAYERS`
+          players. With a single process, or a single tournament, the rounds
+          are paired in this process.
+
+    Returns:
+        The list of pairings of each tournament, in the order of `rounds`.
+    """
+    if processes is None:
+        players = sum(len(args[0]) for args in rounds)
+        processes = (multiprocessing.cpu_count()
+                     if players >= POOL_MIN_PLAYERS else 1)
+    processes = min(processes, len(rounds))
+    if processes <= 1:
+        return [pair_round(*args) for args in rounds]
+    order = sorted(xrange(len(rounds)), key=lambda i: -len(rounds[i][0]))
+    pool = multiprocessing.Pool(processes)
+    try:
+        paired = pool.map(_pair_round, [rounds[i] for i in order],
+                          chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    pairings = [None] * len(rounds)
+    for (i, pairs) in zip(order, paired):
+        pairings[i] = pairs
+    return pairings
+
+
+def repair_pairings(ids, partner, stuck, played):
+    """Pairs the players the greedy pass couldn't pair.
+
+    The stuck players are matched together with the players of the pairs
+    closest to them in the standings. The window of reworked pairs doubles
+    until a pairing without rematches is found, or until it covers the whole
+    field, in which case the pairing with the fewest rematches is used.
+
+    Args:
+        ids: the player ids in ranking order.
+        partner: the index of each player's opponent, -1 for stuck players.
+          It is updated in place.
+        stuck: the indexes of the players without an opponent.
+        played: a set of `pair_key(player, opponent)` of every match played.
+    """
+    paired = [i for i in xrange(len(ids)) if i < partner[i]]
+    size = 1
+    while True:
+        nearest = sorted(paired,
+                         key=lambda i: min(abs(i - s) for s in stuck))[:size]
+        window = sorted(stuck + nearest + [partner[i] for i in nearest])
+        mates, rematches = weighted_pairing(ids, window, played)
+        if rematches == 0 or size >= len(paired):
+            for i, j in mates:
+                partner[i] = j
+                partner[j] = i
+            return
+        size *= 2
+
+
+def weighted_pairing(ids, window, played):
+    """Finds the best perfect pairing of a set of players.
+
+    Pairing two players costs the square of their distance in the standings,
+    and rematches cost more than any pairing without them, so the result has
+    the fewest possible rematches and, among those, the closest opponents.
+
+    Args:
+        ids: the player ids in ranking order.
+        window: the indexes in `ids` of the players to pair.
+        played: a set of `pair_key(player, opponent)` of every match played.
+
+    Returns:
+        A tuple (pairs, rematches) with a list of (index, index) pairs and how
+        many of them are rematches.
+    """
+    n = len(window)
+    span = window[-1] - window[0]
+    rematch_cost = (n // 2) * span * span + 1
+    max_cost = span * span + rematch_cost
+    edges = []
+    for a in xrange(n):
+        for b in xrange(a + 1, n):
+            i, j = window[a], window[b]
+            cost = (j - i) ** 2
+            if pair_key(ids[i], ids[j]) in played:
+                cost += rematch_cost
+            edges.append((a, b, max_cost - cost))
+    mate = max_weight_matching(edges, maxcardinality=True)
+
+    pairs = [(window[a], window[mate[a]]) for a in xrange(n) if a < mate[a]]
+    rematches = sum(1 for (i, j) in pairs
+                    if pair_key(ids[i], ids[j]) in played)
+    return pairs, rematches
+
+
+# Tiebreak systems, each of them worth more the higher it is:
+#   buchholz: the sum of the wins of every opponent.
+#   median_buchholz: the Buchholz score without the best and the worst
+#     opponents, when there are at least three of them.
+#   sonneborn_berger: the sum of the wins of every opponent beaten.
+#   head_to_head: the wins over opponents who have as many wins.
+# They are computed with the current wins, byes are left out.
+TIEBREAKS = ('buchholz', 'median_buchholz', 'sonneborn_berger',
+             'head_to_head')
+
+# Ranks players by their Elo rating across tournaments, see ratings.py. It
+# can follow or replace the tiebreaks above, on its own it seeds round one,
+# when every player has the same wins.
+RATING = 'rating'
+
+
+def tiebreak_names(tiebreak):
+    """Returns a tuple with the names of the tiebreaks to apply, in order.
+
+    Args:
+        tiebreak: a name from `TIEBREAKS` or `RATING`, a sequence of them,
+          or None.
+
+    Raises:
+        ValueError: if a name is not in `TIEBREAKS` or `RATING`.
+    """
+    if tiebreak is None:
+        return ()
+    if isinstance(tiebreak, basestring):
+        tiebreak = (tiebreak,)
+    names = tuple(tiebreak)
+    for name in names:
+        if name not in TIEBREAKS and name != RATING:
+            raise ValueError("Unknown tiebreak: %s" % name)
+    return names
+
+
+def tiebreak_scores(wins, results):
+    """Computes every tiebreak of every player.
+
+    Args:
+        wins: a dict of player id to wins for the players to score.
+        results: (player, opponent, won) for each side of every match, with a
+          None opponent for a bye.
+
+    Returns:
+        A dict of player id to a dict of tiebreak name to score.
+    """
+    opponents = dict((player, []) for player in wins)
+    for (player, opponent, won) in results:
+        if opponent is not None and player in opponents:
+            opponents[player].append((wins.get(opponent, 0), won))
+
+    scores = {}
+    for player, faced in opponents.iteritems():
+        faced_wins = sorted(w for (w, won) in faced)
+        median = faced_wins[1:-1] if len(faced_wins) >= 3 else faced_wins
+        scores[player] = {
+            'buchholz': sum(faced_wins),
+            'median_buchholz': sum(median),
+            'sonneborn_berger': sum(w for (w, won) in faced if won),
+            'head_to_head': sum(1 for (w, won) in faced
+                                if won and w == wins[player]),
+        }
+    return scores
@@ -3,73 +3,654 @@
 # tournament.py -- implementation of a Swiss-system tournament
 #
 
+import sys
+import time
+
+import numpy
 import psycopg2
-import math
+
+import cache
+import columnar
+import db
+import eventlog
+import live
+import metrics
+import ratings
+import swiss
+
+
+# Maximum number of rows sent in a single multi-row insert.
+BULK_CHUNK_SIZE = 5000
+
+# Rows fetched per round trip by the iter_* functions.
+ITER_BATCH_SIZE = 2000
+
+# Queries on the hot path. explain_test.py checks that their plans keep using
+# indexes as the match history grows. Most of them run as prepared
+# statements, see `db.execute_prepared`.
+# Ordering by -player desc instead of player lets the standings_rank index
+# return the rows in order.
+STANDINGS_QUERY = """
+    select standings.player, players.name, wins, matches
+      from standings
+      join players on players.id = standings.player
+     where standings.tournament = %s
+     order by wins desc, points desc, -standings.player desc
+"""
+
+STANDINGS_PAGE_QUERY = """
+    select standings.player, players.name, wins, matches
+      from standings
+      join players on players.id = standings.player
+     where standings.tournament = %(tournament)s
+       and (wins, points, -standings.player) < (
+           select wins, points, -player from standings
+            where tournament = %(tournament)s
+              and player = %(after)s )
+     order by wins desc, points desc, -standings.player desc
+     limit %(limit)s
+"""
+
+# The standings after round %(round)s, to read in place of the standings
+# table: every registered player with the latest of their round standings up
+# to that round. Scanning the primary key backwards gives the latest rounds
+# first.
+AS_OF_ROUND_STANDINGS = """(
+        select standings.tournament, standings.player,
+               coalesce(latest.wins, 0) as wins,
+               coalesce(latest.matches, 0) as matches,
+               coalesce(latest.points, 0) as points
+          from standings
+          left join ( select distinct on (player)
+                             player, wins, matches, points
+                        from round_standings
+                       where tournament = %(tournament)s
+                         and round <= %(round)s
+                       order by player desc, round desc ) latest
+            on latest.player = standings.player
+         where standings.tournament = %(tournament)s )"""
+
+ROUND_STANDINGS_QUERY = """
+    with ranked as (
+        select standings.player, players.name, wins, matches,
+               row_number() over (order by wins desc, points desc,
+                                           standings.player) as rank
+          from {standings} standings
+          join players on players.id = standings.player
+    )
+    select player, name, wins, matches
+      from ranked
+     where %(after)s is null
+        or rank > (select rank from ranked where player = %(after)s)
+     order by rank
+     limit %(limit)s
+""".format(standings=AS_OF_ROUND_STANDINGS)
+
+PLAYER_HISTORY_QUERY = """
+    select round, wins, matches
+      from round_standings
+     where tournament = %s
+       and player = %s
+     order by round
+"""
+
+# Standings ordered by tiebreaks, see `swiss.TIEBREAKS`. All of them are
+# computed at once from the tournament's matches, {order} lists the ones used,
+# along with the players' ratings for `swiss.RATING`. {standings} is either
+# the standings table or `AS_OF_ROUND_STANDINGS`, with {rounds} leaving out
+# the matches of later rounds.
+TIEBREAK_STANDINGS_QUERY = """
+    with results as (
+        select matches.player, matches.opponent, matches.won,
+               case when matches.opponent is not null
+                    then coalesce(opponent.wins, 0) end as opponent_wins
+          from matches
+          left join {standings} opponent
+            on opponent.tournament = matches.tournament
+           and opponent.player = matches.opponent
+         where matches.tournament = %(tournament)s {rounds}
+    ), faced as (
+        select player, won, opponent_wins,
+               sum(won) over (partition by player) as wins,
+               count(opponent_wins) over (partition by player) as opponents,
+               row_number() over (partition by player
+                                  order by opponent_wins nulls last,
+                                           opponent)
+                   as from_worst,
+               row_number() over (partition by player
+                                  order by opponent_wins desc nulls last,
+                                           opponent desc)
+                   as from_best
+          from results
+    ), tiebreaks as (
+        select player,
+               sum(opponent_wins) as buchholz,
+               sum(case when opponents < 3
+                          or (from_worst > 1 and from_best > 1)
+                        then opponent_wins end) as median_buchholz,
+               sum(opponent_wins * won) as sonneborn_berger,
+               sum(case when opponent_wins = wins then won end)
+                   as head_to_head
+          from faced
+         group by player
+    ), ranked as (
+        select standings.player, players.name, wins, matches,
+               row_number() over (order by wins desc, {order},
+                                           points desc,
+                                           standings.player) as rank
+          from {standings} standings
+          join players on players.id = standings.player
+          join ratings on ratings.player = standings.player
+          left join tiebreaks on tiebreaks.player = standings.player
+         where standings.tournament = %(tournament)s
+    )
+    select player, name, wins, matches
+      from ranked
+     where %(after)s is null
+        or rank > (select rank from ranked where player = %(after)s)
+     order by rank
+     limit %(limit)s
+"""
+
+# Locks the standings and the ratings of the players of a match, or of a
+# round, before the losers' wins and everybody's ratings are read, so
+# concurrent reports for the same players run one after the other and each
+# sees the wins and ratings left by the previous one. Locking in player order
+# keeps two reports from waiting on each other.
+PLAYERS_WINS_QUERY = """
+    select standings.player, standings.wins, standings.matches,
+           standings.points, ratings.rating
+      from standings
+      join ratings on ratings.player = standings.player
+     where standings.tournament = %s
+       and standings.player = any(%s)
+     order by standings.player
+       for update
+"""
+
+# Sets the new ratings of the players of some matches and adds the matches
+# they played.
+RATE_MATCHES_QUERY = """
+    update ratings
+       set rating = played.rating,
+           games = ratings.games + played.games
+      from ( select unnest(%s::integer[]) as player,
+                    unnest(%s::real[]) as rating,
+                    unnest(%s::integer[]) as games ) played
+     where ratings.player = played.player
+"""
+
+REPORT_MATCH_QUERY = """
+    insert into matches ( tournament, round, player, opponent, won, points )
+    values ( %(tournament)s, %(round)s, %(winner)s, %(loser)s, 1,
+             %(points)s ),
+           ( %(tournament)s, %(round)s, %(loser)s, %(winner)s, 0, 0 )
+"""
+
+COUNT_PLAYERS_QUERY = """
+    select count(1) from tournament_players where tournament = %s
+"""
+
+DELETE_MATCHES_QUERY = "delete from matches where tournament = %s"
+
+# Run before deleting the matches of a tournament, so the triggers find no
+# round standings to update.
+DELETE_ROUND_STANDINGS_QUERY = """
+    delete from round_standings where tournament = %s
+"""
+
+# Standings events, see live.py. They are sent when the transaction commits.
+PUBLISH_QUERY = "select pg_notify(%s, %s)"
+
+PUBLISH_ALL_QUERY = "select pg_notify(%s || id, %s) from tournaments"
+
+# New rows of players that changed, for the events of live.py.
+CHANGED_STANDINGS_QUERY = """
+    select standings.player, wins, matches, points, players.name
+      from standings
+      join players on players.id = standings.player
+     where standings.tournament = %s
+       and standings.player = any(%s)
+"""
+
+LOG_EVENT_QUERY = """
+    insert into events ( tournament, kind, payload ) values ( %s, %s, %s )
+"""
+
+# Events after `after` and up to `until`, see `iter_events`. Players
+# registered outside of the tournament are left out of its events.
+EVENTS_QUERY = """
+    select id, tournament, kind, payload
+      from events
+     where id > %(after)s
+       and (%(until)s is null or id <= %(until)s)
+       and (%(tournament)s is null
+            or tournament = %(tournament)s
+            or (tournament is null and kind <> %(register_players)s))
+     order by id
+"""
+
+SNAPSHOT_PLAYERS_QUERY = """
+    select standings.player, standings.wins, standings.matches,
+           standings.points, ratings.games, ratings.rating, players.name
+      from standings
+      join players on players.id = standings.player
+      join ratings on ratings.player = standings.player
+     where standings.tournament = %s
+     order by standings.player
+"""
+
+# Every match and bye once, from the winner's side, see `eventlog.RESULT`.
+SNAPSHOT_RESULTS_QUERY = """
+    select coalesce(round, 0), player, coalesce(opponent, 0), points
+      from matches
+     where tournament = %s
+       and won = 1
+     order by id
+"""
+
+# Players registered into a tournament or in its matches, see columnar.py.
+EXPORTED_PLAYERS = """(
+    select player from tournament_players where tournament = %(tournament)s
+     union
+    select player from matches where tournament = %(tournament)s
+     union
+    select opponent from matches
+     where tournament = %(tournament)s
+       and opponent is not null
+)"""
+
+EXPORT_COUNTS_QUERY = """
+    select ( select count(*) from """ + EXPORTED_PLAYERS + """ exported ),
+           ( select count(*) from matches where tournament = %(tournament)s )
+"""
+
+EXPORT_PLAYERS_QUERY = """
+    copy ( select players.id,
+                  (registered.player is not null)::integer,
+                  players.name
+             from """ + EXPORTED_PLAYERS + """ exported
+             join players on players.id = exported.player
+             left join tournament_players registered
+               on registered.tournament = %(tournament)s
+              and registered.player = exported.player
+            order by players.id )
+      to stdout with (format binary)
+"""
+
+EXPORT_MATCHES_QUERY = """
+    copy ( select coalesce(round, 0), player, coalesce(opponent, 0),
+                  coalesce(won, -1), coalesce(points, 0)
+             from matches
+            where tournament = %(tournament)s
+            order by id )
+      to stdout with (format binary)
+"""
+
+IMPORT_TABLES_QUERY = """
+    create temporary table imported_players ( id integer,
+                                              registered integer,
+                                              name text,
+                                              new_id integer )
+      on commit drop;
+    create temporary table imported_matches ( position serial,
+                                              round integer,
+                                              player integer,
+                                              opponent integer,
+                                              won integer,
+                                              points integer )
+      on commit drop;
+"""
+
+IMPORT_PLAYERS_QUERY = """
+    copy imported_players ( id, registered, name )
+      from stdin with (format binary)
+"""
+
+IMPORT_MATCHES_QUERY = """
+    copy imported_matches ( round, player, opponent, won, points )
+      from stdin with (format binary)
+"""
+
+# Imported players get new ids, drawn up front so that the matches can be
+# mapped to them. Matches are inserted before the players are registered
+# into the tournament, the registrations then compute the standings and the
+# round standings of each player at once, see add_standings.
+IMPORT_QUERY = """
+    update imported_players
+       set new_id = nextval(pg_get_serial_sequence('players', 'id'));
+    insert into players ( id, name )
+    select new_id, name from imported_players order by new_id;
+    insert into matches ( tournament, round, player, opponent, won, points )
+    select %(tournament)s, nullif(round, 0), players.new_id,
+           opponents.new_id, nullif(won, -1), points
+      from imported_matches
+      join imported_players players on players.id = imported_matches.player
+      left join imported_players opponents
+        on opponents.id = imported_matches.opponent
+     order by position;
+    insert into tournament_players ( tournament, player )
+    select %(tournament)s, new_id from imported_players
+     where registered = 1;
+    select id, new_id, name from imported_players order by id;
+"""
+
+PLAYED_PAIRS_QUERY = """
+    select player, opponent from matches
+     where tournament = %s
+       and (opponent is null or player < opponent)
+"""
+
+# The standings and played pairs of many tournaments at once, see
+# `player_standings_many`.
+STANDINGS_MANY_QUERY = """
+    select standings.tournament, standings.player, players.name, wins,
+           matches
+      from standings
+      join players on players.id = standings.player
+     where standings.tournament = any(%s)
+     order by standings.tournament, wins desc, points desc,
+              -standings.player desc
+"""
+
+PLAYED_PAIRS_MANY_QUERY = """
+    select tournament, player, opponent from matches
+     where tournament = any(%s)
+       and (opponent is null or player < opponent)
+"""
+
+# Whether the matches table of each database (by connection string) is
+# partitioned by tournament, see partitioning.sql.
+_partitioned = {}
 
 
 class new_transaction:
-    """Handles opening and closing new connections/transtactions.
+    """Handles borrowing pooled connections and running transactions.
 
     This class should be used within a `with` keyword. The code inside it
     will be executed on a new database transaction that will be committed
-    after leaving the `with` statement.
+    after leaving the `with` statement, or rolled back if it raised. The
+    connection is taken from, and given back to, the pool in `db`.
+
+    When a `cursor_name` is given the cursor is a server-side cursor, which
+    fetches the results in batches of `cr.itersize` rows as they are iterated
+    instead of all at once.
+
+    Transactions that only read can be `readonly`, they run on a read replica
+    when there are any, see `db.getconn_for_read`. Committing any other
+    transaction counts as a write for `db.config['read_your_writes']`. While
+    the read cache is enabled they run on the primary instead, so a lagging
+    replica can't fill the cache with results older than this process's own
+    changes, see cache.py.
 
     Example:
         with new_transaction() as cr:
             cr.execute("delete * from users")
     """
+    def __init__(self, cursor_name=None, readonly=False):
+        self.cursor_name = cursor_name
+        self.readonly = readonly
+
     def __enter__(self):
-        self.db = connect()
-        self.cr = self.db.cursor()
+        if not metrics.enabled():
+            self._getconn()
+            return self._cursor()
+
+        # Everything is recorded under the name of the function that opened
+        # the transaction.
+        label = sys._getframe(1).f_code.co_name
+        start = time.time()
+        self._getconn()
+        metrics.observe('connection_wait_seconds', label, time.time() - start)
+        cr = self._cursor(cursor_factory=metrics.TimedCursor)
+        cr.label = label
+        return cr
+
+    def _getconn(self):
+        if self.readonly and not cache.enabled():
+            self.pool, self.db = db.getconn_for_read()
+        else:
+            self.pool = db.get_pool()
+            self.db = self.pool.getconn()
+
+    def _cursor(self, **options):
+        try:
+            if self.cursor_name:
+                self.cr = self.db.cursor(name=self.cursor_name, **options)
+            else:
+                self.cr = self.db.cursor(**options)
+        except BaseException:
+            self.pool.putconn(self.db)
+            raise
         return self.cr
 
     def __exit__(self, type, value, traceback):
-        self.db and self.db.commit()
-        self.cr and self.cr.close()
-        self.db and self.db.close()
+        try:
+            self.cr.close()
+            if type is None:
+                self.db.commit()
+                if not self.readonly:
+                    db.wrote()
+            else:
+                self.db.rollback()
+        except psycopg2.Error:
+            # A failed rollback means the connection itself is gone, that
+            # error must not hide the one raised inside the `with` block.
+            if type is None:
+                raise
+        finally:
+            self.pool.putconn(self.db)
+
+
+def chunks(items, size):
+    """Splits a list into consecutive slices of at most `size` items."""
+    items = list(items)
+    return [items[i:i+size] for i in xrange(0, len(items), size)]
+
+
+@metrics.timed
+def connect():
+    """Connect to the PostgreSQL database.  Returns a database connection.
 
+    The connection is not pooled, use `new_transaction` instead whenever
+    possible.
+    """
+    return psycopg2.connect(db.config['dsn'])
 
-def connect():
-    """Connect to the PostgreSQL database.  Returns a database connection."""
-    return psycopg2.connect("dbname=tournament")
+
+def publish(cr, tournament, event, rows=()):
+    """Sends a standings event to the subscribers of a tournament.
+
+    See live.py, the event is only sent if the transaction of `cr` commits.
+    """
+    for payload in live.encode(event, rows):
+        db.execute_prepared(cr, "publish", PUBLISH_QUERY,
+                            (live.channel(tournament), payload))
+
+
+def publish_changes(cr, tournament, players, event=live.UPDATE):
+    """Sends the current standings of some players of a tournament.
+
+    Returns:
+        The rows of `CHANGED_STANDINGS_QUERY` of the players.
+    """
+    cr.execute(CHANGED_STANDINGS_QUERY, (tournament, list(players)))
+    rows = cr.fetchall()
+    publish(cr, tournament, event,
+            [row[:4] for row in rows] if event == live.UPDATE else rows)
+    return rows
+
+
+def log_event(cr, kind, tournament=None, payload=""):
+    """Appends an event to the log, see eventlog.py.
+
+    The event is only kept if the transaction of `cr` commits.
+    """
+    db.execute_prepared(cr, "log_event", LOG_EVENT_QUERY,
+                        (tournament, kind, psycopg2.Binary(payload)))
+
+
+def updated_standings(locked, sides):
+    """Returns the standings of some players after some matches.
+
+    Args:
+        locked: the rows of `PLAYERS_WINS_QUERY` for the players.
+        sides: (player, won, points) for each side of the matches.
+
+    Returns:
+        A list of (player, wins, matches, points) of the players who played.
+    """
+    rows = dict((row[0], list(row[:4])) for row in locked)
+    for (player, won, points) in sides:
+        row = rows[player]
+        row[1] += won
+        row[2] += 1
+        row[3] += points
+    return [rows[player] for player in sorted(set(side[0] for side in sides))]
 
 
+def matches_partitioned():
+    """Returns whether the database uses the layout of partitioning.sql.
+
+    The answer is remembered for each connection string.
+    """
+    dsn = db.config['dsn']
+    if dsn not in _partitioned:
+        with new_transaction() as cr:
+            cr.execute("""
+                select relkind = 'p' from pg_class
+                 where oid = 'matches'::regclass
+            """)
+            _partitioned[dsn] = cr.fetchone()[0]
+    return _partitioned[dsn]
+
+
+@metrics.timed
+@cache.invalidates_all
 def delete_all_matches():
     """Remove all the match records from the database."""
+    partitioned = matches_partitioned()
     with new_transaction() as cr:
-        cr.execute("delete from matches")
+        if partitioned:
+            cr.execute("select truncate_matches(NULL)")
+        else:
+            cr.execute("delete from round_standings")
+            cr.execute("delete from matches")
+        cr.execute(PUBLISH_ALL_QUERY,
+                   (live.CHANNEL_PREFIX, live.encode(live.RESET)[0]))
+        log_event(cr, eventlog.DELETE_MATCHES)
 
 
+@metrics.timed
+@cache.invalidates
 def delete_matches(tournament):
-    """Remove all matches from a tournament."""
+    """Remove all matches from a tournament.
+
+    With partitioned matches the tournament's partition is truncated, which
+    takes the same time however many matches there are.
+    """
+    partitioned = matches_partitioned()
     with new_transaction() as cr:
-        cr.execute("delete from matches where tournament = %s", (tournament,))
+        if partitioned:
+            cr.execute("select truncate_matches(%s)", (tournament,))
+        else:
+            cr.execute(DELETE_ROUND_STANDINGS_QUERY, (tournament,))
+            cr.execute(DELETE_MATCHES_QUERY, (tournament,))
+        publish(cr, tournament, live.RESET)
+        log_event(cr, eventlog.DELETE_MATCHES, tournament)
+
+
+@metrics.timed
+@cache.invalidates
+def archive_tournament(tournament):
+    """Moves the matches of a finished tournament out of the matches table.
 
+    The tournament's partition is detached and kept as its own table, so
+    queries for the active tournaments never read it. The standings are kept,
+    but no more matches can be reported. Needs the layout of
+    partitioning.sql.
+
+    Args:
+        tournament: the tournament id.
 
+    Returns:
+        The name of the table with the archived matches.
+
+    Raises:
+        ValueError: if the matches table is not partitioned.
+    """
+    if not matches_partitioned():
+        raise ValueError("Archiving needs partitioned matches, "
+                         "see partitioning.sql")
+    with new_transaction() as cr:
+        cr.execute("select archive_tournament(%s)", (tournament,))
+        return cr.fetchone()[0]
+
+
+@metrics.timed
+@cache.invalidates_all
 def delete_tournaments():
-    """Remove all the tournament records from the database."""
+    """Remove all the tournament records from the database.
+
+    With partitioned matches their partitions are dropped too, archived
+    matches are kept.
+    """
     with new_transaction() as cr:
+        cr.execute(PUBLISH_ALL_QUERY,
+                   (live.CHANNEL_PREFIX, live.encode(live.CLEAR)[0]))
         cr.execute("delete from tournament_players")
         cr.execute("delete from tournaments")
+        log_event(cr, eventlog.DELETE_TOURNAMENTS)
 
 
+@metrics.timed
+@cache.invalidates_all
 def register_tournament(name):
     """Adds a new tournament to the tournament database.
 
+    With partitioned matches a trigger creates the tournament's partition.
+
     Args:
         name: the tournament's name.
+
+    Returns:
+        The new tournament's id.
     """
     with new_transaction() as cr:
-        cr.execute("insert into tournaments ( name ) values ( %s )", (name, ))
+        cr.execute("""
+            insert into tournaments ( name ) values ( %s ) returning id
+        """, (name, ))
+        tournament = cr.fetchone()[0]
+        log_event(cr, eventlog.REGISTER_TOURNAMENT, tournament, name)
+        return tournament
 
 
+@metrics.timed
+@cache.cached
 def list_tournaments():
     """Returns a list of all tournaments."""
-    with new_transaction() as cr:
+    with new_transaction(readonly=True) as cr:
         cr.execute("select * from tournaments")
         return cr.fetchall()
 
 
+def iter_tournaments(batch_size=ITER_BATCH_SIZE):
+    """Yields every tournament as an (id, name) tuple.
+
+    Rows are streamed from a server-side cursor `batch_size` at a time, so
+    memory use doesn't grow with the number of tournaments. The connection is
+    held until the generator is exhausted or closed.
+    """
+    with new_transaction(cursor_name="iter_tournaments",
+                         readonly=True) as cr:
+        cr.itersize = batch_size
+        cr.execute("select id, name from tournaments order by id")
+        for row in cr:
+            yield row
+
+
+@metrics.timed
+@cache.invalidates
 def register_player_into_tournament(tournament, player):
     """Register a player to participate in a tournament.
 
@@ -81,14 +662,51 @@ def register_player_into_tournament(tournament, player):
         cr.execute(
             "insert into tournament_players values ( %s, %s )",
             (tournament, player,))
+        rows = publish_changes(cr, tournament, [player], live.REGISTER)
+        log_event(cr, eventlog.REGISTER_INTO_TOURNAMENT, tournament,
+                  eventlog.encode_players([(row[0], row[4]) for row in rows]))
+
+
+@metrics.timed
+@cache.invalidates
+def register_players_into_tournament(tournament, player_ids):
+    """Register many players to participate in a tournament at once.
 
+    Rows are sent in multi-row inserts of up to `BULK_CHUNK_SIZE` players,
+    all of them within a single transaction.
 
+    Args:
+        tournament: the tournament id.
+        player_ids: the ids of the players to register.
+
+    Returns:
+        The list of registered player ids.
+    """
+    registered = []
+    with new_transaction() as cr:
+        for chunk in chunks(player_ids, BULK_CHUNK_SIZE):
+            values = ",".join(cr.mogrify("(%s, %s)", (tournament, player))
+                              for player in chunk)
+            cr.execute("insert into tournament_players values " + values +
+                       " returning player")
+            registered.extend(row[0] for row in cr.fetchall())
+        rows = publish_changes(cr, tournament, registered, live.REGISTER)
+        log_event(cr, eventlog.REGISTER_INTO_TOURNAMENT, tournament,
+                  eventlog.encode_players([(row[0], row[4]) for row in rows]))
+    return registered
+
+
+@metrics.timed
+@cache.invalidates_all
 def delete_all_players():
     """Remove all the player records from the database."""
     with new_transaction() as cr:
         cr.execute("delete from players")
+        log_event(cr, eventlog.DELETE_ALL_PLAYERS)
 
 
+@metrics.timed
+@cache.invalidates
 def delete_players(tournament):
     """Remove all the player records from a tournament.
 
@@ -99,28 +717,33 @@ def delete_players(tournament):
         cr.execute(
             "delete from tournament_players where tournament = %s",
             (tournament,))
+        publish(cr, tournament, live.CLEAR)
+        log_event(cr, eventlog.DELETE_PLAYERS, tournament)
 
 
+@metrics.timed
 def count_all_players():
     """Returns the number of players currently registered."""
-    with new_transaction() as cr:
+    with new_transaction(readonly=True) as cr:
         cr.execute("select count(*) from players")
         return cr.fetchone()[0]
 
 
+@metrics.timed
+@cache.cached
 def count_players(tournament):
     """Returns the number of players currently registered in a torunament.
 
     Args:
         tournament: the tournament id.
     """
-    with new_transaction() as cr:
-        cr.execute(
-            "select count(1) from tournament_players where tournament = %s",
-            (tournament,))
+    with new_transaction(readonly=True) as cr:
+        db.execute_prepared(cr, "count_players", COUNT_PLAYERS_QUERY,
+                            (tournament,))
         return cr.fetchone()[0]
 
 
+@metrics.timed
 def register_player(name):
     """Adds a player to the tournament database.
 
@@ -129,12 +752,47 @@ def register_player(name):
 
     Args:
       name: the player's full name (need not be unique).
+
+    Returns:
+      The new player's id.
     """
     with new_transaction() as cr:
-        query = "insert into players ( name ) values ( %s )"
+        query = "insert into players ( name ) values ( %s ) returning id"
         cr.execute(query, (name,))
+        player = cr.fetchone()[0]
+        log_event(cr, eventlog.REGISTER_PLAYERS, None,
+                  eventlog.encode_players([(player, name)]))
+        return player
+
+
+@metrics.timed
+def register_players(names):
+    """Adds many players to the tournament database at once.
 
+    Rows are sent in multi-row inserts of up to `BULK_CHUNK_SIZE` players,
+    all of them within a single transaction.
 
+    Args:
+      names: the players' full names.
+
+    Returns:
+      The list of the new players' ids, in the same order as `names`.
+    """
+    ids = []
+    with new_transaction() as cr:
+        for chunk in chunks(names, BULK_CHUNK_SIZE):
+            values = ",".join(cr.mogrify("(%s)", (name,)) for name in chunk)
+            cr.execute("insert into players ( name ) values " + values +
+                       " returning id")
+            # Serial ids are drawn in the order of the values list, sorting
+            # them maps each id back to its name.
+            ids.extend(sorted(row[0] for row in cr.fetchall()))
+        log_event(cr, eventlog.REGISTER_PLAYERS, None,
+                  eventlog.encode_players(zip(ids, names)))
+    return ids
+
+
+@metrics.timed
 def list_players():
     """Returns a list of all registered players.
 
@@ -143,19 +801,74 @@ def list_players():
         id: the player's unique id (assigned by the database)
         name: the player's full name (as registered)
     """
-    with new_transaction() as cr:
+    with new_transaction(readonly=True) as cr:
         cr.execute("select * from players")
         return cr.fetchall()
 
 
-def player_standings(tournament):
+def iter_players(batch_size=ITER_BATCH_SIZE):
+    """Yields every registered player as an (id, name) tuple.
+
+    Rows are streamed from a server-side cursor `batch_size` at a time, so
+    memory use doesn't grow with the number of players. The connection is
+    held until the generator is exhausted or closed.
+    """
+    with new_transaction(cursor_name="iter_players",
+                         readonly=True) as cr:
+        cr.itersize = batch_size
+        cr.execute("select id, name from players order by id")
+        for row in cr:
+            yield row
+
+
+def tiebreak_standings_query(tiebreak, as_of_round=False):
+    """Returns `TIEBREAK_STANDINGS_QUERY` ordered by the given tiebreaks.
+
+    With `as_of_round` the query also takes a %(round)s parameter and ranks
+    the standings after that round.
+    """
+    names = swiss.tiebreak_names(tiebreak)
+    order = ", ".join("ratings.rating desc" if name == swiss.RATING
+                      else "coalesce(tiebreaks.%s, 0) desc" % name
+                      for name in names)
+    if as_of_round:
+        return TIEBREAK_STANDINGS_QUERY.format(
+            order=order, standings=AS_OF_ROUND_STANDINGS,
+            rounds="and matches.round <= %(round)s")
+    return TIEBREAK_STANDINGS_QUERY.format(order=order, standings="standings",
+                                           rounds="")
+
+
+@metrics.timed
+@cache.cached
+def player_standings(tournament, after=None, limit=None, tiebreak=None,
+                     as_of_round=None):
     """Returns a list of the players and their win records, sorted by wins.
 
     The first entry in the list should be the player in first place, or a player
     tied for first place if there is currently a tie.
 
+    Long standings can be read a page at a time: `limit` caps the number of
+    rows and `after` starts the page right after the given player, usually the
+    last one of the previous page. Pages are looked up through an index, so
+    every page costs the same no matter how deep it is.
+
+    Players with the same wins are ordered by their points, or by the given
+    tiebreaks first, see `swiss.TIEBREAKS`. `swiss.RATING` orders them by
+    rating, which seeds round one. Tiebreaks are computed from the whole
+    tournament, so pages ordered by them cost as much as a full read.
+
+    `as_of_round` gives the standings as they were after a round, read from
+    the players' round standings, which only count matches reported with a
+    round. Tiebreaks then only count the matches up to that round, while
+    ratings are always the current ones.
+
     Args:
         tournament: the tournament id.
+        after: the id of the player before the first one returned.
+        limit: the maximum number of players returned.
+        tiebreak: a tiebreak name, or a tuple of them applied in order.
+        as_of_round: the last round counted, or None for every match.
 
     Returns:
       A list of tuples, each of which contains (id, name, wins, matches):
@@ -164,72 +877,675 @@ def player_standings(tournament):
         wins: the number of matches the player has won
         matches: the number of matches the player has played
     """
-    with new_transaction() as cr:
-        cr.execute("""
-        select player_id, player_name, wins, matches from tournament_status
-        where tournament_status.id = %s
-        """, (tournament,))
+    with new_transaction(readonly=True) as cr:
+        return read_standings(cr, tournament, after, limit, tiebreak,
+                              as_of_round)
+
+
+def read_standings(cr, tournament, after=None, limit=None, tiebreak=None,
+                   as_of_round=None):
+    """Reads the standings of a tournament, see `player_standings`.
+
+    Args:
+        cr: a cursor of the transaction to read them in.
+    """
+    if tiebreak or as_of_round is not None:
+        if tiebreak:
+            query = tiebreak_standings_query(tiebreak,
+                                             as_of_round is not None)
+        else:
+            query = ROUND_STANDINGS_QUERY
+        cr.execute(query, {'tournament': tournament,
+                           'round': as_of_round,
+                           'after': after,
+                           'limit': limit})
         return cr.fetchall()
 
+    if after is None:
+        db.execute_prepared(cr, "player_standings",
+                            STANDINGS_QUERY + " limit %s",
+                            (tournament, limit))
+    else:
+        db.execute_prepared(cr, "player_standings_page",
+                            STANDINGS_PAGE_QUERY,
+                            {'tournament': tournament,
+                             'after': after,
+                             'limit': limit})
+    return cr.fetchall()
+
+
+@metrics.timed
+@cache.cached
+def player_history(tournament, player):
+    """Returns the record of a player after each round they played.
+
+    Args:
+        tournament: the tournament id.
+        player: the player id.
+
+    Returns:
+      A list of tuples (round, wins, matches) ordered by round, wins and
+      matches counting every match up to the end of that round.
+    """
+    with new_transaction(readonly=True) as cr:
+        db.execute_prepared(cr, "player_history", PLAYER_HISTORY_QUERY,
+                            (tournament, player))
+        return cr.fetchall()
+
+
+def iter_standings(tournament, batch_size=ITER_BATCH_SIZE):
+    """Yields the standings of a tournament one player at a time.
 
-def report_match(tournament, winner, loser):
+    Same rows as `player_standings`, streamed from a server-side cursor
+    `batch_size` at a time. The connection is held until the generator is
+    exhausted or closed.
+    """
+    with new_transaction(cursor_name="iter_standings",
+                         readonly=True) as cr:
+        cr.itersize = batch_size
+        cr.execute(STANDINGS_QUERY, (tournament,))
+        for row in cr:
+            yield row
+
+
+@metrics.timed
+@cache.invalidates
+def report_match(tournament, winner, loser, round=None):
     """Records the outcome of a single match between two players.
 
+    The ratings of both players are updated in the same transaction, see
+    ratings.py. It is safe to report matches from many processes at once,
+    reports that involve the same player are serialized.
+
     Args:
         tournament: the tournament id
         winner:  the id number of the player who won
         loser:  the id number of the player who lost
+        round: the round of the match. By default the round after the last
+          one either player played, counting a match per round.
+    """
+    with new_transaction() as cr:
+        # The winner's points depend on the loser's wins, see
+        # `swiss.winner_points`.
+        db.execute_prepared(cr, "players_wins", PLAYERS_WINS_QUERY,
+                            (tournament, [winner, loser]))
+        locked = cr.fetchall()
+        wins = dict((row[0], row[1]) for row in locked)
+        for player in (winner, loser):
+            if player not in wins:
+                raise ValueError("Player %s is not registered in tournament "
+                                 "%s" % (player, tournament))
+        points = swiss.winner_points(wins[loser])
+        if round is None:
+            round = max(row[2] for row in locked) + 1
+        db.execute_prepared(cr, "report_match", REPORT_MATCH_QUERY,
+                            {'tournament': tournament,
+                             'round': round,
+                             'winner': winner,
+                             'loser': loser,
+                             'points': points})
+        update_ratings(cr, dict((row[0], row[4]) for row in locked),
+                       [(winner, loser)])
+        publish(cr, tournament, live.UPDATE,
+                updated_standings(locked, [(winner, 1, points),
+                                           (loser, 0, 0)]))
+        log_event(cr, eventlog.REPORT_RESULTS, tournament,
+                  eventlog.encode_results([(round, winner, loser, points)]))
+
+
+@metrics.timed
+@cache.invalidates
+def report_round(tournament, results, round=None):
+    """Records the outcome of every match of a round at once.
+
+    The losers' wins are read with a single query and all the matches are
+    inserted with multi-row inserts, in one transaction. Points are computed
+    as in `report_match`, with the wins each loser had at the start of the
+    round. Ratings are updated as if the matches were reported one by one.
+    Like `report_match`, it is safe to call from many processes.
+
+    Args:
+        tournament: the tournament id
+        results: a list of (winner, loser) tuples. A None loser records a bye
+          for the winner.
+        round: the round of the matches. By default the round after the last
+          one any of the players played, counting a match per round.
+    """
+    losers = [loser for (winner, loser) in results if loser is not None]
+    players = losers + [winner for (winner, loser) in results]
+    rows = []
+    with new_transaction() as cr:
+        db.execute_prepared(cr, "players_wins", PLAYERS_WINS_QUERY,
+                            (tournament, players))
+        locked = cr.fetchall()
+        wins = dict((row[0], row[1]) for row in locked)
+        if round is None and locked:
+            round = max(row[2] for row in locked) + 1
+        for (winner, loser) in results:
+            if loser is None:
+                if winner not in wins:
+                    raise ValueError("Player %s is not registered in "
+                                     "tournament %s" % (winner, tournament))
+                rows.append((tournament, round, winner, None, 1,
+                             swiss.BYE_POINTS))
+                continue
+            for player in (winner, loser):
+                if player not in wins:
+                    raise ValueError("Player %s is not registered in "
+                                     "tournament %s" % (player, tournament))
+            rows.append((tournament, round, winner, loser, 1,
+                         swiss.winner_points(wins[loser])))
+            rows.append((tournament, round, loser, winner, 0, 0))
+        for chunk in chunks(rows, BULK_CHUNK_SIZE):
+            values = ",".join(cr.mogrify("(%s, %s, %s, %s, %s, %s)", row)
+                              for row in chunk)
+            cr.execute("""insert into
+                          matches ( tournament, round, player, opponent, won,
+                                    points )
+                          values """ + values)
+        update_ratings(cr, dict((row[0], row[4]) for row in locked),
+                       [(winner, loser) for (winner, loser) in results
+                        if loser is not None])
+        publish(cr, tournament, live.UPDATE,
+                updated_standings(locked, [(row[2], row[4], row[5])
+                                           for row in rows]))
+        log_event(cr, eventlog.REPORT_RESULTS, tournament,
+                  eventlog.encode_results([(row[1], row[2], row[3], row[5])
+                                           for row in rows if row[4]]))
+
+
+def update_ratings(cr, rated, results):
+    """Rates the results of some matches and saves the new ratings.
+
+    Args:
+        cr: a cursor of the transaction that reports the matches, which has
+          locked the players' ratings.
+        rated: a dict of player id to their current rating.
+        results: a list of (winner, loser) tuples.
+    """
+    games = ratings.rate_matches(rated, results)
+    if not games:
+        return
+    players = sorted(games)
+    db.execute_prepared(cr, "rate_matches", RATE_MATCHES_QUERY,
+                        (players,
+                         [rated[player] for player in players],
+                         [games[player] for player in players]))
+
+
+@metrics.timed
+@cache.invalidates
+def report_bye(tournament, player, round=None):
+    """Records a bye, which counts as a win without an opponent.
+
+    Args:
+        tournament: the tournament id
+        player: the id number of the player who sat out the round
+        round: the round sat out, by default the one after the last round
+          the player played.
     """
     with new_transaction() as cr:
-        query = """insert into
-                   matches ( tournament, player, opponent, won, points )
-                   values ( %s, %s, %s, %s, %s )"""
-
-        # The winner receives as points the ammount of wins the loser has plus
-        # one. This will give more value to a win over a player that has more
-        # wins and the amount of points a user has can be used to find
-        # the best match, and the winner in case of ties.
+        cr.execute("""insert into
+                      matches ( tournament, round, player, opponent, won,
+                                points )
+                      values ( %(tournament)s,
+                               coalesce(%(round)s,
+                                        ( select matches + 1 from standings
+                                           where tournament = %(tournament)s
+                                             and player = %(player)s ), 1),
+                               %(player)s, null, 1, %(points)s )
+                      returning round""",
+                   {'tournament': tournament,
+                    'round': round,
+                    'player': player,
+                    'points': swiss.BYE_POINTS})
+        round = cr.fetchone()[0]
+        publish_changes(cr, tournament, [player])
+        log_event(cr, eventlog.REPORT_RESULTS, tournament,
+                  eventlog.encode_results([(round, player, None,
+                                            swiss.BYE_POINTS)]))
+
+
+@metrics.timed
+@cache.cached
+def played_pairs(tournament):
+    """Returns who already played whom in a tournament.
+
+    Args:
+        tournament: the tournament id.
+
+    Returns:
+      A tuple (played, byes):
+        played: a set of `swiss.pair_key(player, opponent)` of every match.
+        byes: a set of the ids of the players who had a bye.
+    """
+    with new_transaction(readonly=True) as cr:
+        return read_played_pairs(cr, tournament)
+
+
+def read_played_pairs(cr, tournament):
+    """Reads who already played whom in a tournament, see `played_pairs`.
+
+    Args:
+        cr: a cursor of the transaction to read them in.
+    """
+    # Not prepared, it is planned in microseconds and then reads every match
+    # of the tournament.
+    cr.execute(PLAYED_PAIRS_QUERY, (tournament,))
+    played = set()
+    byes = set()
+    for (player, opponent) in cr:
+        if opponent is None:
+            byes.add(player)
+        else:
+            played.add(swiss.pair_key(player, opponent))
+    return played, byes
+
+
+@metrics.timed
+@cache.invalidates
+def rebuild_standings(tournament=None):
+    """Recomputes the standings and round standings from the recorded matches.
+
+    Standings are kept up to date by database triggers, this is only needed
+    to repair them.
+
+    Args:
+        tournament: the tournament id, or None to rebuild all tournaments.
+    """
+    with new_transaction() as cr:
+        cr.execute("select rebuild_standings(%s)", (tournament,))
+        if tournament is None:
+            cr.execute(PUBLISH_ALL_QUERY,
+                       (live.CHANNEL_PREFIX, live.encode(live.RELOAD)[0]))
+        else:
+            publish(cr, tournament, live.RELOAD)
+
+
+@metrics.timed
+@cache.invalidates_all
+def rebuild_ratings():
+    """Recomputes the rating of every player from the recorded matches.
+
+    The matches of every tournament are replayed in the order they were
+    reported, in vectorized batches, see `ratings.replay`. Ratings are kept
+    up to date by `report_match` and `report_round`, this is needed after
+    deleting matches, changing `ratings.K_FACTOR` or migrating a database.
+    Matches of archived tournaments are left out.
+
+    Returns:
+        The number of matches replayed.
+    """
+    with new_transaction() as cr:
+        # Ratings are locked before matches, like reports do, so a report
+        # that started first finishes before the rebuild reads the history.
+        cr.execute("lock table ratings in exclusive mode")
+        cr.execute("lock table matches in share mode")
+        cr.execute("select player from ratings")
+        players = [row[0] for row in cr.fetchall()]
+
+        history = cr.connection.cursor(name="rebuild_ratings")
+        history.itersize = ITER_BATCH_SIZE
+        history.execute("""
+            select player, opponent from matches
+             where won = 1
+               and opponent is not null
+             order by id
+        """)
+        batches = []
+        while True:
+            rows = history.fetchmany(ITER_BATCH_SIZE)
+            if not rows:
+                break
+            batches.append(numpy.array(rows, dtype=numpy.int64))
+        history.close()
+        games = (numpy.concatenate(batches) if batches
+                 else numpy.zeros((0, 2), dtype=numpy.int64))
+
+        rated, played = ratings.replay(players, games[:, 0], games[:, 1])
+        cr.execute("update ratings set rating = %s, games = 0",
+                   (ratings.INITIAL_RATING,))
+        for chunk in chunks([i for i in xrange(len(players)) if played[i]],
+                            BULK_CHUNK_SIZE):
+            cr.execute(RATE_MATCHES_QUERY,
+                       ([players[i] for i in chunk],
+                        [float(rated[i]) for i in chunk],
+                        [int(played[i]) for i in chunk]))
+        return len(games)
+
+
+@metrics.timed
+def player_ratings(limit=None):
+    """Returns the players ranked by rating, across every tournament.
+
+    Args:
+        limit: the maximum number of players returned.
+
+    Returns:
+      A list of tuples, each of which contains (id, name, rating, matches):
+        id: the player's unique id (assigned by the database)
+        name: the player's full name (as registered)
+        rating: the player's Elo rating, see ratings.py
+        matches: the number of rated matches the player has played
+    """
+    with new_transaction(readonly=True) as cr:
         cr.execute("""
-            select wins from tournament_status
-            where id = %s
-              and player_id = %s
-        """, (tournament, loser,))
-        loser_wins = cr.fetchone()[0]
-        p = loser_wins + 1
-        params = ((tournament, winner, loser, 1, p,),
-                  (tournament, loser, winner, 0, 0,))
-        cr.executemany(query, params)
-
-
-def swiss_pairings(tournament):
+            select players.id, players.name, ratings.rating, ratings.games
+              from ratings
+              join players on players.id = ratings.player
+             order by ratings.rating desc, players.id
+             limit %s
+        """, (limit,))
+        return cr.fetchall()
+
+
+@metrics.timed
+def win_probability(player, opponent):
+    """Estimates the probability that a player beats an opponent.
+
+    Args:
+        player: the id of the player.
+        opponent: the id of the opponent.
+
+    Raises:
+        ValueError: if either player doesn't exist.
+    """
+    with new_transaction(readonly=True) as cr:
+        cr.execute("select player, rating from ratings where player = any(%s)",
+                   ([player, opponent],))
+        rated = dict(cr.fetchall())
+    for p in (player, opponent):
+        if p not in rated:
+            raise ValueError("Player %s does not exist" % p)
+    return ratings.expected_score(rated[player], rated[opponent])
+
+
+def iter_events(tournament=None, after=0, until=None,
+                batch_size=ITER_BATCH_SIZE):
+    """Yields the logged events in the order they were logged.
+
+    Rows are streamed from a server-side cursor `batch_size` at a time, see
+    `iter_tournaments`.
+
+    Args:
+        tournament: only yield the events of this tournament, along with the
+          deletions of every tournament, players or matches.
+        after: yield the events after this event id.
+        until: yield the events up to this event id, or every one.
+
+    Yields:
+        Tuples (id, tournament, kind, data), see `eventlog.decode` for data.
+    """
+    with new_transaction(cursor_name="iter_events", readonly=True) as cr:
+        cr.itersize = batch_size
+        cr.execute(EVENTS_QUERY,
+                   {'tournament': tournament,
+                    'after': after,
+                    'until': until,
+                    'register_players': eventlog.REGISTER_PLAYERS})
+        for (id, tid, kind, payload) in cr:
+            yield id, tid, kind, eventlog.decode(kind, payload)
+
+
+@metrics.timed
+def snapshot_tournament(tournament, directory):
+    """Writes a snapshot of a tournament into a directory, see eventlog.py.
+
+    Changes to any tournament wait while the tournament is read, so that
+    each of them is either in the snapshot or logged after its event.
+
+    Args:
+        tournament: the tournament id.
+        directory: where to write the file.
+
+    Returns:
+        The path of the snapshot file.
+
+    Raises:
+        ValueError: if the tournament doesn't exist.
+    """
+    with new_transaction() as cr:
+        # Every change logs its event in its own transaction. Once none can
+        # log one, the changes committed so far are all the ones up to the
+        # last event.
+        cr.execute("lock table events in share mode")
+        cr.execute("select coalesce(max(id), 0) from events")
+        event = cr.fetchone()[0]
+        cr.execute("select name from tournaments where id = %s",
+                   (tournament,))
+        row = cr.fetchone()
+        if row is None:
+            raise ValueError("Tournament %s does not exist" % tournament)
+        cr.execute(SNAPSHOT_PLAYERS_QUERY, (tournament,))
+        players = cr.fetchall()
+        cr.execute(PLAYED_PAIRS_QUERY, (tournament,))
+        played = cr.fetchall()
+        cr.execute(SNAPSHOT_RESULTS_QUERY, (tournament,))
+        results = cr.fetchall()
+    snapshot = eventlog.Snapshot(
+        tournament, event, row[0],
+        numpy.array([player[:6] for player in players],
+                    dtype=eventlog.PLAYER),
+        [player[6] for player in players],
+        [pair for pair in played if pair[1] is not None],
+        [player for (player, opponent) in played if opponent is None],
+        numpy.array(results, dtype=eventlog.RESULT))
+    return eventlog.write_snapshot(directory, snapshot)
+
+
+@metrics.timed
+def export_tournament(tournament, path):
+    """Writes the players and matches of a tournament into a columnar file.
+
+    Rows are streamed out of the database with binary COPY and written a
+    chunk at a time, see columnar.py. Binary COPY doesn't work under green.py.
+
+    Args:
+        tournament: the tournament id.
+        path: the file to write.
+
+    Returns:
+        The number of players and of matches rows written.
+
+    Raises:
+        ValueError: if the tournament doesn't exist.
+    """
+    params = {'tournament': tournament}
+    with new_transaction(readonly=True) as cr:
+        # The counts and both copies read the same snapshot.
+        cr.execute("set transaction isolation level repeatable read")
+        cr.execute("select name from tournaments where id = %s",
+                   (tournament,))
+        row = cr.fetchone()
+        if row is None:
+            raise ValueError("Tournament %s does not exist" % tournament)
+        cr.execute(EXPORT_COUNTS_QUERY, params)
+        players, matches = cr.fetchone()
+        with columnar.ExportWriter(path, tournament, row[0], players,
+                                   matches) as writer:
+            cr.copy_expert(cr.mogrify(EXPORT_PLAYERS_QUERY, params),
+                           writer.players, columnar.COPY_CHUNK_SIZE)
+            cr.copy_expert(cr.mogrify(EXPORT_MATCHES_QUERY, params),
+                           writer.matches, columnar.COPY_CHUNK_SIZE)
+    return players, matches
+
+
+@metrics.timed
+@cache.invalidates_all
+def import_tournament(path, name=None):
+    """Loads a file written by `export_tournament` as a new tournament.
+
+    Every player of the file is registered again with a new id, and their
+    ratings are computed from the imported matches alone. Rows are streamed
+    into the database with binary COPY, see `export_tournament`.
+
+    Args:
+        path: the file to read.
+        name: the new tournament's name, the exported one by default.
+
+    Returns:
+        The new tournament's id.
+    """
+    export = columnar.load_export(path)
+    if name is None:
+        name = export.name
+    with new_transaction() as cr:
+        cr.execute("insert into tournaments ( name ) values ( %s ) "
+                   "returning id", (name,))
+        tournament = cr.fetchone()[0]
+        cr.execute(IMPORT_TABLES_QUERY)
+        cr.copy_expert(IMPORT_PLAYERS_QUERY, columnar.copy_players(export),
+                       columnar.COPY_CHUNK_SIZE)
+        cr.copy_expert(IMPORT_MATCHES_QUERY, columnar.copy_matches(export),
+                       columnar.COPY_CHUNK_SIZE)
+        cr.execute(IMPORT_QUERY, {'tournament': tournament})
+        imported = cr.fetchall()
+
+        # The file's players are sorted by id, like `imported`.
+        new_ids = numpy.array([row[1] for row in imported])
+        matches = export.matches
+        won = (matches['won'] == 1) & (matches['opponent'] != 0)
+        winners = new_ids[numpy.searchsorted(export.players['id'],
+                                             matches['player'][won])]
+        losers = new_ids[numpy.searchsorted(export.players['id'],
+                                            matches['opponent'][won])]
+        rated, played = ratings.replay(new_ids, winners, losers)
+        for chunk in chunks(numpy.flatnonzero(played).tolist(),
+                            BULK_CHUNK_SIZE):
+            cr.execute(RATE_MATCHES_QUERY,
+                       (new_ids[chunk].tolist(), rated[chunk].tolist(),
+                        played[chunk].tolist()))
+
+        log_event(cr, eventlog.REGISTER_TOURNAMENT, tournament, name)
+        log_event(cr, eventlog.REGISTER_PLAYERS, None,
+                  eventlog.encode_players([row[1:] for row in imported]))
+        registered = export.players['registered'].astype(bool).tolist()
+        log_event(cr, eventlog.REGISTER_INTO_TOURNAMENT, tournament,
+                  eventlog.encode_players([row[1:] for (row, r)
+                                           in zip(imported, registered)
+                                           if r]))
+        cr.execute(SNAPSHOT_RESULTS_QUERY, (tournament,))
+        log_event(cr, eventlog.REPORT_RESULTS, tournament,
+                  eventlog.encode_results(cr.fetchall()))
+    return tournament
+
+
+@metrics.timed
+@cache.cached
+def swiss_pairings(tournament, tiebreak=None):
     """Returns a list of pairs of players for the next round of a match.
 
-    Assuming that there are an even number of players registered, each player
-    appears exactly once in the pairings.  Each player is paired with another
-    player with an equal or nearly-equal win record, that is, a player adjacent
-    to him or her in the standings.
+    Each player appears exactly once in the pairings.  Each player is paired
+    with another player with an equal or nearly-equal win record whom they
+    haven't played yet, see `swiss.pair_round`. When there is an odd number
+    of players, the lowest ranked player who hasn't had a bye yet gets one.
 
     Args:
         tournament: the tournament id.
+        tiebreak: the tiebreaks that rank players with the same wins, see
+          `player_standings`.
 
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
         id1: the first player's unique id
         name1: the first player's name
-        id2: the second player's unique id
-        name2: the second player's name
+        id2: the second player's unique id, None for a bye
+        name2: the second player's name, None for a bye
     """
-    players = player_standings(tournament)
+    with new_transaction(readonly=True) as cr:
+        # The standings and the played pairs are read from the same snapshot,
+        # on the same server.
+        cr.execute("set transaction isolation level repeatable read")
+        players = read_standings(cr, tournament, tiebreak=tiebreak)
+        played, byes = read_played_pairs(cr, tournament)
+    return swiss.pair_round(players, played, byes)
 
-    def create_pair(idx):
-        p1 = players[idx]
-        p2 = players[idx+1]
-        return (p1[0], p1[1], p2[0], p2[1])
 
-    return [create_pair(i) for i in xrange(0, len(players), 2)]
+def standings_many(cr, tournaments, tiebreak=None):
+    """Reads the standings of many tournaments, see `player_standings_many`.
 
+    Args:
+        cr: a cursor of the transaction to read them in.
+    """
+    standings = dict((tournament, []) for tournament in tournaments)
+    if tiebreak:
+        # Tiebreaks are computed for one tournament at a time.
+        query = tiebreak_standings_query(tiebreak)
+        for tournament in standings:
+            cr.execute(query, {'tournament': tournament,
+                               'after': None,
+                               'limit': None})
+            standings[tournament] = cr.fetchall()
+        return standings
+    cr.execute(STANDINGS_MANY_QUERY, (list(standings),))
+    for row in cr:
+        standings[row[0]].append(row[1:])
+    return standings
+
+
+@metrics.timed
+def player_standings_many(tournaments, tiebreak=None):
+    """Returns the standings of many tournaments at once.
+
+    Every tournament is read with a single query, on one connection, instead
+    of one `player_standings` call each.
 
-def report_winner(tournament):
+    Args:
+        tournaments: the tournament ids.
+        tiebreak: the tiebreaks that rank players with the same wins, see
+          `player_standings`. With tiebreaks each tournament is ranked by a
+          query of its own, still on the same connection.
+
+    Returns:
+        A dict of tournament id to its standings, the list of (id, name,
+        wins, matches) `player_standings` returns.
+    """
+    with new_transaction(readonly=True) as cr:
+        return standings_many(cr, tournaments, tiebreak)
+
+
+@metrics.timed
+def swiss_pairings_many(tournaments, tiebreak=None, processes=None):
+    """Returns the pairings for the next round of many tournaments.
+
+    The standings and played pairs of every tournament are read with one
+    query each, see `player_standings_many`. Large fields are then paired
+    across a pool of processes, see `swiss.pair_rounds`, so pairing many
+    tournaments takes about as long as pairing the largest one, given as
+    many cores.
+
+    Args:
+        tournaments: the tournament ids.
+        tiebreak: the tiebreaks that rank players with the same wins, see
+          `player_standings`.
+        processes: the size of the process pool, see `swiss.pair_rounds`.
+
+    Returns:
+        A dict of tournament id to its pairings, the list of (id1, name1,
+        id2, name2) `swiss_pairings` returns.
+    """
+    with new_transaction(readonly=True) as cr:
+        # The standings and the played pairs are read from the same snapshot.
+        cr.execute("set transaction isolation level repeatable read")
+        standings = standings_many(cr, tournaments, tiebreak)
+        played = dict((tournament, (set(), set()))
+                      for tournament in standings)
+        cr.execute(PLAYED_PAIRS_MANY_QUERY, (list(standings),))
+        for (tournament, player, opponent) in cr:
+            if opponent is None:
+                played[tournament][1].add(player)
+            else:
+                played[tournament][0].add(swiss.pair_key(player, opponent))
+    ids = list(standings)
+    pairings = swiss.pair_rounds([(standings[tournament],) +
+                                  played[tournament]
+                                  for tournament in ids], processes)
+    return dict(zip(ids, pairings))
+
+
+@metrics.timed
+@cache.cached
+def report_winner(tournament, tiebreak=None):
     """Returns the winner of a tournament.
 
     For a tournament to have a winner, a minimun of
@@ -238,6 +1554,8 @@ def report_winner(tournament):
 
     Args:
         tournament: the tournament id
+        tiebreak: the tiebreaks that decide between players with the same
+          wins, see `player_standings`.
 
     Returns:
       A tuple containing the winner information (id, name, wins, matches) or
@@ -248,20 +1566,15 @@ def report_winner(tournament):
         wins: the number of wins the winner has.
         matches: how many maches the winner has played.
     """
-    with new_transaction() as cr:
-        cr.execute("""
-        select player_id, player_name, wins, matches from tournament_status
-        where tournament_status.id = %s
-        limit 1
-        """, (tournament,))
-        first_player = cr.fetchone()
-        matches = first_player[3]
-        players = count_players(tournament)
-        min_number_of_matches = int(round(math.log(players, 2)))
-
-        if matches < min_number_of_matches:
-            return None
-        else:
-            return first_player
-
-
+    standings = player_standings(tournament, limit=1, tiebreak=tiebreak)
+    if not standings:
+        return None
+    first_player = standings[0]
+    matches = first_player[3]
+    players = count_players(tournament)
+    min_number_of_matches = swiss.min_rounds(players)
+
+    if matches < min_number_of_matches:
+        return None
+    else:
+        return first_player
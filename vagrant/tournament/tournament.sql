@@ -15,30 +15,266 @@ CREATE TABLE tournament_players ( tournament INTEGER REFERENCES tournaments(id),
                                   player INTEGER REFERENCES players(id),
                                   PRIMARY KEY (tournament, player) );
 
-CREATE TABLE matches ( tournament INTEGER REFERENCES tournaments(id),
-                       player INTEGER REFERENCES players(id),
+CREATE INDEX tournament_players_player ON tournament_players (player);
+
+CREATE TABLE matches ( id serial PRIMARY KEY,
+                       tournament INTEGER NOT NULL REFERENCES tournaments(id),
+                       round INTEGER,
+                       player INTEGER NOT NULL REFERENCES players(id),
                        opponent INTEGER REFERENCES players(id),
-                       won INTEGER,
+                       won INTEGER CHECK (won IN (0, 1)),
                        points INTEGER DEFAULT 0 );
 
+CREATE INDEX matches_tournament_player ON matches (tournament, player, opponent);
+CREATE INDEX matches_player ON matches (player);
+CREATE INDEX matches_opponent ON matches (opponent);
+
+
+-- Running totals of every registered player in a tournament, kept up to date
+-- by the triggers below in the same transaction that changes `matches`.
+CREATE TABLE standings ( tournament INTEGER,
+                         player INTEGER,
+                         wins INTEGER NOT NULL DEFAULT 0,
+                         matches INTEGER NOT NULL DEFAULT 0,
+                         points INTEGER NOT NULL DEFAULT 0,
+                         PRIMARY KEY (tournament, player),
+                         FOREIGN KEY (tournament, player)
+                           REFERENCES tournament_players ON DELETE CASCADE );
+
+-- Scanned backwards it gives the ranking (wins desc, points desc, player),
+-- and it supports keyset pagination with a (wins, points, -player) row
+-- comparison.
+CREATE INDEX standings_rank ON standings (tournament, wins, points, (-player));
+
+-- Totals of every registered player at the end of each round they played,
+-- counting the matches of that round and of every round before it. The
+-- standings after round n are the latest row of each player up to round n.
+-- Kept up to date by the same triggers as `standings`, matches without a
+-- round are left out.
+CREATE TABLE round_standings ( tournament INTEGER,
+                               player INTEGER,
+                               round INTEGER,
+                               wins INTEGER NOT NULL DEFAULT 0,
+                               matches INTEGER NOT NULL DEFAULT 0,
+                               points INTEGER NOT NULL DEFAULT 0,
+                               PRIMARY KEY (tournament, player, round),
+                               FOREIGN KEY (tournament, player)
+                                 REFERENCES tournament_players
+                                 ON DELETE CASCADE );
+
+
+CREATE FUNCTION add_standings() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO standings ( tournament, player, wins, matches, points )
+  SELECT NEW.tournament,
+         NEW.player,
+         coalesce(sum(won), 0),
+         count(won),
+         coalesce(sum(points), 0)
+    FROM matches
+   WHERE tournament = NEW.tournament
+     AND player = NEW.player;
+  INSERT INTO round_standings ( tournament, player, round, wins, matches,
+                                points )
+  SELECT tournament, player, round,
+         sum(coalesce(sum(won), 0)) OVER w,
+         sum(count(won)) OVER w,
+         sum(coalesce(sum(points), 0)) OVER w
+    FROM matches
+   WHERE tournament = NEW.tournament
+     AND player = NEW.player
+     AND round IS NOT NULL
+   GROUP BY tournament, player, round
+  WINDOW w AS (ORDER BY round);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tournament_players_standings
+  AFTER INSERT ON tournament_players
+  FOR EACH ROW EXECUTE PROCEDURE add_standings();
+
+
+CREATE FUNCTION update_standings() RETURNS trigger AS $$
+DECLARE
+  last_round INTEGER;
+  wins_before INTEGER;
+  matches_before INTEGER;
+  points_before INTEGER;
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    UPDATE standings
+       SET wins = wins - coalesce(OLD.won, 0),
+           matches = matches - (OLD.won IS NOT NULL)::integer,
+           points = points - coalesce(OLD.points, 0)
+     WHERE tournament = OLD.tournament
+       AND player = OLD.player;
+    UPDATE round_standings
+       SET wins = wins - coalesce(OLD.won, 0),
+           matches = matches - (OLD.won IS NOT NULL)::integer,
+           points = points - coalesce(OLD.points, 0)
+     WHERE tournament = OLD.tournament
+       AND player = OLD.player
+       AND round >= OLD.round;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    UPDATE standings
+       SET wins = wins + coalesce(NEW.won, 0),
+           matches = matches + (NEW.won IS NOT NULL)::integer,
+           points = points + coalesce(NEW.points, 0)
+     WHERE tournament = NEW.tournament
+       AND player = NEW.player;
+    -- Only registered players have standings. Their standings row is now
+    -- locked, so the changes to their round standings below don't race
+    -- with other transactions.
+    IF FOUND AND NEW.round IS NOT NULL THEN
+      SELECT round, wins, matches, points
+        INTO last_round, wins_before, matches_before, points_before
+        FROM round_standings
+       WHERE tournament = NEW.tournament
+         AND player = NEW.player
+       ORDER BY round DESC
+       LIMIT 1;
+      -- Usually the player's first match of a later round than any they
+      -- played, which starts from the totals of their last round. A late
+      -- result is added to its round and the ones after it.
+      IF last_round >= NEW.round THEN
+        UPDATE round_standings
+           SET wins = wins + coalesce(NEW.won, 0),
+               matches = matches + (NEW.won IS NOT NULL)::integer,
+               points = points + coalesce(NEW.points, 0)
+         WHERE tournament = NEW.tournament
+           AND player = NEW.player
+           AND round >= NEW.round;
+        IF EXISTS (SELECT 1 FROM round_standings
+                    WHERE tournament = NEW.tournament
+                      AND player = NEW.player
+                      AND round = NEW.round) THEN
+          RETURN NULL;
+        END IF;
+        SELECT wins, matches, points
+          INTO wins_before, matches_before, points_before
+          FROM round_standings
+         WHERE tournament = NEW.tournament
+           AND player = NEW.player
+           AND round < NEW.round
+         ORDER BY round DESC
+         LIMIT 1;
+      END IF;
+      INSERT INTO round_standings ( tournament, player, round, wins,
+                                    matches, points )
+      VALUES ( NEW.tournament, NEW.player, NEW.round,
+               coalesce(wins_before, 0) + coalesce(NEW.won, 0),
+               coalesce(matches_before, 0) + (NEW.won IS NOT NULL)::integer,
+               coalesce(points_before, 0) + coalesce(NEW.points, 0) );
+    END IF;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER matches_standings
+  AFTER INSERT OR UPDATE OR DELETE ON matches
+  FOR EACH ROW EXECUTE PROCEDURE update_standings();
+
+
+-- Recomputes the standings and round standings of a tournament (or of all
+-- of them when called with NULL) from `matches`.
+CREATE FUNCTION rebuild_standings(INTEGER) RETURNS void AS $$
+  LOCK TABLE matches IN SHARE MODE;
+  DELETE FROM round_standings WHERE $1 IS NULL OR tournament = $1;
+  DELETE FROM standings WHERE $1 IS NULL OR tournament = $1;
+  INSERT INTO standings ( tournament, player, wins, matches, points )
+  SELECT tournament_players.tournament,
+         tournament_players.player,
+         coalesce(sum(matches.won), 0),
+         count(matches.won),
+         coalesce(sum(matches.points), 0)
+    FROM tournament_players
+    LEFT JOIN matches
+      ON tournament_players.tournament = matches.tournament
+     AND tournament_players.player = matches.player
+   WHERE $1 IS NULL OR tournament_players.tournament = $1
+   GROUP BY tournament_players.tournament, tournament_players.player;
+  INSERT INTO round_standings ( tournament, player, round, wins, matches,
+                                points )
+  SELECT matches.tournament, matches.player, matches.round,
+         sum(coalesce(sum(matches.won), 0)) OVER w,
+         sum(count(matches.won)) OVER w,
+         sum(coalesce(sum(matches.points), 0)) OVER w
+    FROM matches
+    JOIN tournament_players
+      ON tournament_players.tournament = matches.tournament
+     AND tournament_players.player = matches.player
+   WHERE matches.round IS NOT NULL
+     AND ($1 IS NULL OR matches.tournament = $1)
+   GROUP BY matches.tournament, matches.player, matches.round
+  WINDOW w AS (PARTITION BY matches.tournament, matches.player
+               ORDER BY matches.round);
+$$ LANGUAGE sql;
+
+
+-- Elo rating of every player across tournaments, see ratings.py. Kept up to
+-- date by report_match and report_round, and recomputed from `matches` by
+-- rebuild_ratings. The default is ratings.INITIAL_RATING.
+CREATE TABLE ratings ( player INTEGER PRIMARY KEY
+                         REFERENCES players(id) ON DELETE CASCADE,
+                       rating REAL NOT NULL DEFAULT 1500,
+                       games INTEGER NOT NULL DEFAULT 0 );
+
+CREATE FUNCTION add_rating() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO ratings ( player ) VALUES ( NEW.id );
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER players_ratings
+  AFTER INSERT ON players
+  FOR EACH ROW EXECUTE PROCEDURE add_rating();
+
+
+-- Append-only log of the changes made through tournament.py, see
+-- eventlog.py. It outlives the tournaments, players and matches it describes,
+-- so it has no foreign keys, and its rows can't be changed or removed.
+CREATE TABLE events ( id BIGSERIAL PRIMARY KEY,
+                      tournament INTEGER,
+                      kind SMALLINT NOT NULL,
+                      payload BYTEA NOT NULL,
+                      logged_at TIMESTAMP NOT NULL DEFAULT now() );
+
+CREATE INDEX events_tournament ON events (tournament, id);
+
+CREATE FUNCTION reject_change() RETURNS trigger AS $$
+BEGIN
+  RAISE EXCEPTION '% is append-only', TG_TABLE_NAME;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER events_append_only
+  BEFORE UPDATE OR DELETE OR TRUNCATE ON events
+  FOR EACH STATEMENT EXECUTE PROCEDURE reject_change();
+
 
 CREATE VIEW tournament_status as
   SELECT tournaments.id,
          tournaments.name,
          players.id as player_id,
          players.name as player_name,
-         coalesce(sum(matches.won), 0) as wins,
-         count(matches.won) as matches,
-         coalesce(sum(matches.points), 0) as points
-  FROM tournaments
-  JOIN tournament_players
-    ON tournaments.id = tournament_players.tournament
+         standings.wins,
+         standings.matches,
+         standings.points
+  FROM standings
+  JOIN tournaments
+    ON tournaments.id = standings.tournament
   JOIN players
-    ON tournament_players.player = players.id
-  LEFT JOIN matches
-    ON tournaments.id = matches.tournament
-   AND players.id = matches.player
-  GROUP BY tournaments.id, players.id
+    ON players.id = standings.player
   ORDER BY tournaments.id, wins desc, points desc, players.id;
 
 
+-- Schema changes applied to this database, see migrations/.
+CREATE TABLE schema_migrations ( version INTEGER PRIMARY KEY,
+                                 applied_at TIMESTAMP NOT NULL DEFAULT now() );
+
+INSERT INTO schema_migrations ( version )
+  VALUES (1), (2), (3), (4), (5), (6), (7);
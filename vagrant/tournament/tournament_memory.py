@@ -0,0 +1,629 @@
+#!/usr/bin/env python
+#
+# tournament_memory.py -- in-memory implementation of tournament.py
+#
+# Provides the same functions as tournament.py, with the same arguments and
+# return shapes, keeping all the state in the process instead of PostgreSQL.
+# Code written against tournament.py can run on it unchanged:
+#
+#     import tournament_memory as tournament
+#
+# Set TOURNAMENT_BACKEND=memory to run tournament_test.py against it.
+#
+# `restore` loads a tournament from the event log of tournament.py, see
+# eventlog.py.
+
+import itertools
+
+import eventlog
+import ratings
+import swiss
+
+
+class IntegrityError(Exception):
+    """Raised where the database would reject a change with a constraint."""
+
+
+class Player(object):
+    __slots__ = ('id', 'name', 'tournaments', 'rating', 'games')
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.tournaments = 0
+        self.rating = ratings.INITIAL_RATING
+        self.games = 0
+
+
+# Numbers every match in the order it was reported, like the ids of the
+# `matches` table.
+_match_ids = itertools.count(1)
+
+
+class Match(object):
+    """One side of a match, like a row of the `matches` table."""
+    __slots__ = ('id', 'round', 'player', 'opponent', 'won', 'points')
+
+    def __init__(self, round, player, opponent, won, points):
+        self.id = next(_match_ids)
+        self.round = round
+        self.player = player
+        self.opponent = opponent
+        self.won = won
+        self.points = points
+
+
+class Standing(object):
+    """A player's running totals in a tournament."""
+    __slots__ = ('player', 'wins', 'matches', 'points')
+
+    def __init__(self, player):
+        self.player = player
+        self.wins = 0
+        self.matches = 0
+        self.points = 0
+
+    def add(self, match, sign=1):
+        self.wins += sign * match.won
+        self.matches += sign
+        self.points += sign * match.points
+
+
+class Tournament(object):
+    __slots__ = ('id', 'name', 'standings', 'matches', 'played', 'byes')
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.standings = {}
+        self.matches = []
+        self.played = set()
+        self.byes = set()
+
+    def register(self, player):
+        standing = Standing(player)
+        for match in self.matches:
+            if match.player is player:
+                standing.add(match)
+        self.standings[player.id] = standing
+
+    def record(self, match):
+        self.matches.append(match)
+        standing = self.standings.get(match.player.id)
+        if standing is not None:
+            standing.add(match)
+        if match.opponent is None:
+            self.byes.add(match.player.id)
+        else:
+            self.played.add(swiss.pair_key(match.player.id,
+                                           match.opponent.id))
+
+    def rebuild(self):
+        self.played = set()
+        self.byes = set()
+        matches, self.matches = self.matches, []
+        for player_id, standing in self.standings.items():
+            self.standings[player_id] = Standing(standing.player)
+        for match in matches:
+            self.record(match)
+
+    def next_round(self, players):
+        """Returns the round after the last one any of the players played."""
+        return max([self.standings[p].matches for p in players
+                    if p in self.standings] or [0]) + 1
+
+    def as_of(self, round):
+        """Returns the standings and the matches up to the end of a round."""
+        matches = [m for m in self.matches
+                   if m.round is not None and m.round <= round]
+        standings = dict((player_id, Standing(s.player))
+                         for player_id, s in self.standings.iteritems())
+        for match in matches:
+            standing = standings.get(match.player.id)
+            if standing is not None:
+                standing.add(match)
+        return standings, matches
+
+    def history(self, player):
+        """Returns (round, wins, matches) after each round a player played."""
+        totals = Standing(None)
+        history = []
+        for match in sorted((m for m in self.matches
+                             if m.player.id == player and m.round is not None),
+                            key=lambda m: m.round):
+            totals.add(match)
+            if history and history[-1][0] == match.round:
+                history.pop()
+            history.append((match.round, totals.wins, totals.matches))
+        return history
+
+    def ranking(self, tiebreak=None, as_of_round=None):
+        names = swiss.tiebreak_names(tiebreak)
+        standings, matches = self.standings, self.matches
+        if as_of_round is not None:
+            standings, matches = self.as_of(as_of_round)
+        scores = {}
+        if names:
+            wins = dict((player_id, s.wins)
+                        for player_id, s in standings.iteritems())
+            scores = swiss.tiebreak_scores(
+                wins, [(m.player.id, m.opponent and m.opponent.id, m.won)
+                       for m in matches])
+
+        def score(s, name):
+            if name == swiss.RATING:
+                return s.player.rating
+            return scores[s.player.id][name]
+
+        def key(s):
+            return ((-s.wins,) +
+                    tuple(-score(s, name) for name in names) +
+                    (-s.points, s.player.id))
+        return sorted(standings.itervalues(), key=key)
+
+
+class Store(object):
+    """All the state of the in-memory backend."""
+    def __init__(self):
+        self.players = {}
+        self.tournaments = {}
+        self.next_player_id = 1
+        self.next_tournament_id = 1
+
+    def player(self, player_id):
+        try:
+            return self.players[player_id]
+        except KeyError:
+            raise IntegrityError("Player %s does not exist" % player_id)
+
+    def tournament(self, tournament_id):
+        try:
+            return self.tournaments[tournament_id]
+        except KeyError:
+            raise IntegrityError(
+                "Tournament %s does not exist" % tournament_id)
+
+
+store = Store()
+
+
+def reset():
+    """Discards all the state."""
+    global store
+    store = Store()
+
+
+def delete_all_matches():
+    """Remove all the match records."""
+    for t in store.tournaments.itervalues():
+        t.matches = []
+        t.rebuild()
+
+
+def delete_matches(tournament):
+    """Remove all matches from a tournament."""
+    t = store.tournaments.get(tournament)
+    if t is not None:
+        t.matches = []
+        t.rebuild()
+
+
+def delete_tournaments():
+    """Remove all the tournament records."""
+    if any(t.matches for t in store.tournaments.itervalues()):
+        raise IntegrityError("Tournaments still have matches")
+    for t in store.tournaments.itervalues():
+        for standing in t.standings.itervalues():
+            standing.player.tournaments -= 1
+    store.tournaments.clear()
+
+
+def register_tournament(name):
+    """Adds a new tournament and returns its id."""
+    t = Tournament(store.next_tournament_id, name)
+    store.next_tournament_id += 1
+    store.tournaments[t.id] = t
+    return t.id
+
+
+def list_tournaments():
+    """Returns a list of all tournaments."""
+    return [(t.id, t.name) for t in sorted(store.tournaments.itervalues(),
+                                           key=lambda t: t.id)]
+
+
+def register_player_into_tournament(tournament, player):
+    """Register a player to participate in a tournament."""
+    t = store.tournament(tournament)
+    p = store.player(player)
+    if player in t.standings:
+        raise IntegrityError(
+            "Player %s is already registered in tournament %s"
+            % (player, tournament))
+    t.register(p)
+    p.tournaments += 1
+
+
+def register_players_into_tournament(tournament, player_ids):
+    """Register many players to participate in a tournament at once.
+
+    Returns:
+        The list of registered player ids.
+    """
+    registered = []
+    for player in player_ids:
+        register_player_into_tournament(tournament, player)
+        registered.append(player)
+    return registered
+
+
+def delete_all_players():
+    """Remove all the player records."""
+    if any(p.tournaments for p in store.players.itervalues()):
+        raise IntegrityError("Players are still registered in tournaments")
+    store.players.clear()
+
+
+def delete_players(tournament):
+    """Remove all the player records from a tournament."""
+    t = store.tournaments.get(tournament)
+    if t is not None:
+        for standing in t.standings.itervalues():
+            standing.player.tournaments -= 1
+        t.standings.clear()
+
+
+def count_all_players():
+    """Returns the number of players currently registered."""
+    return len(store.players)
+
+
+def count_players(tournament):
+    """Returns the number of players currently registered in a torunament."""
+    t = store.tournaments.get(tournament)
+    return len(t.standings) if t is not None else 0
+
+
+def register_player(name):
+    """Adds a player and returns its id."""
+    p = Player(store.next_player_id, name)
+    store.next_player_id += 1
+    store.players[p.id] = p
+    return p.id
+
+
+def register_players(names):
+    """Adds many players at once and returns their ids, in order."""
+    return [register_player(name) for name in names]
+
+
+def list_players():
+    """Returns a list of (id, name) of all registered players."""
+    return [(p.id, p.name) for p in sorted(store.players.itervalues(),
+                                           key=lambda p: p.id)]
+
+
+def iter_tournaments(batch_size=None):
+    """Yields every tournament as an (id, name) tuple."""
+    return iter(list_tournaments())
+
+
+def iter_players(batch_size=None):
+    """Yields every registered player as an (id, name) tuple."""
+    return iter(list_players())
+
+
+def player_standings(tournament, after=None, limit=None, tiebreak=None,
+                     as_of_round=None):
+    """Returns a list of (id, name, wins, matches), sorted by wins.
+
+    A page of at most `limit` players starting right after the player `after`
+    is returned when they are given, and players with the same wins are
+    ordered by `tiebreak` first when it is given, see tournament.py. With
+    `as_of_round` only the matches up to that round are counted.
+    """
+    t = store.tournaments.get(tournament)
+    if t is None:
+        return []
+    ranking = t.ranking(tiebreak, as_of_round)
+    if after is not None:
+        ids = [s.player.id for s in ranking]
+        if after not in ids:
+            return []
+        ranking = ranking[ids.index(after) + 1:]
+    if limit is not None:
+        ranking = ranking[:limit]
+    return [(s.player.id, s.player.name, s.wins, s.matches)
+            for s in ranking]
+
+
+def player_history(tournament, player):
+    """Returns (round, wins, matches) after each round a player played."""
+    t = store.tournaments.get(tournament)
+    if t is None or player not in t.standings:
+        return []
+    return t.history(player)
+
+
+def iter_standings(tournament, batch_size=None):
+    """Yields the standings of a tournament one player at a time."""
+    return iter(player_standings(tournament))
+
+
+def rate(results):
+    """Updates the players' ratings with the results of some matches."""
+    rated = {}
+    for (winner, loser) in results:
+        for player in (winner, loser):
+            rated[player.id] = player.rating
+    ratings.rate_matches(rated, [(w.id, l.id) for (w, l) in results])
+    for (winner, loser) in results:
+        for player in (winner, loser):
+            player.rating = rated[player.id]
+            player.games += 1
+
+
+def check_registered(t, players):
+    for player in players:
+        if player not in t.standings:
+            raise ValueError("Player %s is not registered in tournament %s"
+                             % (player, t.id))
+
+
+def report_match(tournament, winner, loser, round=None):
+    """Records the outcome of a single match between two players.
+
+    The round defaults to the one after the last either player played.
+    """
+    t = store.tournament(tournament)
+    won = store.player(winner)
+    lost = store.player(loser)
+    check_registered(t, (winner, loser))
+    if round is None:
+        round = t.next_round((winner, loser))
+    loser_wins = t.standings[loser].wins
+    t.record(Match(round, won, lost, 1, swiss.winner_points(loser_wins)))
+    t.record(Match(round, lost, won, 0, 0))
+    rate([(won, lost)])
+
+
+def report_round(tournament, results, round=None):
+    """Records the outcome of every match of a round at once.
+
+    Points are computed with the wins each loser had at the start of the
+    round. A None loser records a bye for the winner. The round defaults to
+    the one after the last any of the players played.
+    """
+    t = store.tournament(tournament)
+    wins = {}
+    for (winner, loser) in results:
+        check_registered(t, (winner,) if loser is None else (winner, loser))
+        if loser is not None:
+            wins[loser] = t.standings[loser].wins
+    if round is None:
+        round = t.next_round([p for result in results for p in result
+                              if p is not None])
+    rated = []
+    for (winner, loser) in results:
+        won = store.player(winner)
+        if loser is None:
+            t.record(Match(round, won, None, 1, swiss.BYE_POINTS))
+            continue
+        lost = store.player(loser)
+        t.record(Match(round, won, lost, 1, swiss.winner_points(wins[loser])))
+        t.record(Match(round, lost, won, 0, 0))
+        rated.append((won, lost))
+    rate(rated)
+
+
+def report_bye(tournament, player, round=None):
+    """Records a bye, which counts as a win without an opponent.
+
+    The round defaults to the one after the last the player played.
+    """
+    t = store.tournament(tournament)
+    if round is None:
+        round = t.next_round((player,))
+    t.record(Match(round, store.player(player), None, 1, swiss.BYE_POINTS))
+
+
+def played_pairs(tournament):
+    """Returns (played, byes) for a tournament, see tournament.py."""
+    t = store.tournaments.get(tournament)
+    if t is None:
+        return set(), set()
+    return set(t.played), set(t.byes)
+
+
+def rebuild_standings(tournament=None):
+    """Recomputes the standings from the recorded matches."""
+    if tournament is None:
+        for t in store.tournaments.itervalues():
+            t.rebuild()
+    elif tournament in store.tournaments:
+        store.tournaments[tournament].rebuild()
+
+
+def rebuild_ratings():
+    """Recomputes every player's rating from the recorded matches.
+
+    Returns:
+        The number of matches replayed.
+    """
+    games = sorted((m.id, m.player.id, m.opponent.id)
+                   for t in store.tournaments.itervalues()
+                   for m in t.matches
+                   if m.won and m.opponent is not None)
+    players = sorted(store.players)
+    rated, played = ratings.replay(players,
+                                   [w for (i, w, l) in games],
+                                   [l for (i, w, l) in games])
+    for i, player in enumerate(players):
+        store.players[player].rating = float(rated[i])
+        store.players[player].games = int(played[i])
+    return len(games)
+
+
+def player_ratings(limit=None):
+    """Returns (id, name, rating, matches) of the players ranked by rating."""
+    ranked = sorted(store.players.itervalues(),
+                    key=lambda p: (-p.rating, p.id))
+    return [(p.id, p.name, p.rating, p.games) for p in ranked[:limit]]
+
+
+def win_probability(player, opponent):
+    """Estimates the probability that a player beats an opponent."""
+    for p in (player, opponent):
+        if p not in store.players:
+            raise ValueError("Player %s does not exist" % p)
+    return ratings.expected_score(store.players[player].rating,
+                                  store.players[opponent].rating)
+
+
+def restored_player(player_id, name):
+    """Returns a player of the database, added with its id if missing."""
+    p = store.players.get(player_id)
+    if p is None:
+        p = Player(player_id, name)
+        store.players[player_id] = p
+        store.next_player_id = max(store.next_player_id, player_id + 1)
+    return p
+
+
+def remove_tournament(tournament):
+    t = store.tournaments.pop(tournament, None)
+    if t is not None:
+        for standing in t.standings.itervalues():
+            standing.player.tournaments -= 1
+
+
+def load_snapshot(snapshot):
+    """Adds the tournament of an `eventlog.Snapshot`.
+
+    The standings, played pairs and byes are taken as they are, only the
+    list of matches is built from the results.
+    """
+    t = Tournament(snapshot.tournament, snapshot.name)
+    store.tournaments[t.id] = t
+    store.next_tournament_id = max(store.next_tournament_id, t.id + 1)
+    for (row, name) in zip(snapshot.players.tolist(), snapshot.names):
+        (player, wins, matches, points, games, rating) = row
+        p = restored_player(player, name)
+        p.rating = rating
+        p.games = games
+        standing = Standing(p)
+        standing.wins = wins
+        standing.matches = matches
+        standing.points = points
+        t.standings[player] = standing
+        p.tournaments += 1
+    t.played = set(swiss.pair_key(a, b) for (a, b) in snapshot.pairs.tolist())
+    t.byes = set(snapshot.byes.tolist())
+    for (round, winner, loser, points) in snapshot.results.tolist():
+        won = restored_player(winner, None)
+        if not loser:
+            t.matches.append(Match(round or None, won, None, 1, points))
+            continue
+        lost = restored_player(loser, None)
+        t.matches.append(Match(round or None, won, lost, 1, points))
+        t.matches.append(Match(round or None, lost, won, 0, 0))
+
+
+def apply_event(tournament, kind, data):
+    """Applies an event of the log to a tournament, see eventlog.py."""
+    t = store.tournaments.get(tournament)
+    if kind == eventlog.REGISTER_TOURNAMENT:
+        remove_tournament(tournament)
+        store.tournaments[tournament] = Tournament(tournament, data)
+        store.next_tournament_id = max(store.next_tournament_id,
+                                       tournament + 1)
+    elif kind == eventlog.REGISTER_PLAYERS:
+        for (player, name) in data:
+            restored_player(player, name)
+    elif kind == eventlog.DELETE_ALL_PLAYERS:
+        for p in store.players.values():
+            if not p.tournaments:
+                del store.players[p.id]
+    elif t is None:
+        return
+    elif kind == eventlog.REGISTER_INTO_TOURNAMENT:
+        for (player, name) in data:
+            if player not in t.standings:
+                p = restored_player(player, name)
+                t.register(p)
+                p.tournaments += 1
+    elif kind == eventlog.REPORT_RESULTS:
+        rated = []
+        for (round, winner, loser, points) in data.tolist():
+            won = restored_player(winner, None)
+            if not loser:
+                t.record(Match(round or None, won, None, 1, points))
+                continue
+            lost = restored_player(loser, None)
+            t.record(Match(round or None, won, lost, 1, points))
+            t.record(Match(round or None, lost, won, 0, 0))
+            rated.append((won, lost))
+        rate(rated)
+    elif kind == eventlog.DELETE_MATCHES:
+        delete_matches(tournament)
+    elif kind == eventlog.DELETE_PLAYERS:
+        delete_players(tournament)
+    elif kind == eventlog.DELETE_TOURNAMENTS:
+        remove_tournament(tournament)
+
+
+def restore(tournament, events, snapshot=None):
+    """Loads a tournament from the event log of tournament.py.
+
+    Any tournament with the same id is replaced. Players keep the ids they
+    have in the database. Ratings start from the snapshot and then only
+    follow the matches of this tournament.
+
+    Args:
+        tournament: the tournament id.
+        events: the events after the snapshot, or all of them without one,
+          as yielded by `tournament.iter_events`.
+        snapshot: an `eventlog.Snapshot` of the tournament.
+    """
+    remove_tournament(tournament)
+    if snapshot is not None:
+        load_snapshot(snapshot)
+    for (event, tid, kind, data) in events:
+        if tid is None or tid == tournament:
+            apply_event(tournament, kind, data)
+
+
+def swiss_pairings(tournament, tiebreak=None):
+    """Returns a list of (id1, name1, id2, name2) for the next round."""
+    played, byes = played_pairs(tournament)
+    return swiss.pair_round(player_standings(tournament, tiebreak=tiebreak),
+                            played, byes)
+
+
+def player_standings_many(tournaments, tiebreak=None):
+    """Returns a dict of tournament id to its `player_standings`."""
+    return dict((tournament, player_standings(tournament, tiebreak=tiebreak))
+                for tournament in tournaments)
+
+
+def swiss_pairings_many(tournaments, tiebreak=None, processes=None):
+    """Returns a dict of tournament id to its `swiss_pairings`.
+
+    Large fields are paired across a pool of processes, see
+    `swiss.pair_rounds`.
+    """
+    ids = list(set(tournaments))
+    rounds = [(player_standings(tournament, tiebreak=tiebreak),) +
+              played_pairs(tournament) for tournament in ids]
+    return dict(zip(ids, swiss.pair_rounds(rounds, processes)))
+
+
+def report_winner(tournament, tiebreak=None):
+    """Returns the winner (id, name, wins, matches) of a tournament or None."""
+    standings = player_standings(tournament, tiebreak=tiebreak)
+    if not standings:
+        return None
+    first_player = standings[0]
+    if first_player[3] < swiss.min_rounds(len(standings)):
+        return None
+    return first_player
@@ -1,8 +1,26 @@
 #!/usr/bin/env python
 #
 # Test cases for tournament.py
+#
+# Set TOURNAMENT_BACKEND=memory to run them against tournament_memory.py, or
+# TOURNAMENT_BACKEND=green to run them from gevent greenlets (see green.py).
+
+import os
+import random
+
+import ratings
+import swiss
 
-from tournament import *
+BACKEND = os.environ.get('TOURNAMENT_BACKEND', 'postgres')
+
+if BACKEND == 'memory':
+    from tournament_memory import *
+else:
+    if BACKEND == 'green':
+        import green
+        green.patch()
+    import db
+    from tournament import *
 
 
 def test_count():
@@ -433,6 +451,987 @@ def test_report_winner():
     print "19. The right winner is reported."
 
 
+def test_bulk_registration():
+    """Test registering many players at once, in and out of tournaments."""
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    names = ["Player %s" % i for i in xrange(250)]
+    ids = register_players(names)
+    if len(ids) != 250 or len(set(ids)) != 250:
+        raise ValueError(
+            "register_players should return one new id per player")
+    if dict(list_players()) != dict(zip(ids, names)):
+        raise ValueError(
+            "register_players should return the ids in the order of the names")
+    print "20. register_players() registers all players and returns their ids."  # noqa
+
+    tid = register_tournament("Bulk contest")
+    registered = register_players_into_tournament(tid, ids[:100])
+    if sorted(registered) != sorted(ids[:100]):
+        raise ValueError(
+            "register_players_into_tournament should return the registered "
+            "player ids")
+    c = count_players(tid)
+    if c != 100:
+        raise ValueError(
+            "After registering 100 players, count_players() should be 100. "
+            "Got {c}".format(c=c))
+    print "21. register_players_into_tournament() registers all players."
+
+
+def test_rebuild_standings():
+    """Test that rebuilding the standings from the matches changes nothing."""
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    register_players(["A", "B", "C", "D"])
+    tid = register_tournament("Rebuild contest")
+    register_all_players_into(tid)
+    [a, b, c, d] = [row[0] for row in player_standings(tid)]
+    report_match(tid, a, b)
+    report_match(tid, c, d)
+    report_match(tid, a, c)
+
+    before = player_standings(tid)
+    rebuild_standings(tid)
+    if player_standings(tid) != before:
+        raise ValueError(
+            "Rebuilding the standings should not change them")
+    print "22. rebuild_standings() recomputes the same standings."
+
+
+def test_pairings_with_odd_players():
+    """Test that one player gets a bye when the number of players is odd."""
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    register_players(["A", "B", "C", "D", "E"])
+    tid = register_tournament("Odd contest")
+    register_all_players_into(tid)
+
+    pairings = swiss_pairings(tid)
+    if len(pairings) != 3:
+        raise ValueError(
+            "For five players, swiss_pairings should return 3 pairs. Got {pairs}"  # noqa
+            .format(pairs=len(pairings)))
+    (bye_id, bye_name, none_id, none_name) = pairings[-1]
+    if none_id is not None or none_name is not None:
+        raise ValueError(
+            "The last pair should be the bye, with no opponent")
+    players = set()
+    for (pid1, pname1, pid2, pname2) in pairings:
+        players.update([pid1, pid2])
+    if len(players - set([None])) != 5:
+        raise ValueError("Every player should appear once in the pairings")
+
+    for (pid1, pname1, pid2, pname2) in pairings[:-1]:
+        report_match(tid, pid1, pid2)
+    report_bye(tid, bye_id)
+    next_bye = swiss_pairings(tid)[-1][0]
+    if next_bye == bye_id:
+        raise ValueError("A player should not get a second bye")
+    print "23. With an odd number of players, one player gets a bye."
+
+
+def test_pairings_avoid_rematches():
+    """Test that players are not paired with opponents they already played."""
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    register_players(["A", "B", "C", "D", "E", "F"])
+    tid = register_tournament("Round robin")
+    register_all_players_into(tid)
+
+    played = set()
+    for round in xrange(5):
+        for (pid1, pname1, pid2, pname2) in swiss_pairings(tid):
+            pair = frozenset([pid1, pid2])
+            if pair in played:
+                raise ValueError(
+                    "Players %s and %s should not be paired twice"
+                    % (pname1, pname2))
+            played.add(pair)
+            report_match(tid, pid1, pid2)
+    print "24. Players are never paired with the same opponent twice."
+
+
+def test_report_round():
+    """Test that reporting a whole round equals reporting match by match."""
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    register_players(["A", "B", "C", "D", "E", "F", "G"])
+    tid1 = register_tournament("Match by match")
+    tid2 = register_tournament("Round by round")
+    register_all_players_into(tid1)
+    register_all_players_into(tid2)
+
+    for round in xrange(3):
+        results = [(pid1, pid2) for (pid1, pname1, pid2, pname2)
+                   in swiss_pairings(tid1)]
+        for (winner, loser) in results:
+            if loser is None:
+                report_bye(tid1, winner)
+            else:
+                report_match(tid1, winner, loser)
+        report_round(tid2, results)
+
+    if player_standings(tid1) != player_standings(tid2):
+        raise ValueError(
+            "report_round should give the same standings as report_match")
+    if played_pairs(tid1) != played_pairs(tid2):
+        raise ValueError(
+            "report_round should record the same matches as report_match")
+    print "25. report_round() records a whole round like report_match() does."
+
+
+def test_read_cache():
+    """Test that cached reads are served until the tournament changes."""
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    register_players(["A", "B", "C", "D"])
+    tid = register_tournament("Cached contest")
+    register_all_players_into(tid)
+
+    cache.enable(maxsize=16)
+    try:
+        standings = player_standings(tid)
+        if player_standings(tid) != standings:
+            raise ValueError("Cached standings should not change")
+        if cache.info()['hits'] != 1:
+            raise ValueError(
+                "Repeated reads should be served from the cache")
+
+        [a, b, c, d] = [row[0] for row in standings]
+        played, byes = played_pairs(tid)
+        played.add(swiss.pair_key(a, b))
+        byes.add(a)
+        if played_pairs(tid) != (set(), set()):
+            raise ValueError("Changing a cached result should not change "
+                             "the cache")
+        report_match(tid, d, a)
+        if player_standings(tid)[0][0] != d:
+            raise ValueError(
+                "report_match should invalidate the cached standings")
+
+        # Ratings change with the matches of every tournament.
+        other = register_tournament("Rated contest")
+        register_all_players_into(other)
+        if player_standings(other, tiebreak="rating")[0][0] != d:
+            raise ValueError("D leads by rating after beating A")
+        report_match(tid, c, d)
+        if player_standings(other, tiebreak="rating")[0][0] != c:
+            raise ValueError("report_match should invalidate the cached "
+                             "standings by rating of every tournament")
+
+        delete_players(tid)
+        if count_players(tid) != 0:
+            raise ValueError(
+                "delete_players should invalidate the cached player count")
+    finally:
+        cache.disable()
+    print "26. Cached reads are invalidated when the tournament changes."
+
+
+def test_concurrent_requests():
+    """Test that greenlets wait for the database concurrently."""
+    import time
+
+    def slow_query():
+        with new_transaction() as cr:
+            cr.execute("select pg_sleep(0.2)")
+        return count_all_players()
+
+    start = time.time()
+    results = green.gather([green.spawn(slow_query) for _ in xrange(5)])
+    elapsed = time.time() - start
+    if results != [count_all_players()] * 5:
+        raise ValueError("Every greenlet should return its own result")
+    if elapsed > 0.6:
+        raise ValueError(
+            "Five 0.2s queries from greenlets should run concurrently, "
+            "took %.2fs" % elapsed)
+    print "27. Requests from greenlets run concurrently."
+
+
+def test_paged_standings():
+    """Test that standings can be read page by page or streamed."""
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    register_players(["Player %s" % i for i in xrange(25)])
+    tid = register_tournament("Paged contest")
+    register_all_players_into(tid)
+    for round in xrange(2):
+        report_round(tid, [(pid1, pid2) for (pid1, pname1, pid2, pname2)
+                           in swiss_pairings(tid)])
+
+    standings = player_standings(tid)
+    pages = [player_standings(tid, limit=7)]
+    while pages[-1]:
+        pages.append(player_standings(tid, after=pages[-1][-1][0], limit=7))
+    if [len(page) for page in pages] != [7, 7, 7, 4, 0]:
+        raise ValueError("Pages should hold at most `limit` players")
+    if sum(pages, []) != standings:
+        raise ValueError("The pages should add up to the whole standings")
+    if list(iter_standings(tid, batch_size=3)) != standings:
+        raise ValueError("iter_standings should yield the standings in order")
+    if list(iter_players(batch_size=3)) != sorted(list_players()):
+        raise ValueError("iter_players should yield every player")
+    if list(iter_tournaments(batch_size=3)) != sorted(list_tournaments()):
+        raise ValueError("iter_tournaments should yield every tournament")
+    print "28. Standings can be read page by page or streamed."
+
+
+def test_tiebreaks():
+    """Test that players with the same wins can be ranked by tiebreaks."""
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    [a, b, c, d, e, f] = register_players(["A", "B", "C", "D", "E", "F"])
+    tid = register_tournament("Tiebreak contest")
+    register_all_players_into(tid)
+    results = [(a, b), (c, d), (e, f),
+               (a, c), (e, b), (d, f),
+               (c, e), (b, d), (f, a)]
+    for (winner, loser) in results:
+        report_match(tid, winner, loser)
+
+    if [row[0] for row in player_standings(tid)] != [c, a, e, f, b, d]:
+        raise ValueError("Players with the same wins are ranked by points")
+    if ([row[0] for row in player_standings(tid, tiebreak="head_to_head")] !=
+            [c, a, e, b, d, f]):
+        raise ValueError(
+            "With head_to_head, B beat D and D beat F in the one-win group")
+    scores = swiss.tiebreak_scores(
+        dict((row[0], row[2]) for row in player_standings(tid)),
+        [(w, l, 1) for (w, l) in results] + [(l, w, 0) for (w, l) in results])
+    if ([scores[p]['buchholz'] for p in (a, b, c, d, e, f)] !=
+            [4, 5, 5, 4, 4, 5]):
+        raise ValueError("Buchholz is the sum of the opponents' wins")
+    if [scores[p]['median_buchholz'] for p in (a, b, c)] != [1, 2, 2]:
+        raise ValueError(
+            "Median Buchholz leaves out the best and worst opponents")
+    if [scores[p]['sonneborn_berger'] for p in (a, e, f)] != [3, 2, 2]:
+        raise ValueError(
+            "Sonneborn-Berger is the sum of the beaten opponents' wins")
+    try:
+        player_standings(tid, tiebreak="coin toss")
+    except ValueError:
+        pass
+    else:
+        raise ValueError("Unknown tiebreaks should be rejected")
+
+    # A larger field, checked against the scores computed in Python.
+    delete_matches(tid)
+    delete_players(tid)
+    register_players(["Player %s" % i for i in xrange(24)])
+    register_all_players_into(tid)
+    rng = random.Random(13)
+    results = []
+    for round in xrange(swiss.min_rounds(count_players(tid))):
+        pairs = [(pid1, pid2) for (pid1, pname1, pid2, pname2)
+                 in swiss_pairings(tid, tiebreak="buchholz")]
+        pairs = [pair if rng.random() < 0.5 else pair[::-1] for pair in pairs]
+        report_round(tid, pairs)
+        results.extend((w, l, 1) for (w, l) in pairs if l is not None)
+        results.extend((l, w, 0) for (w, l) in pairs if l is not None)
+
+    standings = player_standings(tid)
+    scores = swiss.tiebreak_scores(
+        dict((row[0], row[2]) for row in standings), results)
+    for tiebreak in swiss.TIEBREAKS + (("head_to_head", "buchholz"),):
+        names = swiss.tiebreak_names(tiebreak)
+        expected = sorted(standings, key=lambda row: (-row[2],) + tuple(
+            -scores[row[0]][name] for name in names))
+        if player_standings(tid, tiebreak=tiebreak) != expected:
+            raise ValueError("Standings by %s are not in the right order"
+                             % (tiebreak,))
+        page = player_standings(tid, limit=10, tiebreak=tiebreak)
+        page += player_standings(tid, after=page[-1][0], tiebreak=tiebreak)
+        if page != expected:
+            raise ValueError("Pages by %s should add up to the standings"
+                             % (tiebreak,))
+        if report_winner(tid, tiebreak=tiebreak) != expected[0]:
+            raise ValueError("The winner by %s should be %s"
+                             % (tiebreak, expected[0][1]))
+    print "29. Players with the same wins can be ranked by tiebreaks."
+
+
+def test_ratings():
+    """Test that ratings follow the results and seed new tournaments."""
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    [a, b, c, d] = register_players(["A", "B", "C", "D"])
+    if any(row[2] != ratings.INITIAL_RATING or row[3]
+           for row in player_ratings()):
+        raise ValueError("New players should start at the initial rating")
+    tid = register_tournament("Rated contest")
+    register_all_players_into(tid)
+    report_match(tid, a, b)
+    report_match(tid, a, c)
+    report_round(tid, [(c, d)])
+
+    expected = {}
+    games = ratings.rate_matches(expected, [(a, b), (a, c), (c, d)])
+    ranked = player_ratings()
+    for (player, name, rating, played) in ranked:
+        if abs(rating - expected[player]) > 0.01:
+            raise ValueError("%s should be rated %.2f, not %.2f"
+                             % (name, expected[player], rating))
+        if played != games[player]:
+            raise ValueError("%s played %s rated matches, not %s"
+                             % (name, games[player], played))
+    if [row[0] for row in ranked] != sorted(expected, key=expected.get,
+                                            reverse=True):
+        raise ValueError("player_ratings should rank players by rating")
+    if player_ratings(limit=2) != ranked[:2]:
+        raise ValueError("player_ratings should return at most `limit` rows")
+    if not 0.5 < win_probability(a, b) < 1:
+        raise ValueError("A should be the favourite against B")
+    if abs(win_probability(a, b) + win_probability(b, a) - 1) > 1e-9:
+        raise ValueError("Either A or B wins")
+
+    # Round one of a new tournament, where everybody has zero wins.
+    other = register_tournament("Seeded contest")
+    register_all_players_into(other)
+    seeded = [row[0] for row in player_standings(other, tiebreak="rating")]
+    if seeded != [row[0] for row in ranked]:
+        raise ValueError("Round one standings by rating should be seeded")
+    pairs = [(pid1, pid2) for (pid1, pname1, pid2, pname2)
+             in swiss_pairings(other, tiebreak="rating")]
+    if pairs != [(seeded[0], seeded[1]), (seeded[2], seeded[3])]:
+        raise ValueError("Round one should pair players of close ratings")
+
+    if rebuild_ratings() != 3:
+        raise ValueError("rebuild_ratings should replay the three matches")
+    for (player, name, rating, played) in player_ratings():
+        if abs(rating - expected[player]) > 0.01:
+            raise ValueError("Rebuilt ratings should match the reported ones")
+    delete_matches(tid)
+    rebuild_ratings()
+    if any(row[2] != ratings.INITIAL_RATING or row[3]
+           for row in player_ratings()):
+        raise ValueError("Without matches every player is back to the "
+                         "initial rating")
+    print "33. Ratings follow the results and seed new tournaments."
+
+
+def test_round_history():
+    """Test that the standings after each round can be read back."""
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    players = register_players(["A", "B", "C", "D", "E"])
+    tid = register_tournament("Round contest")
+    register_all_players_into(tid)
+    after_round = {}
+    by_buchholz = {}
+    for round in (1, 2, 3):
+        pairs = [(pid1, pid2) for (pid1, pname1, pid2, pname2)
+                 in swiss_pairings(tid)]
+        if round == 2:
+            for (winner, loser) in pairs:
+                if loser is None:
+                    report_bye(tid, winner)
+                else:
+                    report_match(tid, winner, loser)
+        else:
+            report_round(tid, pairs)
+        after_round[round] = player_standings(tid)
+        by_buchholz[round] = player_standings(tid, tiebreak="buchholz")
+
+    for round in (1, 2, 3):
+        if player_standings(tid, as_of_round=round) != after_round[round]:
+            raise ValueError("The standings as of round %s should be the "
+                             "ones read after it" % round)
+        if (player_standings(tid, tiebreak="buchholz", as_of_round=round) !=
+                by_buchholz[round]):
+            raise ValueError("Tiebreaks as of round %s should only count "
+                             "the matches up to it" % round)
+    page = player_standings(tid, limit=2, as_of_round=1)
+    page += player_standings(tid, after=page[-1][0], as_of_round=1)
+    if page != after_round[1]:
+        raise ValueError("Pages as of a round should add up to its standings")
+    for player in players:
+        expected = [(round, row[2], row[3])
+                    for round in (1, 2, 3)
+                    for row in after_round[round] if row[0] == player]
+        if player_history(tid, player) != expected:
+            raise ValueError("The history of a player should list their "
+                             "record after each round")
+
+    # A late entry plays a round of its own.
+    late = register_player("Late")
+    register_player_into_tournament(tid, late)
+    report_match(tid, late, players[0], round=4)
+    if player_history(tid, late) != [(4, 1, 1)]:
+        raise ValueError("The late player won their only match in round 4")
+    if [row for row in player_standings(tid, as_of_round=3)
+            if row[0] != late] != after_round[3]:
+        raise ValueError("Round 4 should leave the earlier rounds alone")
+    if (late, "Late", 0, 0) not in player_standings(tid, as_of_round=3):
+        raise ValueError("Players without matches yet have no wins")
+    if player_standings(tid, as_of_round=4) != player_standings(tid):
+        raise ValueError("The standings as of the last round are the "
+                         "current ones")
+    # A result reported late counts from its round on.
+    report_match(tid, players[1], late, round=2)
+    if player_history(tid, late) != [(2, 0, 1), (4, 1, 2)]:
+        raise ValueError("The late player lost a match in round 2")
+    wins = dict((row[0], row[2]) for row in after_round[2])
+    if [row[2] for row in player_standings(tid, as_of_round=2)
+            if row[0] == players[1]] != [wins[players[1]] + 1]:
+        raise ValueError("B won one more match in round 2")
+
+    before = [player_standings(tid, as_of_round=round)
+              for round in (1, 2, 3, 4)]
+    rebuild_standings(tid)
+    if [player_standings(tid, as_of_round=round)
+            for round in (1, 2, 3, 4)] != before:
+        raise ValueError("Rebuilding should not change the round standings")
+    delete_matches(tid)
+    if any(row[3] for row in player_standings(tid, as_of_round=1)):
+        raise ValueError("Without matches nobody played in round 1")
+    if player_history(tid, late):
+        raise ValueError("Without matches players have no history")
+    print "36. The standings after each round can be read back."
+
+
+def test_many_tournaments():
+    """Test that many tournaments are read and paired at once."""
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    players = register_players(["Player %s" % i for i in xrange(15)])
+    tournaments = []
+    for (size, rounds) in ((8, 2), (5, 3), (2, 0)):
+        tid = register_tournament("Contest of %s" % size)
+        register_players_into_tournament(tid, random.sample(players, size))
+        for _ in xrange(rounds):
+            report_round(tid, [(pid1, pid2) for (pid1, pname1, pid2, pname2)
+                               in swiss_pairings(tid)])
+        tournaments.append(tid)
+    tournaments.append(max(tournaments) + 1)
+
+    for tiebreak in (None, "buchholz"):
+        standings = player_standings_many(tournaments, tiebreak=tiebreak)
+        if standings != dict((tid, player_standings(tid, tiebreak=tiebreak))
+                             for tid in tournaments):
+            raise ValueError("Standings read at once should be the same")
+    if standings[tournaments[-1]] != []:
+        raise ValueError("Unknown tournaments should have no standings")
+    expected = dict((tid, swiss_pairings(tid)) for tid in tournaments)
+    for processes in (1, 2):
+        if swiss_pairings_many(tournaments, processes=processes) != expected:
+            raise ValueError("Pairings made at once should be the same")
+    print "39. Many tournaments are read and paired at once."
+
+
+def test_tied_opponents():
+    """Test that median Buchholz leaves out one opponent when several tie."""
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    register_players(["Player %s" % i for i in xrange(8)])
+    tid = register_tournament("Tied opponents")
+    register_all_players_into(tid)
+    rng = random.Random(7)
+    for _ in xrange(10):
+        delete_matches(tid)
+        results = []
+        for round in xrange(3):
+            pairs = [(pid1, pid2) for (pid1, pname1, pid2, pname2)
+                     in swiss_pairings(tid)]
+            pairs = [pair if rng.random() < 0.5 else pair[::-1]
+                     for pair in pairs]
+            report_round(tid, pairs)
+            results.extend((w, l, 1) for (w, l) in pairs)
+            results.extend((l, w, 0) for (w, l) in pairs)
+
+        standings = player_standings(tid)
+        scores = swiss.tiebreak_scores(
+            dict((row[0], row[2]) for row in standings), results)
+        expected = sorted(standings, key=lambda row: (
+            -row[2], -scores[row[0]]['median_buchholz']))
+        ranked = player_standings(tid, tiebreak="median_buchholz")
+        if ranked != expected:
+            raise ValueError("Median Buchholz should leave out only one of "
+                             "the opponents tied for best or worst")
+        if BACKEND != 'memory':
+            import tournament_memory
+            tournament_memory.reset()
+            tournament_memory.restore(tid, iter_events(tid))
+            if (tournament_memory.player_standings(
+                    tid, tiebreak="median_buchholz") != ranked):
+                raise ValueError(
+                    "Both backends should rank by median Buchholz alike")
+            tournament_memory.reset()
+    print "41. Median Buchholz leaves out one opponent when several tie."
+
+
+def test_event_log():
+    """Test that tournaments can be restored from the event log."""
+    import shutil
+    import tempfile
+    import psycopg2
+    import eventlog
+    import tournament_memory
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    players = register_players(["A", "B", "C", "D", "E", "F"])
+    tid = register_tournament("Logged contest")
+    other = register_tournament("Other contest")
+    register_players_into_tournament(tid, players[:5])
+    register_player_into_tournament(other, players[5])
+
+    def play_round():
+        pairs = [(pid1, pid2) for (pid1, pname1, pid2, pname2)
+                 in swiss_pairings(tid)]
+        report_round(tid, pairs)
+
+    def restored(snapshot, until=None):
+        tournament_memory.reset()
+        tournament_memory.restore(
+            tid, iter_events(tid, snapshot.event if snapshot else 0, until),
+            snapshot)
+        return tournament_memory
+
+    directory = tempfile.mkdtemp()
+    try:
+        play_round()
+        path = snapshot_tournament(tid, directory)
+        for (pid1, pname1, pid2, pname2) in swiss_pairings(tid):
+            if pid2 is None:
+                report_bye(tid, pid1)
+            else:
+                report_match(tid, pid1, pid2)
+        register_player_into_tournament(tid, players[5])
+        play_round()
+        snapshot = eventlog.latest_snapshot(directory, tid)
+        if snapshot is None or eventlog.load_snapshot(path).event != \
+                snapshot.event:
+            raise ValueError("The snapshot written should be the latest")
+        if len(snapshot.results) != 3 or snapshot.name != "Logged contest":
+            raise ValueError("The snapshot should hold the first round")
+
+        for start in (snapshot, None):
+            memory = restored(start)
+            if memory.list_tournaments() != [(tid, "Logged contest")]:
+                raise ValueError("Only the restored tournament is loaded")
+            if memory.player_standings(tid) != player_standings(tid):
+                raise ValueError("Restored standings should be the same")
+            if memory.played_pairs(tid) != played_pairs(tid):
+                raise ValueError("Restored played pairs should be the same")
+            for round in (1, 2, 3):
+                if (memory.player_standings(tid, tiebreak="buchholz",
+                                            as_of_round=round) !=
+                        player_standings(tid, tiebreak="buchholz",
+                                         as_of_round=round)):
+                    raise ValueError("Restored rounds should be the same")
+            for player in players:
+                if (memory.player_history(tid, player) !=
+                        player_history(tid, player)):
+                    raise ValueError("Restored histories should be the same")
+            rated = dict((row[0], row[2]) for row in player_ratings())
+            for (player, name, rating, games) in memory.player_ratings():
+                if abs(rating - rated[player]) > 0.01:
+                    raise ValueError("Restored ratings should be the same")
+
+        # Deleting the matches keeps them in the log.
+        before = player_standings(tid)
+        last = max(event[0] for event in iter_events(tid))
+        delete_matches(tid)
+        if restored(None, until=last).player_standings(tid) != before:
+            raise ValueError("The log should restore deleted matches")
+        if restored(snapshot).player_standings(tid) != player_standings(tid):
+            raise ValueError("Replaying the deletion should delete the "
+                             "matches")
+        tournament_memory.reset()
+
+        try:
+            with new_transaction() as cr:
+                cr.execute("delete from events")
+        except psycopg2.Error:
+            pass
+        else:
+            raise ValueError("Events should not be deleted")
+    finally:
+        shutil.rmtree(directory)
+    print "37. Tournaments are restored from a snapshot and the event log."
+
+
+def test_export_import():
+    """Test that tournaments are exported to columnar files and imported."""
+    import shutil
+    import tempfile
+    import columnar
+    import tournament_memory
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    players = register_players(["A", "B", "C", "D", "E", "F", "G"])
+    tid = register_tournament("Exported contest")
+    register_players_into_tournament(tid, players[:5])
+    for _ in xrange(2):
+        report_round(tid, [(pid1, pid2) for (pid1, pname1, pid2, pname2)
+                           in swiss_pairings(tid)])
+    # Players who only played, and players outside of the tournament.
+    register_player_into_tournament(tid, players[5])
+    report_match(tid, players[5], players[0])
+    delete_players(tid)
+    register_players_into_tournament(tid, players[1:6])
+
+    def without_ids(rows):
+        return [row[1:] for row in rows]
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = directory + "/contest.tcol"
+        # Two rows a match, one a bye.
+        if export_tournament(tid, path) != (6, 12):
+            raise ValueError("Six players and twelve matches rows should be "
+                             "exported")
+        export = columnar.load_export(path)
+        if export.name != "Exported contest":
+            raise ValueError("The tournament's name should be exported")
+        for as_of in (None, 1, 2):
+            if (columnar.standings(export, as_of_round=as_of) !=
+                    player_standings(tid, as_of_round=as_of)):
+                raise ValueError("Exported standings should be the same")
+
+        imported = import_tournament(path, "Imported contest")
+        if (imported, "Imported contest") not in list_tournaments():
+            raise ValueError("The import should be a new tournament")
+        if count_all_players() != 13:
+            raise ValueError("Imported players should be new players")
+        for as_of in (None, 1, 3):
+            if (without_ids(player_standings(imported, as_of_round=as_of,
+                                             tiebreak="buchholz")) !=
+                    without_ids(player_standings(tid, as_of_round=as_of,
+                                                 tiebreak="buchholz"))):
+                raise ValueError("Imported standings should be the same")
+        if len(played_pairs(imported)[0]) != len(played_pairs(tid)[0]):
+            raise ValueError("Imported matches should be the same")
+        rated = sorted((name, round(rating, 2))
+                       for (id, name, rating, games) in player_ratings()
+                       if games)
+        if rated[::2] != rated[1::2]:
+            raise ValueError("Imported ratings should be the same")
+
+        tournament_memory.reset()
+        tournament_memory.restore(imported, iter_events(imported))
+        if (tournament_memory.player_standings(imported) !=
+                player_standings(imported)):
+            raise ValueError("Imports should be in the event log")
+        tournament_memory.reset()
+    finally:
+        shutil.rmtree(directory)
+    print "38. Tournaments are exported to columnar files and imported."
+
+
+def test_metrics():
+    """Test that calls and statements are timed while metrics are enabled."""
+    import metrics
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    register_players(["A", "B", "C", "D"])
+    tid = register_tournament("Timed contest")
+    register_all_players_into(tid)
+
+    observed = []
+
+    def hook(metric, function, value):
+        observed.append((metric, function, value))
+
+    metrics.enable()
+    metrics.add_hook(hook)
+    try:
+        swiss_pairings(tid)
+        info = metrics.info()
+        text = metrics.export()
+    finally:
+        metrics.remove_hook(hook)
+        metrics.disable()
+
+    if info['function_seconds']['swiss_pairings'][0] != 1:
+        raise ValueError("swiss_pairings should have been timed once")
+    if info['query_rows']['swiss_pairings'][1] != 4:
+        raise ValueError("The standings query should have returned 4 rows")
+    if 'swiss_pairings' not in info['connection_wait_seconds']:
+        raise ValueError("Waiting for a connection should be timed")
+    if len(observed) != sum(count for histograms in info.values()
+                            for (count, total) in histograms.values()):
+        raise ValueError("Hooks should see every observation")
+    # Setting the isolation level, the standings and the played pairs.
+    if ('tournament_query_seconds_count{function="swiss_pairings"} 3'
+            not in text.splitlines()):
+        raise ValueError("The export should count every statement")
+    print "30. Calls and statements are timed while metrics are enabled."
+
+
+def test_archive_tournament():
+    """Test that archived tournaments keep their standings."""
+    import psycopg2
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    [a, b, c, d] = register_players(["A", "B", "C", "D"])
+    tid = register_tournament("Archived contest")
+    other = register_tournament("Active contest")
+    register_all_players_into(tid)
+    register_all_players_into(other)
+    report_round(tid, [(a, b), (c, d)])
+    report_round(other, [(a, c), (b, d)])
+    standings = player_standings(tid)
+
+    table = archive_tournament(tid)
+    if player_standings(tid) != standings:
+        raise ValueError("Archiving should keep the standings")
+    with new_transaction() as cr:
+        cr.execute("select count(*) from matches where tournament = %s",
+                   (tid,))
+        if cr.fetchone()[0] != 0:
+            raise ValueError("Archived matches should leave the matches table")
+        cr.execute("select count(*) from " + table)
+        if cr.fetchone()[0] != 4:
+            raise ValueError("Archived matches should be kept in %s" % table)
+    try:
+        report_match(tid, a, c)
+    except psycopg2.IntegrityError:
+        pass
+    else:
+        raise ValueError("Archived tournaments should not take new matches")
+
+    delete_matches(other)
+    if [row[3] for row in player_standings(other)] != [0, 0, 0, 0]:
+        raise ValueError("delete_matches should reset the standings")
+    delete_all_matches()
+    if player_standings(tid) != standings:
+        raise ValueError("delete_all_matches should keep archived standings")
+    delete_tournaments()
+    delete_all_players()
+    with new_transaction() as cr:
+        cr.execute("select count(*) from " + table)
+        if cr.fetchone()[0] != 4:
+            raise ValueError("Archived matches should outlive the tournament")
+        cr.execute("drop table " + table)
+    print "31. Archived tournaments keep their standings."
+
+
+def test_prepared_statements():
+    """Test that hot queries are prepared again on new connections."""
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    register_players(["A", "B", "C", "D"])
+    tid = register_tournament("Prepared contest")
+    register_all_players_into(tid)
+
+    def prepared():
+        with new_transaction() as cr:
+            cr.execute("select name from pg_prepared_statements")
+            return set(row[0] for row in cr.fetchall())
+
+    sizes = dict((k, db.config[k]) for k in ('minconn', 'maxconn', 'replicas'))
+    db.configure(minconn=1, maxconn=1, replicas=[])
+    try:
+        count_players(tid)
+        if "count_players" not in prepared():
+            raise ValueError("count_players should run a prepared statement")
+        db.configure()
+        if "count_players" in prepared():
+            raise ValueError("A new connection has no prepared statements")
+        if count_players(tid) != 4 or "count_players" not in prepared():
+            raise ValueError("Statements should be prepared again after "
+                             "reconnecting")
+    finally:
+        db.configure(**sizes)
+    print "32. Hot queries are prepared again on new connections."
+
+
+def test_live_standings():
+    """Test that subscribers follow the standings from their events."""
+    import time
+    import live
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    [a, b, c, d, e] = register_players(["A", "B", "C", "D", "E"])
+    tid = register_tournament("Live contest")
+    other = register_tournament("Other contest")
+    register_players_into_tournament(tid, [a, b, c, d])
+    register_players_into_tournament(other, [a, b])
+
+    subscriber = live.Subscriber()
+    try:
+        board = subscriber.follow(tid)
+
+        def synced(message):
+            deadline = time.time() + 5
+            while board.standings() != player_standings(tid):
+                if time.time() > deadline:
+                    raise ValueError(message)
+                subscriber.wait(timeout=0.1)
+
+        synced("Following a tournament should read its standings")
+        report_match(tid, a, b)
+        if subscriber.wait(timeout=5) != set([tid]):
+            raise ValueError("report_match should notify the subscriber")
+        synced("report_match should push the players' new standings")
+        report_match(other, b, a)
+        report_round(tid, [(c, d), (b, a)])
+        synced("report_round should push the players' new standings")
+        register_player_into_tournament(tid, e)
+        report_bye(tid, e)
+        synced("Registrations and byes should be pushed")
+
+        names = ["Player %s %s" % (i, "x" * 80) for i in xrange(300)]
+        register_players_into_tournament(tid, register_players(names))
+        synced("Events larger than a NOTIFY payload should be split")
+        rebuild_standings(tid)
+        synced("rebuild_standings should make the subscriber read again")
+        delete_matches(tid)
+        synced("delete_matches should reset the standings")
+        delete_players(tid)
+        synced("delete_players should clear the standings")
+        if board.standings():
+            raise ValueError("A tournament without players has no standings")
+    finally:
+        subscriber.close()
+
+    for payload in live.encode(live.REGISTER,
+                               [(i, 0, 0, 0, "x" * 100) for i in xrange(500)]):
+        if len(payload) >= 8000:
+            raise ValueError("NOTIFY payloads must be under 8000 bytes")
+    print "34. Subscribers follow the standings from their events."
+
+
+def test_read_replicas():
+    """Test that reads go to the replicas, or to the primary when needed.
+
+    The replicas are only checked when TOURNAMENT_REPLICA_DSNS is set.
+    """
+    saved = dict((k, db.config[k]) for k in ('replicas', 'read_your_writes'))
+
+    def server():
+        with new_transaction(readonly=True) as cr:
+            cr.execute("""select pg_is_in_recovery(),
+                                 current_setting('application_name')""")
+            return cr.fetchone()
+
+    unreachable = "dbname=tournament host=/nonexistent"
+    try:
+        db.configure(replicas=[unreachable], read_your_writes=0)
+        if server()[0] or count_all_players() is None:
+            raise ValueError("Reads should go to the primary when no replica "
+                             "is up")
+        if saved['replicas']:
+            replica = saved['replicas'][0]
+            db.configure(replicas=[replica + " application_name=replica_a",
+                                   unreachable,
+                                   replica + " application_name=replica_b"],
+                         read_your_writes=0)
+            reads = [server() for _ in xrange(6)]
+            if not all(in_recovery for (in_recovery, name) in reads):
+                raise ValueError("Reads should go to the replicas that are up")
+            if (set(name for (in_recovery, name) in reads) !=
+                    set(["replica_a", "replica_b"])):
+                raise ValueError("Reads should go to every replica in turn")
+            cache.enable()
+            try:
+                if server()[0]:
+                    raise ValueError("Reads should go to the primary while "
+                                     "they are cached")
+            finally:
+                cache.disable()
+
+            db.configure(read_your_writes=60)
+            tid = register_tournament("Replicated contest")
+            if server()[0]:
+                raise ValueError("Reads right after a write should go to "
+                                 "the primary")
+            if tid not in [t[0] for t in list_tournaments()]:
+                raise ValueError("Reads should see the writes of the process")
+    finally:
+        db.configure(**saved)
+    print ("35. Reads go to the replicas in turn, or to the primary when "
+           "needed.")
+
+
+def test_speculative_pairing():
+    """Test that the next round is paired while the round is played."""
+    import time
+    import speculative
+    delete_all_matches()
+    delete_tournaments()
+    delete_all_players()
+
+    players = register_players(["Player %s" % i for i in xrange(9)])
+    tid = register_tournament("Speculative contest")
+    register_players_into_tournament(tid, players)
+
+    def report(boards):
+        for (pid1, pname1, pid2, pname2) in boards:
+            if pid2 is None:
+                report_bye(tid, pid1)
+            else:
+                report_match(tid, *random.sample([pid1, pid2], 2))
+
+    boards = swiss_pairings(tid)
+    pairer = speculative.SpeculativePairer(tid, boards, max_pending=2)
+    pairer.start()
+    try:
+        for _ in xrange(3):
+            # Four boards and a bye, the first two are left pending.
+            report(boards[2:])
+            deadline = time.time() + 5
+            while pairer.info()['candidates'] != 4:
+                if time.time() > deadline:
+                    raise ValueError("Every outcome of the pending boards "
+                                     "should be paired")
+                time.sleep(0.01)
+            report(boards[:2])
+            boards = pairer.next_round()
+            if boards != swiss_pairings(tid):
+                raise ValueError("Speculative pairings should be the same")
+        if pairer.info()['hits'] != 3:
+            raise ValueError("The next rounds should be looked up")
+
+        # Standings that no outcome gives are read from the database.
+        delete_matches(tid)
+        if pairer.next_round(timeout=0.2) != swiss_pairings(tid):
+            raise ValueError("Pairings should be read again after a reset")
+        if pairer.info()['misses'] != 1:
+            raise ValueError("A reset should not be looked up")
+    finally:
+        pairer.stop()
+    print "40. The next round is paired while the round is played."
+
+
 def test_standings(tournament_id, tournament_name, expected):
     standings = player_standings(tournament_id)
     for standing in standings:
@@ -443,9 +1442,8 @@ def test_standings(tournament_id, tournament_name, expected):
 
 
 def register_all_players_into(tournament):
-    all_players = list_players()
-    for (pid, name) in all_players:
-        register_player_into_tournament(tournament, pid)
+    register_players_into_tournament(
+        tournament, [pid for (pid, name) in list_players()])
 
 
 if __name__ == '__main__':
@@ -457,4 +1455,31 @@ if __name__ == '__main__':
     test_parings_using_points()
     test_multiple_tournaments()
     test_report_winner()
+    test_bulk_registration()
+    test_rebuild_standings()
+    test_pairings_with_odd_players()
+    test_pairings_avoid_rematches()
+    test_report_round()
+    test_paged_standings()
+    test_tiebreaks()
+    test_ratings()
+    test_round_history()
+    test_many_tournaments()
+    test_tied_opponents()
+    if BACKEND != 'memory':
+        test_read_cache()
+        test_metrics()
+        if matches_partitioned():
+            test_archive_tournament()
+        if db.config['prepare']:
+            test_prepared_statements()
+        test_live_standings()
+        test_read_replicas()
+        test_event_log()
+        test_speculative_pairing()
+    if BACKEND == 'postgres':
+        # Binary COPY doesn't work under green.py.
+        test_export_import()
+    if BACKEND == 'green':
+        test_concurrent_requests()
     print "Success!  All tests pass!"